@@ -3,7 +3,10 @@ from __future__ import annotations
 
 import ast
 import math
-from typing import Any, Dict, Set
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, FrozenSet, NamedTuple, Optional, Set, Union
 
 
 class FormulaError(ValueError):
@@ -110,10 +113,153 @@ def _eval(node: ast.AST, values: Dict[str, Any]) -> Any:
     raise FormulaError(f"Unsupported formula element: {type(node).__name__}")
 
 
+# ---------------------------------------------------------------------------
+# Compiled formulas
+# ---------------------------------------------------------------------------
+#
+# Formulas are parsed, validated and compiled into nested closures once per
+# expression text; _eval above stays the reference evaluator they match.
+
+_Closure = Callable[[Dict[str, Any]], Any]
+
+
+def _fail(message: str, parts: tuple[_Closure, ...] = ()) -> _Closure:
+    def fail(values: Dict[str, Any]) -> Any:
+        for part in parts: part(values)  # evaluated first, as _eval does
+        raise FormulaError(message)
+    return fail
+
+
+def _implementation(name: str, count: int) -> Optional[Callable[[list[Any]], Any]]:
+    """_call(name, args) for *count* arguments, or None when _call rejects them."""
+    if name == "ifelse":
+        return (lambda args: args[1] if _truthy(args[0]) else args[2]) if count == 3 else None
+    numeric = {
+        "percent": (lambda n: n[0] * n[1] / 100) if count == 2 else None,
+        "sum": sum,
+        "avg": lambda n: sum(n) / len(n) if n else 0,
+        "min": lambda n: min(n) if n else 0,
+        "max": lambda n: max(n) if n else 0,
+        "round": (lambda n: round(n[0], int(n[1]) if len(n) == 2 else 0)) if 1 <= count <= 2 else None,
+        "abs": (lambda n: abs(n[0])) if count == 1 else None,
+        "floor": (lambda n: math.floor(n[0])) if count == 1 else None,
+        "ceil": (lambda n: math.ceil(n[0])) if count == 1 else None,
+        "clamp": (lambda n: min(max(n[0], n[1]), n[2])) if count == 3 else None,
+    }[name]
+    return None if numeric is None else lambda args: numeric([_number(value) for value in args])
+
+
+_BINARY = {
+    ast.Add: lambda left, right: left + right,
+    ast.Sub: lambda left, right: left - right,
+    ast.Mult: lambda left, right: left * right,
+    ast.Div: lambda left, right: 0 if right == 0 else left / right,
+    ast.Mod: lambda left, right: 0 if right == 0 else left % right,
+    ast.Pow: lambda left, right: left ** right,
+}
+_COMPARE = {
+    ast.Eq: lambda left, right: str(left) == str(right),
+    ast.NotEq: lambda left, right: str(left) != str(right),
+    ast.Gt: lambda left, right: _number(left) > _number(right),
+    ast.GtE: lambda left, right: _number(left) >= _number(right),
+    ast.Lt: lambda left, right: _number(left) < _number(right),
+    ast.LtE: lambda left, right: _number(left) <= _number(right),
+}
+
+
+def _compile(node: ast.AST) -> _Closure:
+    """A closure computing _eval(node, values)."""
+    if isinstance(node, ast.Expression): return _compile(node.body)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float, str, bool)):
+        constant = node.value
+        return lambda values: constant
+    if isinstance(node, ast.Name):
+        name = node.id
+        if name in _CONSTANTS:
+            constant = _CONSTANTS[name]
+            return lambda values: constant
+        return lambda values: values.get(name, 0)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.UAdd, ast.USub, ast.Not)):
+        operand = _compile(node.operand)
+        if isinstance(node.op, ast.Not): return lambda values: not _truthy(operand(values))
+        if isinstance(node.op, ast.UAdd): return lambda values: _number(operand(values))
+        return lambda values: -_number(operand(values))
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY:
+        left, right, apply = _compile(node.left), _compile(node.right), _BINARY[type(node.op)]
+        return lambda values: apply(_number(left(values)), _number(right(values)))
+    if isinstance(node, ast.Compare):
+        first = _compile(node.left)
+        steps = [(_COMPARE[type(operator)], _compile(comparator)) for operator, comparator in zip(node.ops, node.comparators)]
+
+        def compare(values: Dict[str, Any]) -> bool:
+            left = first(values)
+            for test, comparator in steps:
+                right = comparator(values)
+                if not test(left, right): return False
+                left = right
+            return True
+        return compare
+    if isinstance(node, ast.BoolOp) and isinstance(node.op, (ast.And, ast.Or)):
+        parts, combine = [_compile(value) for value in node.values], all if isinstance(node.op, ast.And) else any
+        return lambda values: combine([_truthy(part(values)) for part in parts])
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in _FUNCTIONS and not node.keywords:
+        args = [_compile(arg) for arg in node.args]
+        implementation = _implementation(node.func.id, len(args))
+        if implementation is None: return _fail(f"Unknown function or wrong arguments: {node.func.id}", tuple(args))
+        return lambda values: implementation([arg(values) for arg in args])
+    return _fail(f"Unsupported formula element: {type(node).__name__}")
+
+
+class _Formula(NamedTuple):
+    evaluate: _Closure
+    dependencies: FrozenSet[str]
+
+
+FORMULA_CACHE_SIZE = int(os.getenv("FORMULA_CACHE_SIZE", "1024"))
+
+_formula_cache: "OrderedDict[str, Union[_Formula, FormulaError]]" = OrderedDict()
+_formula_cache_lock = threading.Lock()
+_formula_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def _compiled(expression: str) -> _Formula:
+    """The parsed, validated and compiled formula, from a bounded LRU keyed by its text."""
+    if not isinstance(expression, str): raise FormulaError("Formula cannot be empty")
+    with _formula_cache_lock:
+        cached = _formula_cache.get(expression)
+        if cached is not None:
+            _formula_cache.move_to_end(expression)
+            _formula_cache_stats["hits"] += 1
+        else:
+            _formula_cache_stats["misses"] += 1
+    if cached is None:
+        try:
+            tree = _parse(expression)
+            # A function name is only a function in call position: a bare "sum" reads the value "sum".
+            calls = {id(node.func) for node in ast.walk(tree) if isinstance(node, ast.Call)}
+            cached = _Formula(_compile(tree), frozenset(
+                node.id for node in ast.walk(tree)
+                if isinstance(node, ast.Name) and id(node) not in calls and node.id not in _CONSTANTS
+            ))
+        except FormulaError as exc:
+            cached = exc  # invalid formulas are remembered too
+        with _formula_cache_lock:
+            _formula_cache[expression] = cached
+            while len(_formula_cache) > FORMULA_CACHE_SIZE:
+                _formula_cache.popitem(last=False)
+                _formula_cache_stats["evictions"] += 1
+    if isinstance(cached, FormulaError): raise FormulaError(str(cached))
+    return cached
+
+
+def formula_cache_stats() -> Dict[str, int]:
+    with _formula_cache_lock:
+        return {**_formula_cache_stats, "size": len(_formula_cache), "max_size": FORMULA_CACHE_SIZE}
+
+
 def evaluate_formula(expression: str, values: Dict[str, Any]) -> Any:
-    return _format(_eval(_parse(expression), values))
+    return _format(_compiled(expression).evaluate(values))
 
 
 def formula_dependencies(expression: str) -> Set[str]:
-    tree = _parse(expression)
-    return {node.id for node in ast.walk(tree) if isinstance(node, ast.Name) and node.id not in _FUNCTIONS | _CONSTANTS.keys()}
+    return set(_compiled(expression).dependencies)
@@ -1,6 +1,10 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List, Tuple
+import functools
+import operator
+import re
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
 
 
 Number = int | float
@@ -128,42 +132,44 @@ def _apply_logic_rules(form_data: Dict[str, Any], mapping: Dict[str, Any]) -> Di
 
     # deterministic order: iterate mapping in insertion order
     for _, rule in mapping.items():
-        if not isinstance(rule, dict):
-            continue
+        if isinstance(rule, dict):
+            _apply_logic_rule(rule, state, variables)
 
-        rtype = str(rule.get("type", "")).lower()
+    return state
 
-        if rtype == "set_var":
-            name = rule.get("name")
-            source = str(rule.get("from", ""))
-            if not name or not source:
-                continue
-            variables[str(name)] = _read_input_value(source, state, variables)
-            continue
 
-        if rtype == "math":
-            output_key = rule.get("output_key")
-            if not output_key:
-                continue
-            result = _evaluate_math_rule(rule, state, variables)
-            state[str(output_key)] = result
-            if rule.get("var_name"):
-                variables[str(rule["var_name"])] = result
-            continue
-
-        if rtype == "if":
-            output_key = rule.get("output_key")
-            if not output_key:
-                continue
-            passed = _evaluate_condition(rule, state, variables)
-            true_val = rule.get("true")
-            false_val = rule.get("false", "")
-            chosen = true_val if passed else false_val
-            if isinstance(chosen, str) and chosen.startswith("var:"):
-                chosen = variables.get(chosen.split(":", 1)[1], "")
-            state[str(output_key)] = chosen
-
-    return state
+def _apply_logic_rule(rule: Dict[str, Any], state: Dict[str, Any], variables: Dict[str, Any]) -> None:
+    rtype = str(rule.get("type", "")).lower()
+
+    if rtype == "set_var":
+        name = rule.get("name")
+        source = str(rule.get("from", ""))
+        if not name or not source:
+            return
+        variables[str(name)] = _read_input_value(source, state, variables)
+        return
+
+    if rtype == "math":
+        output_key = rule.get("output_key")
+        if not output_key:
+            return
+        result = _evaluate_math_rule(rule, state, variables)
+        state[str(output_key)] = result
+        if rule.get("var_name"):
+            variables[str(rule["var_name"])] = result
+        return
+
+    if rtype == "if":
+        output_key = rule.get("output_key")
+        if not output_key:
+            return
+        passed = _evaluate_condition(rule, state, variables)
+        true_val = rule.get("true")
+        false_val = rule.get("false", "")
+        chosen = true_val if passed else false_val
+        if isinstance(chosen, str) and chosen.startswith("var:"):
+            chosen = variables.get(chosen.split(":", 1)[1], "")
+        state[str(output_key)] = chosen
 
 
 def build_pdf_field_values(form_data: Dict[str, Any], mapping: Dict[str, Any]) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
@@ -180,207 +186,795 @@ def build_pdf_field_values(form_data: Dict[str, Any], mapping: Dict[str, Any]) -
     sig_overlays: List[Dict[str, Any]] = []
 
     for key, rule in mapping.items():
-        if key not in state:
-            continue
+        if key in state:
+            _apply_output_rule(rule, state.get(key), out, sig_overlays)
 
-        value = state.get(key)
+    return out, sig_overlays
 
-        # Guard: never write data URIs as text into PDF fields
-        raw_str = "" if value is None else str(value)
-        is_data_image = raw_str.startswith("data:image")
 
-        if isinstance(rule, str):
-            if is_data_image:
-                out[rule] = ""
+def _apply_output_rule(rule: Any, value: Any, out: Dict[str, Any], sig_overlays: List[Dict[str, Any]]) -> None:
+    """Write the PDF field values and overlays for one mapping entry."""
+    # Guard: never write data URIs as text into PDF fields
+    raw_str = "" if value is None else str(value)
+    is_data_image = raw_str.startswith("data:image")
+
+    if isinstance(rule, str):
+        if is_data_image:
+            out[rule] = ""
+            sig_overlays.append({
+                "value": raw_str,
+                "page": 0,
+                "rect": [0, 0, 200, 50],
+                "field": rule,
+            })
+        else:
+            out[rule] = raw_str
+        return
+
+    if isinstance(rule, list):
+        if is_data_image:
+            for field_name in rule:
+                out[field_name] = ""
+            sig_overlays.append({
+                "value": raw_str,
+                "page": 0,
+                "rect": [0, 0, 200, 50],
+                "field": rule[0] if rule else "",
+            })
+        else:
+            for field_name in rule:
+                out[field_name] = raw_str
+        return
+
+    if not isinstance(rule, dict):
+        return
+
+    rtype = rule.get("type", "text")
+
+    if rtype in {"math", "set_var", "if"}:
+        return
+
+    if rtype == "checkbox":
+        field = rule["field"]
+        checked = rule.get("checked_value", "/Yes")
+        unchecked = rule.get("unchecked_value", "/Off")
+        out[field] = checked if bool(value) else unchecked
+
+    elif rtype == "radio":
+        field = rule["field"]
+        value_map = rule.get("value_map", {})
+        out[field] = value_map.get(value, value)
+
+    elif rtype == "radio_group":
+        choices = rule.get("choices") or []
+        off_value = rule.get("off_value", "/Off")
+        for ch in choices:
+            fld = ch.get("field")
+            if fld:
+                out[fld] = off_value
+
+        selected = "" if value is None else str(value)
+        for ch in choices:
+            if ch.get("value") == selected:
+                fld = ch.get("field")
+                onv = ch.get("export_on", "/1")
+                if fld:
+                    out[fld] = onv
+                break
+
+    elif rtype == "split":
+        raw = "" if value is None else str(value)
+        digits = "".join(ch for ch in raw if ch.isdigit())
+        fields = rule.get("fields") or []
+        pattern = rule.get("pattern") or []
+
+        if fields and pattern and len(fields) == len(pattern):
+            pos = 0
+            for field_name, length in zip(fields, pattern):
+                out[field_name] = digits[pos:pos + length]
+                pos += length
+
+    elif rtype == "date_split":
+        # Parse MM/DD/YYYY or M/D/YYYY and split into separate fields
+        import re
+        raw = "" if value is None else str(value).strip()
+        fields_map = rule.get("fields") or {}
+        m = re.match(r"(\d{1,2})[/\-](\d{1,2})[/\-](\d{2,4})", raw)
+        if m:
+            if "mm" in fields_map:
+                out[fields_map["mm"]] = m.group(1)
+            if "dd" in fields_map:
+                out[fields_map["dd"]] = m.group(2)
+            if "yyyy" in fields_map:
+                out[fields_map["yyyy"]] = m.group(3)
+
+    elif rtype == "spread":
+        raw = "" if value is None else str(value)
+        separator = rule.get("separator", ",")
+        fields = rule.get("fields") or []
+        parts = [p.strip() for p in raw.split(separator) if p.strip()]
+        for i, field_name in enumerate(fields):
+            if i < len(parts):
+                out[field_name] = parts[i]
+
+    elif rtype == "value_to_checkboxes":
+        all_fields = rule.get("all_fields") or []
+        off_value = rule.get("off_value", "/Off")
+        value_mapping = rule.get("mapping") or {}
+        for fld in all_fields:
+            out[fld] = off_value
+
+        selected = "" if value is None else str(value)
+        field_states = value_mapping.get(selected, {})
+        for fld, val in field_states.items():
+            out[fld] = val
+
+    elif rtype == "signature":
+        field = rule.get("field")
+        raw = "" if value is None else str(value)
+        is_image = raw.startswith("data:image")
+
+        if is_image:
+            if field:
+                out[field] = ""
+            sig_overlays.append({
+                "value": raw,
+                "page": rule.get("page", 0),
+                "rect": rule.get("rect", [0, 0, 200, 50]),
+                "field": field or "",
+            })
+        else:
+            if field:
+                out[field] = raw
+            elif raw.strip():
+                # No PDF form field — render typed name as text overlay
                 sig_overlays.append({
-                    "value": raw_str,
-                    "page": 0,
-                    "rect": [0, 0, 200, 50],
-                    "field": rule,
+                    "value": raw.strip(),
+                    "page": rule.get("page", 0),
+                    "rect": rule.get("rect", [0, 0, 200, 50]),
+                    "field": "",
+                    "text_mode": True,
+                    "font_size": rule.get("font_size"),
                 })
-            else:
-                out[rule] = raw_str
-            continue
 
-        if isinstance(rule, list):
-            if is_data_image:
-                for field_name in rule:
-                    out[field_name] = ""
+    elif rtype == "text_overlay":
+        # Overlay text at specific coordinates on a PDF page (no AcroForm field needed)
+        raw = "" if value is None else str(value).strip()
+        if raw:
+            sig_overlays.append({
+                "value": raw,
+                "page": rule.get("page", 0),
+                "rect": rule.get("rect", [0, 0, 200, 20]),
+                "field": "",
+                "text_mode": True,
+                "font_size": rule.get("font_size"),
+                "font": rule.get("font", "Helvetica"),
+                "align": rule.get("align", "L"),
+            })
+
+    elif rtype == "tin_split":
+        raw = "" if value is None else str(value)
+        digits = "".join(ch for ch in raw if ch.isdigit())
+
+        ssn = rule.get("ssn") or []
+        ein = rule.get("ein") or []
+        prefer = rule.get("prefer", "auto")
+
+        if len(digits) != 9:
+            if len(ssn) >= 1:
+                out[ssn[0]] = digits
+            elif len(ein) >= 1:
+                out[ein[0]] = digits
+            return
+
+        if prefer in ("auto", "ssn") and len(ssn) >= 3:
+            out[ssn[0]] = digits[0:3]
+            out[ssn[1]] = digits[3:5]
+            out[ssn[2]] = digits[5:9]
+
+        if prefer in ("auto", "ein") and len(ein) >= 2:
+            out[ein[0]] = digits[0:2]
+            out[ein[1]] = digits[2:9]
+
+    else:
+        field = rule.get("field")
+        if field:
+            raw = "" if value is None else str(value)
+            # Never write data URIs as text — auto-detect as signature overlay
+            if raw.startswith("data:image"):
+                out[field] = ""
                 sig_overlays.append({
-                    "value": raw_str,
-                    "page": 0,
-                    "rect": [0, 0, 200, 50],
-                    "field": rule[0] if rule else "",
+                    "value": raw,
+                    "page": rule.get("page", 0),
+                    "rect": rule.get("rect", [0, 0, 200, 50]),
+                    "field": field,
                 })
             else:
-                for field_name in rule:
-                    out[field_name] = raw_str
-            continue
+                out[field] = value
+
+
+# ---------------------------------------------------------------------------
+# Compiled plans
+# ---------------------------------------------------------------------------
+
+_DATE_PARTS = re.compile(r"(\d{1,2})[/\-](\d{1,2})[/\-](\d{2,4})")
+_NUMERIC_COMPARISONS = {"gt": operator.gt, "gte": operator.ge, "lt": operator.lt, "lte": operator.le}
+
+_Reader = Callable[[Dict[str, Any], Dict[str, Any]], Any]
+# What a logic rule reads or writes: ("key", form key) or ("var", variable name).
+_Name = Tuple[str, str]
+_LogicStep = Callable[[Dict[str, Any], Dict[str, Any]], None]
+_OutputStep = Callable[[Any, Dict[str, Any], List[Dict[str, Any]]], None]
+
+
+def _digits(raw: str) -> str:
+    return "".join(filter(str.isdigit, raw))
+
+
+def _compile_reader(input_name: str) -> _Reader:
+    if input_name.startswith("var:"):
+        name = input_name.split(":", 1)[1]
+        return lambda state, variables: variables.get(name)
+    return lambda state, variables: state.get(input_name)
+
+
+def _compile_math(rule: Dict[str, Any]) -> Callable[[Dict[str, Any], Dict[str, Any]], str]:
+    operation = str(rule.get("operation", "add")).lower()
+    source_keys = rule.get("inputs") or []
+    readers = [_compile_reader(str(k)) for k in source_keys] if isinstance(source_keys, list) else []
+
+    combine: Callable[[List[Number]], Number]
+    if operation == "multiply":
+        factor = _to_number(rule.get("factor", 1))
+        combine = lambda values: (values[0] if values else 0) * factor  # noqa: E731
+    elif operation == "subtract":
+        combine = lambda values: functools.reduce(operator.sub, values) if values else 0  # noqa: E731
+    elif operation in {"divide", "pow", "mod"}:
+        operand = _to_number(rule.get({"divide": "divisor", "pow": "exp", "mod": "mod"}[operation], 1))
+        apply = {"divide": operator.truediv, "pow": operator.pow, "mod": operator.mod}[operation]
+        guarded = operation != "pow"  # x / 0 and x % 0 give 0
+
+        def binary(values: List[Number]) -> Number:
+            left = values[0] if values else 0
+            right = values[1] if len(values) > 1 else operand
+            return 0 if guarded and right == 0 else apply(left, right)
+        combine = binary
+    elif operation in {"min", "max"}:
+        pick = min if operation == "min" else max
+        combine = lambda values: pick(values) if values else 0  # noqa: E731
+    elif operation == "avg":
+        combine = lambda values: (sum(values) / len(values)) if values else 0  # noqa: E731
+    elif operation == "round":
+        precision = int(_to_number(rule.get("precision", 0)))
+        combine = lambda values: round(values[0] if values else 0, precision)  # noqa: E731
+    else:  # add, sum and anything unknown
+        combine = sum
+
+    return lambda state, variables: _number_to_str(combine([_to_number(read(state, variables)) for read in readers]))
+
+
+def _compile_condition(rule: Dict[str, Any]) -> Callable[[Dict[str, Any], Dict[str, Any]], bool]:
+    left = _compile_reader(str(rule.get("left", "")))
+    right = _compile_reader(str(rule.get("right", "")))
+    op = str(rule.get("op", "eq")).lower()
+    if op in _NUMERIC_COMPARISONS:
+        compare = _NUMERIC_COMPARISONS[op]
+        return lambda state, variables: compare(_to_number(left(state, variables)), _to_number(right(state, variables)))
+    compare = operator.ne if op == "neq" else operator.eq
+    text = lambda raw: "" if raw is None else str(raw)  # noqa: E731
+    return lambda state, variables: compare(text(left(state, variables)), text(right(state, variables)))
+
+
+def _compile_choice(value: Any) -> Callable[[Dict[str, Any]], Any]:
+    if isinstance(value, str) and value.startswith("var:"):
+        name = value.split(":", 1)[1]
+        return lambda variables: variables.get(name, "")
+    return lambda variables: value
+
+
+def _compile_logic_rule(rule: Dict[str, Any]) -> Optional[_LogicStep]:
+    rtype = str(rule.get("type", "")).lower()
+
+    if rtype == "set_var":
+        name = rule.get("name")
+        source = str(rule.get("from", ""))
+        if not name or not source:
+            return None
+        name, read = str(name), _compile_reader(source)
+
+        def set_var(state: Dict[str, Any], variables: Dict[str, Any]) -> None:
+            variables[name] = read(state, variables)
+        return set_var
+
+    if rtype not in {"math", "if"} or not rule.get("output_key"):
+        return None
+    output_key = str(rule["output_key"])
+
+    if rtype == "math":
+        evaluate = _compile_math(rule)
+        var_name = str(rule["var_name"]) if rule.get("var_name") else None
+
+        def math(state: Dict[str, Any], variables: Dict[str, Any]) -> None:
+            result = state[output_key] = evaluate(state, variables)
+            if var_name is not None:
+                variables[var_name] = result
+        return math
+
+    passed = _compile_condition(rule)
+    when_true, when_false = _compile_choice(rule.get("true")), _compile_choice(rule.get("false", ""))
+
+    def condition(state: Dict[str, Any], variables: Dict[str, Any]) -> None:
+        state[output_key] = (when_true if passed(state, variables) else when_false)(variables)
+    return condition
+
+
+def _input_name(input_name: str) -> _Name:
+    if input_name.startswith("var:"):
+        return ("var", input_name.split(":", 1)[1])
+    return ("key", input_name)
+
+
+def _logic_names(rule: Dict[str, Any]) -> Optional[Tuple[List[_Name], List[_Name]]]:
+    """(reads, writes) of a logic rule, or None when it does nothing; mirrors _compile_logic_rule."""
+    rtype = str(rule.get("type", "")).lower()
+    if rtype == "set_var":
+        name, source = rule.get("name"), str(rule.get("from", ""))
+        return ([_input_name(source)], [("var", str(name))]) if name and source else None
+    if rtype not in {"math", "if"} or not rule.get("output_key"):
+        return None
+    writes = [("key", str(rule["output_key"]))]
+    if rtype == "math":
+        source_keys = rule.get("inputs") or []
+        reads = [_input_name(str(k)) for k in source_keys] if isinstance(source_keys, list) else []
+        if rule.get("var_name"):
+            writes.append(("var", str(rule["var_name"])))
+        return reads, writes
+    reads = [_input_name(str(rule.get("left", ""))), _input_name(str(rule.get("right", "")))]
+    for chosen in (rule.get("true"), rule.get("false", "")):
+        if isinstance(chosen, str) and chosen.startswith("var:"):
+            reads.append(_input_name(chosen))
+    return reads, writes
+
+
+def _display_name(name: _Name) -> str:
+    return f"var:{name[1]}" if name[0] == "var" else name[1]
+
+
+def logic_rule_errors(mapping: Dict[str, Any]) -> List[str]:
+    """
+    Cycles among the math / set_var / if rules of *mapping*, for save-time validation.
+
+    Rules run in mapping order, and a read resolves like it does in
+    compile_mapping: to the last earlier rule writing that name. A rule that
+    reads an output only later rules compute sees the submitted value (or no
+    variable) instead. When such a later rule in turn depends on the first
+    one, the rules feed each other and no order gives the result the author
+    meant. Rewriting a name that an earlier rule wrote (a running total, a
+    reassigned variable) and reading the key a rule writes itself
+    (``amount = round(amount)``) are not cycles.
+    """
+    rules: Dict[str, Tuple[List[_Name], List[_Name]]] = {}
+    for key, rule in mapping.items():
+        names = _logic_names(rule) if isinstance(rule, dict) else None
+        if names:
+            rules[key] = names
+    # Writers of each name not yet passed by the loop below, in mapping order.
+    later_writers: Dict[_Name, List[str]] = {}
+    for key, (_, writes) in rules.items():
+        for name in writes:
+            later_writers.setdefault(name, []).append(key)
+
+    feeds: Dict[str, List[str]] = {key: [] for key in rules}
+    last_writer: Dict[_Name, str] = {}
+    for key, (reads, writes) in rules.items():
+        for name in writes:
+            later_writers[name].remove(key)
+        for name in dict.fromkeys(reads):
+            earlier = last_writer.get(name)
+            for writer in [earlier] if earlier is not None else later_writers.get(name, []):
+                if key not in feeds[writer]:
+                    feeds[writer].append(key)
+        for name in writes:
+            last_writer[name] = key
+
+    errors: List[str] = []
+    done: Set[str] = set()
+    path: List[str] = []
+
+    def visit(key: str) -> None:
+        if key in path:
+            cycle = path[path.index(key):] + [key]
+            errors.append("Logic rules " + " -> ".join(f"'{step}'" for step in cycle) + " depend on each other")
+            return
+        if key in done:
+            return
+        path.append(key)
+        for reader in feeds[key]:
+            visit(reader)
+        path.pop()
+        done.add(key)
+
+    for key in rules:
+        visit(key)
+    return errors
+
+
+def _image_overlay(raw: str, page: Any, rect: Callable[[], Any], field: Any) -> Dict[str, Any]:
+    return {"value": raw, "page": page, "rect": rect(), "field": field}
+
+
+def _compile_rect(rule: Dict[str, Any], default: List[float]) -> Callable[[], Any]:
+    """The rule's own rect, or a fresh copy of *default* per overlay (callers may mutate it)."""
+    if "rect" in rule:
+        rect = rule["rect"]
+        return lambda: rect
+    return lambda: list(default)
+
+
+def _compile_fields(fields: List[Any], overlay_field: Any) -> _OutputStep:
+    """Direct string or list mapping: the text in every field, or the image as an overlay."""
+    default_rect = functools.partial(list, (0, 0, 200, 50))
+
+    def direct(value: Any, out: Dict[str, Any], overlays: List[Dict[str, Any]]) -> None:
+        raw = "" if value is None else str(value)
+        if raw.startswith("data:image"):
+            text = ""
+            overlays.append(_image_overlay(raw, 0, default_rect, overlay_field))
+        else:
+            text = raw
+        for field_name in fields:
+            out[field_name] = text
+    return direct
+
+
+def _compile_output_rule(rule: Any) -> Optional[_OutputStep]:
+    """One mapping entry as a closure over everything that does not depend on the value."""
+    if isinstance(rule, str):
+        return _compile_fields([rule], rule)
+    if isinstance(rule, list):
+        return _compile_fields(list(rule), rule[0] if rule else "")
+    if not isinstance(rule, dict):
+        return None
 
-        if not isinstance(rule, dict):
-            continue
+    rtype = rule.get("type", "text")
+    if rtype in {"math", "set_var", "if"}:
+        return None
 
-        rtype = rule.get("type", "text")
+    if rtype == "checkbox":
+        field, checked, unchecked = rule["field"], rule.get("checked_value", "/Yes"), rule.get("unchecked_value", "/Off")
 
-        if rtype in {"math", "set_var", "if"}:
-            continue
+        def checkbox(value: Any, out: Dict[str, Any], overlays: List[Dict[str, Any]]) -> None:
+            out[field] = checked if value else unchecked
+        return checkbox
 
-        if rtype == "checkbox":
-            field = rule["field"]
-            checked = rule.get("checked_value", "/Yes")
-            unchecked = rule.get("unchecked_value", "/Off")
-            out[field] = checked if bool(value) else unchecked
+    if rtype == "radio":
+        field, value_map = rule["field"], rule.get("value_map", {})
 
-        elif rtype == "radio":
-            field = rule["field"]
-            value_map = rule.get("value_map", {})
+        def radio(value: Any, out: Dict[str, Any], overlays: List[Dict[str, Any]]) -> None:
             out[field] = value_map.get(value, value)
+        return radio
 
-        elif rtype == "radio_group":
+    if rtype in {"radio_group", "value_to_checkboxes"}:
+        off_value = rule.get("off_value", "/Off")
+        if rtype == "radio_group":
             choices = rule.get("choices") or []
-            off_value = rule.get("off_value", "/Off")
+            cleared = {ch.get("field"): off_value for ch in choices if ch.get("field")}
+            selections: Dict[str, Dict[Any, Any]] = {}
             for ch in choices:
-                fld = ch.get("field")
-                if fld:
-                    out[fld] = off_value
-
-            selected = "" if value is None else str(value)
-            for ch in choices:
-                if ch.get("value") == selected:
+                selected = ch.get("value")
+                if isinstance(selected, str) and selected not in selections:
                     fld = ch.get("field")
-                    onv = ch.get("export_on", "/1")
-                    if fld:
-                        out[fld] = onv
-                    break
-
-        elif rtype == "split":
-            raw = "" if value is None else str(value)
-            digits = "".join(ch for ch in raw if ch.isdigit())
-            fields = rule.get("fields") or []
-            pattern = rule.get("pattern") or []
-
-            if fields and pattern and len(fields) == len(pattern):
-                pos = 0
-                for field_name, length in zip(fields, pattern):
-                    out[field_name] = digits[pos:pos + length]
-                    pos += length
-
-        elif rtype == "date_split":
-            # Parse MM/DD/YYYY or M/D/YYYY and split into separate fields
-            import re
-            raw = "" if value is None else str(value).strip()
-            fields_map = rule.get("fields") or {}
-            m = re.match(r"(\d{1,2})[/\-](\d{1,2})[/\-](\d{2,4})", raw)
+                    selections[selected] = {fld: ch.get("export_on", "/1")} if fld else {}
+        else:
+            cleared = {fld: off_value for fld in rule.get("all_fields") or []}
+            value_mapping = rule.get("mapping") or {}
+            if not isinstance(value_mapping, dict) or not all(isinstance(v, dict) for v in value_mapping.values()):
+                raise TypeError("value_to_checkboxes mapping must map values to {field: state}")
+            selections = {selected: states for selected, states in value_mapping.items() if isinstance(selected, str)}
+        # Every field switched off, then the selected ones on: one update per render.
+        tables = {selected: {**cleared, **states} for selected, states in selections.items()}
+
+        def choose(value: Any, out: Dict[str, Any], overlays: List[Dict[str, Any]]) -> None:
+            out.update(tables.get("" if value is None else str(value), cleared))
+        return choose
+
+    if rtype == "split":
+        fields, pattern = rule.get("fields") or [], rule.get("pattern") or []
+        slices, pos = [], 0
+        if fields and pattern and len(fields) == len(pattern):
+            for field_name, length in zip(fields, pattern):
+                slices.append((field_name, pos, pos + length))
+                pos += length
+
+        def split(value: Any, out: Dict[str, Any], overlays: List[Dict[str, Any]]) -> None:
+            digits = _digits("" if value is None else str(value))
+            for field_name, start, end in slices:
+                out[field_name] = digits[start:end]
+        return split
+
+    if rtype == "date_split":
+        fields_map = rule.get("fields") or {}
+        if not isinstance(fields_map, dict):
+            raise TypeError("date_split fields must be a {part: field} object")
+        groups = [(fields_map[part], group) for group, part in enumerate(("mm", "dd", "yyyy"), start=1) if part in fields_map]
+
+        def date_split(value: Any, out: Dict[str, Any], overlays: List[Dict[str, Any]]) -> None:
+            m = _DATE_PARTS.match("" if value is None else str(value).strip())
             if m:
-                if "mm" in fields_map:
-                    out[fields_map["mm"]] = m.group(1)
-                if "dd" in fields_map:
-                    out[fields_map["dd"]] = m.group(2)
-                if "yyyy" in fields_map:
-                    out[fields_map["yyyy"]] = m.group(3)
-
-        elif rtype == "spread":
+                for field_name, group in groups:
+                    out[field_name] = m.group(group)
+        return date_split
+
+    if rtype == "spread":
+        separator, fields = rule.get("separator", ","), list(rule.get("fields") or [])
+
+        def spread(value: Any, out: Dict[str, Any], overlays: List[Dict[str, Any]]) -> None:
             raw = "" if value is None else str(value)
-            separator = rule.get("separator", ",")
-            fields = rule.get("fields") or []
             parts = [p.strip() for p in raw.split(separator) if p.strip()]
-            for i, field_name in enumerate(fields):
-                if i < len(parts):
-                    out[field_name] = parts[i]
-
-        elif rtype == "value_to_checkboxes":
-            all_fields = rule.get("all_fields") or []
-            off_value = rule.get("off_value", "/Off")
-            value_mapping = rule.get("mapping") or {}
-            for fld in all_fields:
-                out[fld] = off_value
+            for field_name, part in zip(fields, parts):
+                out[field_name] = part
+        return spread
 
-            selected = "" if value is None else str(value)
-            field_states = value_mapping.get(selected, {})
-            for fld, val in field_states.items():
-                out[fld] = val
+    if rtype == "signature":
+        field, page, rect = rule.get("field"), rule.get("page", 0), _compile_rect(rule, [0, 0, 200, 50])
+        font_size = rule.get("font_size")
 
-        elif rtype == "signature":
-            field = rule.get("field")
+        def signature(value: Any, out: Dict[str, Any], overlays: List[Dict[str, Any]]) -> None:
             raw = "" if value is None else str(value)
-            is_image = raw.startswith("data:image")
-
-            if is_image:
+            if raw.startswith("data:image"):
                 if field:
                     out[field] = ""
-                sig_overlays.append({
-                    "value": raw,
-                    "page": rule.get("page", 0),
-                    "rect": rule.get("rect", [0, 0, 200, 50]),
-                    "field": field or "",
+                overlays.append(_image_overlay(raw, page, rect, field or ""))
+            elif field:
+                out[field] = raw
+            elif raw.strip():
+                # No PDF form field — render typed name as text overlay
+                overlays.append({
+                    "value": raw.strip(), "page": page, "rect": rect(), "field": "",
+                    "text_mode": True, "font_size": font_size,
                 })
-            else:
-                if field:
-                    out[field] = raw
-                elif raw.strip():
-                    # No PDF form field — render typed name as text overlay
-                    sig_overlays.append({
-                        "value": raw.strip(),
-                        "page": rule.get("page", 0),
-                        "rect": rule.get("rect", [0, 0, 200, 50]),
-                        "field": "",
-                        "text_mode": True,
-                        "font_size": rule.get("font_size"),
-                    })
-
-        elif rtype == "text_overlay":
-            # Overlay text at specific coordinates on a PDF page (no AcroForm field needed)
+        return signature
+
+    if rtype == "text_overlay":
+        page, rect, font_size = rule.get("page", 0), _compile_rect(rule, [0, 0, 200, 20]), rule.get("font_size")
+        font, align = rule.get("font", "Helvetica"), rule.get("align", "L")
+
+        def text_overlay(value: Any, out: Dict[str, Any], overlays: List[Dict[str, Any]]) -> None:
             raw = "" if value is None else str(value).strip()
             if raw:
-                sig_overlays.append({
-                    "value": raw,
-                    "page": rule.get("page", 0),
-                    "rect": rule.get("rect", [0, 0, 200, 20]),
-                    "field": "",
-                    "text_mode": True,
-                    "font_size": rule.get("font_size"),
-                    "font": rule.get("font", "Helvetica"),
-                    "align": rule.get("align", "L"),
+                overlays.append({
+                    "value": raw, "page": page, "rect": rect(), "field": "",
+                    "text_mode": True, "font_size": font_size, "font": font, "align": align,
                 })
+        return text_overlay
 
-        elif rtype == "tin_split":
-            raw = "" if value is None else str(value)
-            digits = "".join(ch for ch in raw if ch.isdigit())
-
-            ssn = rule.get("ssn") or []
-            ein = rule.get("ein") or []
-            prefer = rule.get("prefer", "auto")
+    if rtype == "tin_split":
+        ssn, ein, prefer = rule.get("ssn") or [], rule.get("ein") or [], rule.get("prefer", "auto")
+        partial_field = ssn[0] if len(ssn) >= 1 else ein[0] if len(ein) >= 1 else None
+        ssn_fields = tuple(ssn[:3]) if prefer in ("auto", "ssn") and len(ssn) >= 3 else None
+        ein_fields = tuple(ein[:2]) if prefer in ("auto", "ein") and len(ein) >= 2 else None
 
+        def tin_split(value: Any, out: Dict[str, Any], overlays: List[Dict[str, Any]]) -> None:
+            digits = _digits("" if value is None else str(value))
             if len(digits) != 9:
-                if len(ssn) >= 1:
-                    out[ssn[0]] = digits
-                elif len(ein) >= 1:
-                    out[ein[0]] = digits
-                continue
+                if partial_field is not None:
+                    out[partial_field] = digits
+                return
+            if ssn_fields is not None:
+                out[ssn_fields[0]], out[ssn_fields[1]], out[ssn_fields[2]] = digits[0:3], digits[3:5], digits[5:9]
+            if ein_fields is not None:
+                out[ein_fields[0]], out[ein_fields[1]] = digits[0:2], digits[2:9]
+        return tin_split
+
+    field = rule.get("field")
+    if not field:
+        return None
+    page, rect = rule.get("page", 0), _compile_rect(rule, [0, 0, 200, 50])
+
+    def text(value: Any, out: Dict[str, Any], overlays: List[Dict[str, Any]]) -> None:
+        raw = "" if value is None else str(value)
+        # Never write data URIs as text — auto-detect as signature overlay
+        if raw.startswith("data:image"):
+            out[field] = ""
+            overlays.append(_image_overlay(raw, page, rect, field))
+        else:
+            out[field] = value
+    return text
+
+
+@dataclass
+class LogicResult:
+    """The logic rules evaluated for one set of form data; see MappingPlan.run_logic."""
+
+    inputs: Dict[str, Any]  # the form data, not copied: do not change it afterwards
+    state: Dict[str, Any]  # form data with the rule outputs applied
+    variables: Dict[str, Any]
+    written: List[Dict[_Name, Any]]  # per logic rule, what it wrote
+
+
+class _LogicNode:
+    """A compiled logic rule with each of its reads resolved to the rule it depends on."""
+
+    __slots__ = ("step", "sources", "writes")
+
+    def __init__(self, step: _LogicStep, sources: List[Tuple[_Name, Optional[int]]], writes: List[_Name]):
+        self.step = step
+        # Rules run in mapping order: a read sees the latest earlier rule
+        # writing that name, or the submitted data when there is none (None).
+        self.sources = sources
+        self.writes = writes
 
-            if prefer in ("auto", "ssn") and len(ssn) >= 3:
-                out[ssn[0]] = digits[0:3]
-                out[ssn[1]] = digits[3:5]
-                out[ssn[2]] = digits[5:9]
 
-            if prefer in ("auto", "ein") and len(ein) >= 2:
-                out[ein[0]] = digits[0:2]
-                out[ein[1]] = digits[2:9]
+_MISSING = object()
+
+
+def _same(a: Any, b: Any) -> bool:
+    # 1 == True == 1.0, but they render differently.
+    return a is b or (type(a) is type(b) and a == b)
+
+
+def _same_writes(a: Dict[_Name, Any], b: Dict[_Name, Any]) -> bool:
+    return a.keys() == b.keys() and all(_same(value, b[name]) for name, value in a.items())
+
+
+class MappingPlan:
+    """
+    A mapping.json compiled into closures, built once per template bundle.
+
+    ``build`` returns what ``build_pdf_field_values`` returns for the same
+    mapping; the rule types, defaults, regexes and choice tables are
+    resolved here instead of on every render. The logic rules form a
+    dependency graph, so ``run_logic`` can recompute only what depends on
+    the inputs that changed since a previous run.
+    """
 
+    __slots__ = ("logic", "final_writers", "incremental", "outputs")
+
+    def __init__(
+        self,
+        logic: List[_LogicNode],
+        final_writers: Dict[_Name, int],
+        incremental: bool,
+        outputs: List[Tuple[str, Optional[str], _OutputStep]],
+    ):
+        self.logic = logic
+        self.final_writers = final_writers  # name -> last rule writing it
+        self.incremental = incremental  # False when some rule is left to the interpreter
+        # (form key, field of a plain text mapping or None, step); plain text
+        # mappings, most of any mapping.json, are written inline.
+        self.outputs = outputs
+
+    def run_logic(
+        self,
+        form_data: Dict[str, Any],
+        previous: Optional[LogicResult] = None,
+        changed: Optional[Iterable[str]] = None,
+    ) -> LogicResult:
+        """
+        Evaluate the logic rules for *form_data*.
+
+        With *previous* (a result of this plan), only rules downstream of the
+        *changed* form keys run again; *changed* defaults to the keys whose
+        values differ from ``previous.inputs``. The result is the same as a
+        full run either way.
+        """
+        if previous is None or not self.incremental:
+            return self._run_all(form_data)
+        if changed is None:
+            old = previous.inputs
+            changed = {
+                key for key in old.keys() | form_data.keys() if not _same(old.get(key, _MISSING), form_data.get(key, _MISSING))
+            }
         else:
-            field = rule.get("field")
-            if field:
-                raw = "" if value is None else str(value)
-                # Never write data URIs as text — auto-detect as signature overlay
-                if raw.startswith("data:image"):
-                    out[field] = ""
-                    sig_overlays.append({
-                        "value": raw,
-                        "page": rule.get("page", 0),
-                        "rect": rule.get("rect", [0, 0, 200, 50]),
-                        "field": field,
-                    })
+            changed = set(changed)
+        if not changed:
+            return LogicResult(form_data, previous.state, previous.variables, previous.written)
+
+        written = list(previous.written)
+        rerun: Set[int] = set()  # rules whose output changed
+        for index, node in enumerate(self.logic):
+            if not any(
+                (source is None and name[0] == "key" and name[1] in changed) or source in rerun
+                for name, source in node.sources
+            ):
+                continue
+            state: Dict[str, Any] = {}
+            variables: Dict[str, Any] = {}
+            for (kind, name), source in node.sources:
+                if source is not None:
+                    (state if kind == "key" else variables)[name] = written[source][(kind, name)]
+                elif kind == "key" and name in form_data:
+                    state[name] = form_data[name]
+            node.step(state, variables)
+            result = {(kind, name): (state if kind == "key" else variables)[name] for kind, name in node.writes}
+            if not _same_writes(result, written[index]):
+                written[index] = result
+                rerun.add(index)
+
+        state, variables = dict(previous.state), dict(previous.variables)
+        for key in changed:
+            if ("key", key) not in self.final_writers:
+                if key in form_data:
+                    state[key] = form_data[key]
                 else:
-                    out[field] = value
+                    state.pop(key, None)
+        for name, writer in self.final_writers.items():
+            if writer in rerun:
+                (state if name[0] == "key" else variables)[name[1]] = written[writer][name]
+        return LogicResult(form_data, state, variables, written)
+
+    def _run_all(self, form_data: Dict[str, Any]) -> LogicResult:
+        state, variables = dict(form_data), {}
+        written: List[Dict[_Name, Any]] = []
+        for node in self.logic:
+            node.step(state, variables)
+            written.append({(kind, name): (state if kind == "key" else variables)[name] for kind, name in node.writes})
+        return LogicResult(form_data, state, variables, written)
+
+    def build(
+        self, form_data: Dict[str, Any], logic: Optional[LogicResult] = None
+    ) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """PDF field values and overlays; *logic* is ``run_logic(form_data, ...)`` when the caller has it."""
+        state = form_data
+        if self.logic:
+            state = (logic or self._run_all(form_data)).state
+        out: Dict[str, Any] = {}
+        sig_overlays: List[Dict[str, Any]] = []
+        for key, text_field, step in self.outputs:
+            if key not in state:
+                continue
+            value = state[key]
+            if text_field is not None:
+                raw = "" if value is None else str(value)
+                if not raw.startswith("data:image"):
+                    out[text_field] = raw
+                    continue
+            step(value, out, sig_overlays)
+        return out, sig_overlays
 
-    return out, sig_overlays
+
+class LogicSession:
+    """
+    Successive builds of one plan (a live preview, the records of a bulk
+    job): each recomputes only the logic rules whose inputs changed since
+    the previous build. Builds may run on several threads at once: each
+    diffs against whichever result was last, so every build stays exact.
+    """
+
+    def __init__(self, plan: MappingPlan):
+        self.plan = plan
+        self.last: Optional[LogicResult] = None
+
+    def build(self, form_data: Dict[str, Any]) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        self.last = logic = self.plan.run_logic(form_data, self.last)
+        return self.plan.build(form_data, logic)
+
+
+def compile_mapping(mapping: Dict[str, Any]) -> MappingPlan:
+    logic: List[_LogicNode] = []
+    last_writer: Dict[_Name, int] = {}
+    incremental = True
+    outputs: List[Tuple[str, Optional[str], _OutputStep]] = []
+    for key, rule in mapping.items():
+        # An entry the compiler cannot make sense of is left to the
+        # interpreter, so it fails (or not) exactly as it always did.
+        if isinstance(rule, dict):
+            names = None
+            try:
+                step = _compile_logic_rule(rule)
+                names = _logic_names(rule)
+            except Exception:
+                step, incremental = functools.partial(_apply_logic_rule, rule), False
+            if step is not None:
+                reads, writes = names or ([], [])
+                sources = [(name, last_writer.get(name)) for name in dict.fromkeys(reads)]
+                logic.append(_LogicNode(step, sources, writes))
+                for name in writes:
+                    last_writer[name] = len(logic) - 1
+        try:
+            output = _compile_output_rule(rule)
+        except Exception:
+            output = functools.partial(_apply_output_rule, rule)
+        if output is not None:
+            outputs.append((key, rule if isinstance(rule, str) else None, output))
+    return MappingPlan(logic, last_writer, incremental, outputs)
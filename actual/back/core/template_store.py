@@ -1,8 +1,16 @@
 from __future__ import annotations
 import json
-from dataclasses import dataclass
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import cached_property
 from pathlib import Path
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple
+
+from .mapping import MappingPlan, compile_mapping
+from .transforms import TransformProgram, compile_transforms
 
 
 @dataclass
@@ -14,16 +22,45 @@ class TemplateBundle:
     schema: Dict[str, Any]
     mapping: Dict[str, Any]
     meta: Dict[str, Any]
+    # Values the API derives from the bundle (e.g. the PDF renders read),
+    # computed on first use and dropped with the bundle when its files change.
+    derived: Dict[str, Any] = field(default_factory=dict, repr=False, compare=False)
 
+    # Compiled on first use, so a malformed mapping or transform list fails
+    # the requests that need it (renders) and not every page of the template.
+    @cached_property
+    def mapping_plan(self) -> MappingPlan:
+        return compile_mapping(self.mapping)
 
-def load_template(
-    templates_root: str | Path,
-    template_id: str,
-    *,
-    include_unpublished: bool = False,
-) -> TemplateBundle:
-    templates_root = Path(templates_root)
-    base = templates_root / template_id
+    @cached_property
+    def transform_program(self) -> TransformProgram:
+        return compile_transforms(self.schema.get("transforms", []) if isinstance(self.schema, dict) else [])
+
+
+# Parsed bundles are shared between requests: treat them as read-only.
+TEMPLATE_CACHE_SIZE = int(os.getenv("TEMPLATE_CACHE_SIZE", "64"))
+
+_Signature = Tuple[Optional[Tuple[int, int]], ...]
+
+_bundle_cache: "OrderedDict[Tuple[str, str], Tuple[Tuple[Path, ...], _Signature, TemplateBundle]]" = OrderedDict()
+_bundle_cache_lock = threading.Lock()
+_bundle_cache_stats = {"hits": 0, "misses": 0, "invalidations": 0, "evictions": 0}
+
+
+def _signature(paths: Tuple[Path, ...]) -> _Signature:
+    """Cheap change detector: (mtime_ns, size) of every file the bundle was built from."""
+    stamps = []
+    for path in paths:
+        try:
+            stat = path.stat()
+        except OSError:
+            stamps.append(None)
+            continue
+        stamps.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(stamps)
+
+
+def _read_template(base: Path, template_id: str) -> Tuple[Tuple[Path, ...], TemplateBundle]:
     if not base.exists():
         raise FileNotFoundError(f"Template folder not found: {base}")
 
@@ -32,8 +69,6 @@ def load_template(
         raise FileNotFoundError(f"template.json not found in {base}")
 
     meta = json.loads(meta_path.read_text(encoding="utf-8"))
-    if not include_unpublished and meta.get("published", True) is False:
-        raise FileNotFoundError(f"Template is not published: {template_id}")
 
     engine = meta.get("engine", "acroform")
     pdf_rel = meta.get("pdf")
@@ -53,7 +88,7 @@ def load_template(
     schema = json.loads(schema_path.read_text(encoding="utf-8")) if schema_path.exists() else {"fields": []}
     mapping = json.loads(mapping_path.read_text(encoding="utf-8")) if mapping_path.exists() else {}
 
-    return TemplateBundle(
+    bundle = TemplateBundle(
         template_id=template_id,
         base_dir=base,
         engine=engine,
@@ -62,6 +97,71 @@ def load_template(
         mapping=mapping,
         meta=meta,
     )
+    return (meta_path, schema_path, mapping_path, pdf_path), bundle
+
+
+def load_template(
+    templates_root: str | Path,
+    template_id: str,
+    *,
+    include_unpublished: bool = False,
+) -> TemplateBundle:
+    """
+    Return the parsed bundle for *template_id*.
+
+    Bundles are kept in a bounded LRU cache and revalidated against the
+    mtime/size of their source files on every call, so edits on disk are
+    picked up without a restart.
+    """
+    templates_root = Path(templates_root)
+    base = templates_root / template_id
+    key = (str(templates_root), template_id)
+
+    with _bundle_cache_lock:
+        entry = _bundle_cache.get(key)
+
+    bundle: Optional[TemplateBundle] = None
+    if entry is not None:
+        paths, signature, cached = entry
+        if _signature(paths) == signature:
+            bundle = cached
+
+    with _bundle_cache_lock:
+        if bundle is not None:
+            _bundle_cache_stats["hits"] += 1
+            if key in _bundle_cache:
+                _bundle_cache.move_to_end(key)
+        else:
+            _bundle_cache_stats["misses"] += 1
+            _bundle_cache.pop(key, None)
+
+    if bundle is None:
+        paths, bundle = _read_template(base, template_id)
+        signature = _signature(paths)
+        with _bundle_cache_lock:
+            _bundle_cache[key] = (paths, signature, bundle)
+            _bundle_cache.move_to_end(key)
+            while len(_bundle_cache) > max(TEMPLATE_CACHE_SIZE, 1):
+                _bundle_cache.popitem(last=False)
+                _bundle_cache_stats["evictions"] += 1
+
+    if not include_unpublished and bundle.meta.get("published", True) is False:
+        raise FileNotFoundError(f"Template is not published: {template_id}")
+
+    return bundle
+
+
+def invalidate_template_cache(template_id: Optional[str] = None) -> None:
+    """Drop cached bundles for *template_id* (or everything) after files are rewritten."""
+    with _bundle_cache_lock:
+        for key in [key for key in _bundle_cache if template_id is None or key[1] == template_id]:
+            del _bundle_cache[key]
+        _bundle_cache_stats["invalidations"] += 1
+
+
+def template_cache_stats() -> Dict[str, int]:
+    with _bundle_cache_lock:
+        return {**_bundle_cache_stats, "size": len(_bundle_cache), "max_size": TEMPLATE_CACHE_SIZE}
 
 
 def load_template_meta(
@@ -96,3 +196,133 @@ def list_templates(templates_root: str | Path, *, include_unpublished: bool = Fa
         if include_unpublished or meta.get("published", True) is not False:
             template_ids.append(path.name)
     return sorted(template_ids)
+
+
+# ---------------------------------------------------------------------------
+# Catalog index
+# ---------------------------------------------------------------------------
+
+CATALOG_REFRESH_SECONDS = float(os.getenv("TEMPLATE_CATALOG_REFRESH_SECONDS", "60"))
+
+
+@dataclass
+class CatalogEntry:
+    template_id: str
+    meta: Dict[str, Any]
+    published: bool
+    category: str
+    tags: List[str] = field(default_factory=list)
+    country: str = ""
+    field_count: int = 0
+    last_modified: float = 0.0
+
+
+def _folder_stamp(base: Path) -> Tuple[int, int]:
+    """(newest mtime_ns, file count) over every file in a template folder."""
+    newest, count = base.stat().st_mtime_ns, 0
+    for path in base.rglob("*"):
+        if path.is_file():
+            newest = max(newest, path.stat().st_mtime_ns)
+            count += 1
+    return newest, count
+
+
+def _build_catalog_entry(base: Path, stamp: Tuple[int, int]) -> Optional[CatalogEntry]:
+    try:
+        meta = json.loads((base / "template.json").read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    try:
+        schema_path = base / meta.get("schema", "schema.json")
+        schema = json.loads(schema_path.read_text(encoding="utf-8"))
+        fields = schema.get("fields", []) if isinstance(schema, dict) else []
+    except (OSError, json.JSONDecodeError):
+        fields = []
+    tags = meta.get("tags", [])
+    return CatalogEntry(
+        template_id=base.name,
+        meta=meta,
+        published=meta.get("published", True) is not False,
+        category=meta.get("category", ""),
+        tags=tags if isinstance(tags, list) else [],
+        country=meta.get("country", ""),
+        field_count=len(fields) if isinstance(fields, list) else 0,
+        last_modified=stamp[0] / 1e9,
+    )
+
+
+class TemplateCatalog:
+    """
+    In-memory index of every template folder's metadata.
+
+    Built once on construction and answered from memory afterwards. Folders
+    are rescanned when invalidated explicitly or after the refresh interval,
+    and only folders whose files changed are parsed again.
+    """
+
+    def __init__(self, templates_root: str | Path, *, refresh_interval: float = CATALOG_REFRESH_SECONDS):
+        self.root = Path(templates_root)
+        self.refresh_interval = refresh_interval
+        self._entries: Dict[str, CatalogEntry] = {}
+        self._stamps: Dict[str, Tuple[int, int]] = {}
+        self._lock = threading.Lock()
+        self._stale = True
+        self._checked_at = 0.0
+        self.refresh()
+
+    def refresh(self) -> None:
+        with self._lock:
+            entries = dict(self._entries)
+            stamps = dict(self._stamps)
+            seen = set()
+            folders = sorted(path for path in self.root.iterdir() if path.is_dir()) if self.root.exists() else []
+            for base in folders:
+                try:
+                    stamp = _folder_stamp(base)
+                except OSError:
+                    continue
+                seen.add(base.name)
+                if stamps.get(base.name) == stamp and base.name in entries:
+                    continue
+                entry = _build_catalog_entry(base, stamp)
+                stamps[base.name] = stamp
+                if entry is None:
+                    entries.pop(base.name, None)
+                else:
+                    entries[base.name] = entry
+            for template_id in set(entries) - seen:
+                entries.pop(template_id, None)
+                stamps.pop(template_id, None)
+            self._entries = dict(sorted(entries.items()))
+            self._stamps = stamps
+            self._stale = False
+            self._checked_at = time.monotonic()
+
+    def invalidate(self, template_id: Optional[str] = None) -> None:
+        """Force the next lookup to rescan (*template_id* or every folder)."""
+        with self._lock:
+            if template_id is None:
+                self._stamps.clear()
+            else:
+                self._stamps.pop(template_id, None)
+            self._stale = True
+
+    def _current(self) -> Dict[str, CatalogEntry]:
+        expired = self.refresh_interval > 0 and time.monotonic() - self._checked_at > self.refresh_interval
+        if self._stale or expired:
+            self.refresh()
+        return self._entries
+
+    def entries(self, *, include_unpublished: bool = False) -> List[CatalogEntry]:
+        return [entry for entry in self._current().values() if include_unpublished or entry.published]
+
+    def ids(self, *, include_unpublished: bool = False) -> List[str]:
+        return [entry.template_id for entry in self.entries(include_unpublished=include_unpublished)]
+
+    def get(self, template_id: str, *, include_unpublished: bool = False) -> CatalogEntry:
+        entry = self._current().get(template_id)
+        if entry is None:
+            raise FileNotFoundError(f"template.json not found in {self.root / template_id}")
+        if not include_unpublished and not entry.published:
+            raise FileNotFoundError(f"Template is not published: {template_id}")
+        return entry
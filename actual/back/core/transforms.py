@@ -29,10 +29,14 @@ Supported compute operations
 """
 from __future__ import annotations
 
+import functools
+import heapq
+import operator
+from dataclasses import dataclass
 from datetime import date as _date
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
 
-from .formula import evaluate_formula
+from .formula import evaluate_formula, formula_dependencies
 
 
 # ---------------------------------------------------------------------------
@@ -221,84 +225,565 @@ def apply_transforms(
 ) -> Dict[str, Any]:
     """Apply declarative transform rules to form data.  Returns enriched copy."""
     result = dict(data)
+    _apply_rules(transforms, result)
+    return result
+
 
+def _apply_rules(transforms: List[Dict[str, Any]], result: Dict[str, Any]) -> None:
     for rule in transforms:
-        rtype = rule.get("type", "")
-        when = rule.get("when")
-        unless = rule.get("unless")
-        active = matches_conditions(when, result) and not (
-            unless is not None and matches_conditions(unless, result)
-        )
-
-        # --- derive: conditional bulk-set ---
-        if rtype == "derive":
-            result.update(rule.get("set", {}) if active else rule.get("else_set", {}))
-
-        # --- compute: math → output ---
-        elif rtype == "compute":
-            output_key = rule.get("output")
-            if not active or not output_key:
-                continue
-            result[output_key] = _compute(rule, result)
-
-        # Ordered outputs let one answer populate an entire group of PDF lines.
-        elif rtype == "formula":
-            if not active:
-                continue
-            outputs = rule.get("outputs", {})
-            if not isinstance(outputs, dict):
-                continue
-            for output_key, expression in outputs.items():
-                if output_key and isinstance(expression, str):
+        _apply_rule(rule, result)
+
+
+def _apply_rule(rule: Dict[str, Any], result: Dict[str, Any]) -> None:
+    rtype = rule.get("type", "")
+    when = rule.get("when")
+    unless = rule.get("unless")
+    active = matches_conditions(when, result) and not (
+        unless is not None and matches_conditions(unless, result)
+    )
+
+    # --- derive: conditional bulk-set ---
+    if rtype == "derive":
+        result.update(rule.get("set", {}) if active else rule.get("else_set", {}))
+
+    # --- compute: math → output ---
+    elif rtype == "compute":
+        output_key = rule.get("output")
+        if not active or not output_key:
+            return
+        result[output_key] = _compute(rule, result)
+
+    # Ordered outputs let one answer populate an entire group of PDF lines.
+    elif rtype == "formula":
+        if not active:
+            return
+        outputs = rule.get("outputs", {})
+        if not isinstance(outputs, dict):
+            return
+        for output_key, expression in outputs.items():
+            if output_key and isinstance(expression, str):
+                result[output_key] = evaluate_formula(expression, result)
+
+    # --- copy: field → field ---
+    elif rtype == "copy":
+        src, dst = rule.get("from", ""), rule.get("to", "")
+        if not src or not dst:
+            return
+        if not active:
+            return
+        val = result.get(src, "")
+        if not _is_empty(val):
+            if rule.get("if_empty", False):
+                if result.get(dst) in (None, ""):
+                    result[dst] = val
+            else:
+                result[dst] = val
+
+    # --- concat: fields -> joined output ---
+    elif rtype == "concat":
+        source_keys = rule.get("fields") or rule.get("inputs") or []
+        output_key = rule.get("output", "")
+        if not active or not isinstance(source_keys, list) or not output_key:
+            return
+        values = [str(result.get(key, "")).strip() for key in source_keys]
+        if rule.get("skip_empty", True):
+            values = [value for value in values if value]
+        result[output_key] = str(rule.get("separator", " ")).join(values)
+
+    # --- auto_date: today's date ---
+    elif rtype == "auto_date":
+        field = rule.get("field", "")
+        fmt = rule.get("format", "MM/DD/YYYY")
+        if active and field:
+            py_fmt = _strftime_format(fmt)
+            if result.get(field) in (None, ""):
+                result[field] = _date.today().strftime(py_fmt)
+
+    # --- set_value: literal value ---
+    elif rtype == "set_value":
+        field = rule.get("field", "")
+        value = rule.get("value")
+        if field:
+            if active:
+                result[field] = value
+            elif "else_value" in rule:
+                result[field] = rule.get("else_value")
+
+
+def _strftime_format(fmt: str) -> str:
+    return fmt.replace("MM", "%m").replace("DD", "%d").replace("YYYY", "%Y")
+
+
+# ---------------------------------------------------------------------------
+# Compiled transforms
+# ---------------------------------------------------------------------------
+#
+# compile_transforms() resolves everything apply_transforms() looks up per
+# rule and per call (rule types, operations, condition operators, expected
+# values as strings, date formats) once, into closures. A rule the compiler
+# cannot handle exactly is left to _apply_rule, so it behaves (and fails)
+# as it always did.
+
+_Step = Callable[[Dict[str, Any]], None]
+_Predicate = Callable[[Any], bool]
+
+
+def _compile_equal(expected: Any) -> _Predicate:
+    if isinstance(expected, bool):
+        return lambda actual: _to_bool(actual) == expected
+    if expected is None:
+        return lambda actual: actual is None
+    text = str(expected)
+    return lambda actual: str(actual) == text
+
+
+def _compile_any_equal(items: List[Any]) -> _Predicate:
+    """any(_equal(actual, item) for item in items)"""
+    texts = frozenset(str(item) for item in items if item is not None and not isinstance(item, bool))
+    accepts_true = any(item is True for item in items)
+    accepts_false = any(item is False for item in items)
+    accepts_none = any(item is None for item in items)
+
+    def any_equal(actual: Any) -> bool:
+        if accepts_none and actual is None:
+            return True
+        if (accepts_true or accepts_false) and (accepts_true if _to_bool(actual) else accepts_false):
+            return True
+        return bool(texts) and str(actual) in texts
+    return any_equal
+
+
+_BOUNDS = (("gt", operator.gt), ("gte", operator.ge), ("lt", operator.lt), ("lte", operator.le))
+
+
+def _compile_expected(expected: Any) -> _Predicate:
+    """_match_expected(actual, expected) as a function of actual."""
+    if isinstance(expected, list):
+        return _compile_any_equal(expected)
+    if not isinstance(expected, dict):
+        return _compile_equal(expected)
+
+    checks: List[_Predicate] = []
+    if "equals" in expected:
+        checks.append(_compile_equal(expected["equals"]))
+    if "not_equals" in expected:
+        equal = _compile_equal(expected["not_equals"])
+        checks.append(lambda actual: not equal(actual))
+    if "in" in expected:
+        checks.append(_compile_any_equal(list(expected["in"])))
+    if "not_in" in expected:
+        any_equal = _compile_any_equal(list(expected["not_in"]))
+        checks.append(lambda actual: not any_equal(actual))
+    if "empty" in expected:
+        empty = bool(expected["empty"])
+        checks.append(lambda actual: _is_empty(actual) == empty)
+    if "truthy" in expected:
+        truthy = bool(expected["truthy"])
+        checks.append(lambda actual: _to_bool(actual) == truthy)
+    bounds = [(compare, _to_num(expected[key])) for key, compare in _BOUNDS if key in expected]
+
+    def match(actual: Any) -> bool:
+        for check in checks:
+            if not check(actual):
+                return False
+        numeric = _to_num(actual)  # also raises where the interpreter does (huge ints)
+        for compare, bound in bounds:
+            if not compare(numeric, bound):
+                return False
+        return True
+    return match
+
+
+def _compile_conditions(conditions: Dict[str, Any] | None) -> Optional[Callable[[Dict[str, Any]], bool]]:
+    """matches_conditions(conditions, data) as a function of data; None when always true."""
+    if conditions is None:
+        return None
+    if not isinstance(conditions, dict):
+        raise TypeError("conditions must be an object")
+    predicates = [(key, _compile_expected(expected)) for key, expected in conditions.items()]
+
+    def matches(data: Dict[str, Any]) -> bool:
+        for key, predicate in predicates:
+            if not predicate(data.get(key)):
+                return False
+        return True
+    return matches
+
+
+def _compile_active(rule: Dict[str, Any]) -> Optional[Callable[[Dict[str, Any]], bool]]:
+    when, unless = _compile_conditions(rule.get("when")), _compile_conditions(rule.get("unless"))
+    if unless is None:
+        return when
+    if when is None:
+        return lambda data: not unless(data)
+    return lambda data: when(data) and not unless(data)
+
+
+def _compile_compute(rule: Dict[str, Any]) -> Callable[[Dict[str, Any]], str]:
+    """_compute(rule, data) as a function of data."""
+    op = rule.get("operation", "add")
+    inputs = list(rule.get("inputs") or ([rule["input"]] if rule.get("input") else []))
+
+    def values(data: Dict[str, Any]) -> List[float]:
+        return [_to_num(data.get(k)) for k in inputs]
+
+    def first(data: Dict[str, Any]) -> float:
+        vals = values(data)
+        return vals[0] if vals else 0.0
+
+    if op == "subtract":
+        def subtract(data: Dict[str, Any]) -> str:
+            vals = values(data)
+            result = vals[0] if vals else 0.0
+            for v in vals[1:]:
+                result -= v
+            return _fmt(result)
+        return subtract
+
+    if op == "multiply":
+        factor = rule.get("factor")
+        if factor is not None:
+            scale = _to_num(factor)
+            return lambda data: _fmt(first(data) * scale)
+
+        def product(data: Dict[str, Any]) -> str:
+            result = 1.0
+            for v in values(data):
+                result *= v
+            return _fmt(result)
+        return product
+
+    if op in ("divide", "percent", "pow", "mod"):
+        # Second operand: the second input, else a constant from the rule.
+        default_key, default = {"divide": ("divisor", 1), "percent": ("percent", 0), "pow": ("exp", 1), "mod": ("mod", 1)}[op]
+        constant = _to_num(rule.get(default_key, default))
+        binary = {
+            "divide": lambda a, b: 0.0 if b == 0 else a / b,
+            "percent": lambda a, b: a * b / 100,
+            "pow": lambda a, b: a ** b,
+            "mod": lambda a, b: 0.0 if b == 0 else a % b,
+        }[op]
+
+        def apply_binary(data: Dict[str, Any]) -> str:
+            vals = values(data)
+            return _fmt(binary(vals[0] if vals else 0.0, vals[1] if len(vals) > 1 else constant))
+        return apply_binary
+
+    if op in ("min", "max", "avg"):
+        if not inputs:
+            return lambda data: "0"
+        if op == "avg":
+            return lambda data: _fmt(sum(values(data)) / len(inputs))
+        pick = min if op == "min" else max
+        return lambda data: _fmt(pick(values(data)))
+
+    if op == "round":
+        precision = int(_to_num(rule.get("precision", 0)))
+        return lambda data: _fmt(round(first(data), precision))
+
+    if op == "abs":
+        return lambda data: _fmt(abs(first(data)))
+
+    if op == "negate":
+        return lambda data: _fmt(-first(data))
+
+    # add / sum, and unknown operations
+    return lambda data: _fmt(sum(values(data)))
+
+
+def _compile_action(rule: Dict[str, Any]) -> Optional[Callable[[Dict[str, Any], bool], None]]:
+    """What the rule does given whether it is active; None when it never does anything."""
+    rtype = rule.get("type", "")
+
+    if rtype == "derive":
+        updates, else_updates = rule.get("set", {}), rule.get("else_set", {})
+
+        def derive(result: Dict[str, Any], active: bool) -> None:
+            result.update(updates if active else else_updates)
+        return derive
+
+    if rtype == "compute":
+        output_key = rule.get("output")
+        if not output_key:
+            return None
+        compute = _compile_compute(rule)
+
+        def compute_output(result: Dict[str, Any], active: bool) -> None:
+            if active:
+                result[output_key] = compute(result)
+        return compute_output
+
+    if rtype == "formula":
+        outputs = rule.get("outputs", {})
+        if not isinstance(outputs, dict):
+            return None
+        formulas = [(key, expression) for key, expression in outputs.items() if key and isinstance(expression, str)]
+
+        def formula(result: Dict[str, Any], active: bool) -> None:
+            if active:
+                for output_key, expression in formulas:
                     result[output_key] = evaluate_formula(expression, result)
+        return formula
+
+    if rtype == "copy":
+        src, dst = rule.get("from", ""), rule.get("to", "")
+        if not src or not dst:
+            return None
+        if_empty = bool(rule.get("if_empty", False))
 
-        # --- copy: field → field ---
-        elif rtype == "copy":
-            src, dst = rule.get("from", ""), rule.get("to", "")
-            if not src or not dst:
-                continue
+        def copy(result: Dict[str, Any], active: bool) -> None:
             if not active:
-                continue
+                return
             val = result.get(src, "")
-            if not _is_empty(val):
-                if rule.get("if_empty", False):
-                    if result.get(dst) in (None, ""):
-                        result[dst] = val
-                else:
-                    result[dst] = val
-
-        # --- concat: fields -> joined output ---
-        elif rtype == "concat":
-            source_keys = rule.get("fields") or rule.get("inputs") or []
-            output_key = rule.get("output", "")
-            if not active or not isinstance(source_keys, list) or not output_key:
-                continue
-            values = [str(result.get(key, "")).strip() for key in source_keys]
-            if rule.get("skip_empty", True):
-                values = [value for value in values if value]
-            result[output_key] = str(rule.get("separator", " ")).join(values)
-
-        # --- auto_date: today's date ---
-        elif rtype == "auto_date":
-            field = rule.get("field", "")
-            fmt = rule.get("format", "MM/DD/YYYY")
-            if active and field:
-                py_fmt = (
-                    fmt.replace("MM", "%m")
-                    .replace("DD", "%d")
-                    .replace("YYYY", "%Y")
-                )
-                if result.get(field) in (None, ""):
-                    result[field] = _date.today().strftime(py_fmt)
-
-        # --- set_value: literal value ---
-        elif rtype == "set_value":
-            field = rule.get("field", "")
-            value = rule.get("value")
-            if field:
-                if active:
-                    result[field] = value
-                elif "else_value" in rule:
-                    result[field] = rule.get("else_value")
-
-    return result
+            if not _is_empty(val) and (not if_empty or result.get(dst) in (None, "")):
+                result[dst] = val
+        return copy
+
+    if rtype == "concat":
+        source_keys = rule.get("fields") or rule.get("inputs") or []
+        output_key = rule.get("output", "")
+        if not isinstance(source_keys, list) or not output_key:
+            return None
+        skip_empty = bool(rule.get("skip_empty", True))
+        separator = str(rule.get("separator", " "))
+
+        def concat(result: Dict[str, Any], active: bool) -> None:
+            if active:
+                values = [str(result.get(key, "")).strip() for key in source_keys]
+                if skip_empty:
+                    values = [value for value in values if value]
+                result[output_key] = separator.join(values)
+        return concat
+
+    if rtype == "auto_date":
+        field = rule.get("field", "")
+        if not field:
+            return None
+        py_fmt = _strftime_format(rule.get("format", "MM/DD/YYYY"))
+
+        def auto_date(result: Dict[str, Any], active: bool) -> None:
+            if active and result.get(field) in (None, ""):
+                result[field] = _date.today().strftime(py_fmt)
+        return auto_date
+
+    if rtype == "set_value":
+        field = rule.get("field", "")
+        if not field:
+            return None
+        value = rule.get("value")
+        has_else, else_value = "else_value" in rule, rule.get("else_value")
+
+        def set_value(result: Dict[str, Any], active: bool) -> None:
+            if active:
+                result[field] = value
+            elif has_else:
+                result[field] = else_value
+        return set_value
+
+    return None
+
+
+def _compile_rule(rule: Dict[str, Any]) -> Optional[_Step]:
+    active = _compile_active(rule)
+    action = _compile_action(rule)
+    if action is None:
+        # Nothing to do, but conditions are still evaluated: a bad one fails here too.
+        return None if active is None else active
+    if active is None:
+        return lambda result: action(result, True)
+    return lambda result: action(result, active(result))
+
+
+def _rule_keys(rule: Dict[str, Any]) -> Tuple[List[str], List[str]]:
+    """
+    (reads, writes) of a compiled rule. Rules write conditionally, so a
+    written key's earlier value is read too. Raises for rules whose keys
+    cannot be known up front.
+    """
+    reads: List[str] = []
+    for conditions in (rule.get("when"), rule.get("unless")):
+        if conditions is not None:
+            reads += list(conditions)
+    rtype = rule.get("type", "")
+    writes: List[str] = []
+    if rtype == "derive":
+        for updates in (rule.get("set", {}), rule.get("else_set", {})):
+            if not isinstance(updates, dict):
+                raise TypeError("derive sets must be objects")
+            writes += list(updates)
+    elif rtype == "compute" and rule.get("output"):
+        reads += list(rule.get("inputs") or ([rule["input"]] if rule.get("input") else []))
+        writes.append(rule["output"])
+    elif rtype == "formula" and isinstance(rule.get("outputs", {}), dict):
+        for output_key, expression in rule.get("outputs", {}).items():
+            if output_key and isinstance(expression, str):
+                reads += formula_dependencies(expression)
+                writes.append(output_key)
+    elif rtype == "copy" and rule.get("from", "") and rule.get("to", ""):
+        reads.append(rule["from"])
+        writes.append(rule["to"])
+    elif rtype == "concat" and isinstance(rule.get("fields") or rule.get("inputs") or [], list) and rule.get("output", ""):
+        reads += rule.get("fields") or rule.get("inputs") or []
+        writes.append(rule["output"])
+    elif rtype in ("auto_date", "set_value") and rule.get("field", ""):
+        writes.append(rule["field"])
+    reads = list(dict.fromkeys(reads + writes))
+    return reads, list(dict.fromkeys(writes))
+
+
+class _Node:
+    """A compiled rule with each key it reads resolved to the rule it depends on."""
+
+    __slots__ = ("step", "sources", "writes", "readers")
+
+    def __init__(self, step: _Step, sources: List[Tuple[str, Optional[int]]], writes: List[str]):
+        self.step = step
+        # Rules run in order: a read sees the latest earlier rule writing that
+        # key, or the submitted data when there is none (None).
+        self.sources = sources
+        self.writes = writes
+        self.readers: List[int] = []  # later rules reading what this one writes
+
+
+_MISSING = object()
+
+
+def _same(a: Any, b: Any) -> bool:
+    # 1 == True == 1.0, but conditions and concat tell them apart.
+    return a is b or (type(a) is type(b) and a == b)
+
+
+@dataclass
+class TransformRun:
+    """A program applied to one set of data; see TransformProgram.apply_incremental."""
+
+    inputs: Dict[str, Any]  # the data, not copied: do not change it afterwards
+    result: Dict[str, Any]
+    written: List[Dict[str, Any]]  # per rule, the value of each key it writes (_MISSING when absent)
+
+
+class TransformProgram:
+    """
+    A schema's transform list compiled into closures, built once per
+    template bundle. ``apply(data)`` returns what ``apply_transforms(data,
+    transforms)`` returns. The rules also form a dependency graph over the
+    keys they read and write, so ``apply_incremental`` can rerun only the
+    rules affected by the keys that changed since a previous run.
+    """
+
+    __slots__ = ("nodes", "final_writers", "input_readers", "clock_readers", "incremental")
+
+    def __init__(self, nodes: List[_Node], final_writers: Dict[str, int], clock_readers: List[int], incremental: bool):
+        self.nodes = nodes
+        self.final_writers = final_writers  # key -> last rule writing it
+        self.input_readers: Dict[str, List[int]] = {}  # key -> rules reading its submitted value
+        for index, node in enumerate(nodes):
+            for key, source in node.sources:
+                if source is None:
+                    self.input_readers.setdefault(key, []).append(index)
+                elif index not in nodes[source].readers:
+                    nodes[source].readers.append(index)
+        self.clock_readers = clock_readers  # auto_date rules, rerun every time
+        self.incremental = incremental  # False when some rule's keys are unknown
+
+    def apply(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        result = dict(data)
+        for node in self.nodes:
+            node.step(result)
+        return result
+
+    def apply_incremental(
+        self,
+        data: Dict[str, Any],
+        previous: Optional[TransformRun] = None,
+        changed: Optional[Iterable[str]] = None,
+    ) -> TransformRun:
+        """
+        Apply the program to *data*, reusing *previous* (a run of this
+        program): only rules downstream of the *changed* keys run again.
+        *changed* defaults to the keys whose values differ from
+        ``previous.inputs``. The result equals ``apply(data)``; its key order
+        may differ.
+        """
+        if previous is None or not self.incremental:
+            return self._run_all(data)
+        if changed is None:
+            old = previous.inputs
+            changed = {key for key in old.keys() | data.keys() if not _same(old.get(key, _MISSING), data.get(key, _MISSING))}
+        else:
+            changed = set(changed)
+
+        written = list(previous.written)
+        rerun: Set[int] = set()  # rules whose writes changed
+        pending = set(self.clock_readers)
+        for key in changed:
+            pending.update(self.input_readers.get(key, ()))
+        queue = list(pending)
+        heapq.heapify(queue)  # readers come after the rules they read from
+        while queue:
+            index = heapq.heappop(queue)
+            node = self.nodes[index]
+            values: Dict[str, Any] = {}
+            for key, source in node.sources:
+                value = data.get(key, _MISSING) if source is None else written[source][key]
+                if value is not _MISSING:
+                    values[key] = value
+            node.step(values)
+            writes = {key: values.get(key, _MISSING) for key in node.writes}
+            if any(not _same(value, written[index][key]) for key, value in writes.items()):
+                written[index] = writes
+                rerun.add(index)
+                for reader in node.readers:
+                    if reader not in pending:
+                        pending.add(reader)
+                        heapq.heappush(queue, reader)
+
+        result = dict(previous.result)
+        updates = [(key, data.get(key, _MISSING)) for key in changed if key not in self.final_writers]
+        updates += [(key, written[writer][key]) for key, writer in self.final_writers.items() if writer in rerun]
+        for key, value in updates:
+            if value is _MISSING:
+                result.pop(key, None)
+            else:
+                result[key] = value
+        return TransformRun(data, result, written)
+
+    def _run_all(self, data: Dict[str, Any]) -> TransformRun:
+        result = dict(data)
+        written: List[Dict[str, Any]] = []
+        for node in self.nodes:
+            node.step(result)
+            written.append({key: result.get(key, _MISSING) for key in node.writes})
+        return TransformRun(data, result, written)
+
+
+def compile_transforms(transforms: List[Dict[str, Any]]) -> TransformProgram:
+    if not isinstance(transforms, list):
+        return TransformProgram([_Node(functools.partial(_apply_rules, transforms), [], [])], {}, [], False)
+    nodes: List[_Node] = []
+    last_writer: Dict[str, int] = {}
+    clock_readers: List[int] = []
+    incremental = True
+    for rule in transforms:
+        try:
+            step = _compile_rule(rule)
+        except Exception:
+            step = functools.partial(_apply_rule, rule)
+        if step is None:
+            continue
+        node = None
+        if not isinstance(step, functools.partial):
+            try:
+                reads, writes = _rule_keys(rule)
+                node = _Node(step, [(key, last_writer.get(key)) for key in reads], writes)
+                if rule.get("type") == "auto_date":
+                    clock_readers.append(len(nodes))
+            except Exception:
+                pass
+        if node is None:
+            # Keys unknown: every run is a full run.
+            incremental, node = False, _Node(step, [], [])
+        nodes.append(node)
+        for key in node.writes:
+            last_writer[key] = len(nodes) - 1
+    return TransformProgram(nodes, last_writer, clock_readers, incremental)
@@ -1,11 +1,13 @@
 from __future__ import annotations
 import base64
 import io
+import logging
+import math
+import os
 import re
-import tempfile
 import xml.etree.ElementTree as ET
 from pathlib import Path
-from typing import Dict, Any, List, Optional, Union
+from typing import BinaryIO, Dict, Any, List, Optional, Union
 from pypdf import PdfReader, PdfWriter
 from pypdf.generic import (
     ArrayObject,
@@ -13,27 +15,38 @@ from pypdf.generic import (
     EncodedStreamObject,
     NameObject,
     BooleanObject,
+    StreamObject,
 )
 
+try:
+    from .appearance import SUPPORTED as FAST_APPEARANCES, fill_text_appearances, pages_for_values
+except ImportError:  # the pypdf internals it builds on are gone; see requirements.txt
+    FAST_APPEARANCES = False
+if not FAST_APPEARANCES:
+    logging.getLogger(__name__).warning("Installed pypdf lacks the internals of the fast appearance engine; using pypdf's")
+from .field_catalog import FieldCatalog, field_catalog
+from .pdf_cache import SourceDocument, checkout_writer, load_source
+from .pdf_compact import write_compact, write_increment
+from .pdf_linearize import write_linearized
+from .widget_index import index_page, widget_index
 
-def _with_name_fallbacks(reader: PdfReader, field_values: Dict[str, Any]) -> Dict[str, Any]:
+
+def _with_name_fallbacks(catalog: FieldCatalog, field_values: Dict[str, Any]) -> Dict[str, Any]:
     """
     Makes filling resilient:
     - if given a long name like form1[0].Page1[0].field[0], also adds the short name field[0]
     - if given a short name but PDF only has the long one — leaves as-is
     """
-    fields = reader.get_fields() or {}
-    available = set(fields.keys())
+    available = catalog.full_names
 
     out = dict(field_values)
 
-    for k, v in list(field_values.items()):
+    for k, v in field_values.items():
         if k in available:
             continue
-        if "." in k:
-            short = k.split(".")[-1]
-            if short not in out:
-                out[short] = v
+        short = catalog.fallback_name(k)
+        if short is not None and short not in out:
+            out[short] = v
 
     return out
 
@@ -219,8 +232,133 @@ def _fill_xfa_datasets(writer: PdfWriter, field_values: Dict[str, Any]) -> None:
 # Signature overlays
 # ---------------------------------------------------------------------------
 
-def _apply_signature_overlays(writer: PdfWriter, overlays: List[Dict[str, Any]]) -> None:
-    """Overlay drawn signature images onto PDF pages."""
+# Drawn signatures are embedded at no more than this resolution for their
+# box on the page; a browser canvas is usually several times larger.
+SIGNATURE_DPI = int(os.getenv("PDF_SIGNATURE_DPI", "200"))
+# Ink is one or two colours; antialiasing lives in the alpha channel, and
+# 16 coverage levels are plenty for edges at that resolution.
+SIGNATURE_COLORS = 16
+SIGNATURE_ALPHA_LEVELS = 16
+
+
+def _compact_signature(img, width: float, height: float):
+    """Downscale RGBA *img* to SIGNATURE_DPI at *width* x *height* points and reduce it to palette + alpha."""
+    from PIL import Image
+
+    size = (max(1, math.ceil(width * SIGNATURE_DPI / 72)), max(1, math.ceil(height * SIGNATURE_DPI / 72)))
+    if size[0] < img.width and size[1] < img.height:
+        img = img.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)  # resampled premultiplied
+    step = 255 / (SIGNATURE_ALPHA_LEVELS - 1)
+    alpha = img.getchannel("A").point(lambda value: round(round(value / step) * step))
+    # fpdf2 embeds "PA" as one index byte per pixel plus the alpha soft mask.
+    compact = img.convert("RGB").quantize(SIGNATURE_COLORS).convert("PA")
+    compact.putalpha(alpha)
+    return compact
+
+
+class _OverlayBatch:
+    """
+    Collects every stamp for a document (checkbox marks, text overlays,
+    signatures) and merges them with a single overlay page per PDF page.
+
+    All overlay pages live in one fpdf2 document, so a render pays for one
+    FPDF serialization, one PdfReader parse and one merge_page per stamped
+    page, however many stamps there are.
+    """
+
+    def __init__(self, writer: PdfWriter):
+        self.writer = writer
+        self.stamps: Dict[int, List[Dict[str, Any]]] = {}
+
+    def add_text(
+        self,
+        page_idx: int,
+        text: str,
+        x: float,
+        y: float,
+        w: float,
+        h: float,
+        font_size: Optional[float] = None,
+        font: str = "Helvetica",
+        font_style: str = "",
+        align: str = "L",
+    ) -> None:
+        self.stamps.setdefault(page_idx, []).append({
+            "kind": "text",
+            "text": text,
+            "rect": (x, y, w, h),
+            "size": font_size if font_size else min(h * 0.8, 18),
+            "font": font,
+            "font_style": font_style,
+            "align": align,
+        })
+
+    def add_image(self, page_idx: int, img, x: float, y: float, w: float, h: float) -> None:
+        # Browser canvases are larger than most PDF signature boxes. Crop empty
+        # transparent margins and fit the ink without distorting its proportions.
+        alpha = img.getchannel("A") if img.mode == "RGBA" else None
+        bounds = alpha.getbbox() if alpha is not None else None
+        if bounds:
+            padding = max(2, int(max(img.size) * 0.01))
+            left = max(0, bounds[0] - padding)
+            top = max(0, bounds[1] - padding)
+            right = min(img.width, bounds[2] + padding)
+            bottom = min(img.height, bounds[3] + padding)
+            img = img.crop((left, top, right, bottom))
+
+        if img.width <= 0 or img.height <= 0:
+            return
+        scale = min(w / img.width, h / img.height)
+        draw_w = img.width * scale
+        draw_h = img.height * scale
+        draw_x = x + (w - draw_w) / 2
+        draw_y = y + (h - draw_h) / 2
+        self.stamps.setdefault(page_idx, []).append({
+            "kind": "image",
+            "image": _compact_signature(img, draw_w, draw_h),
+            "rect": (draw_x, draw_y, draw_w, draw_h),
+        })
+
+    def merge(self) -> int:
+        """Draw and merge all queued stamps. Returns the number of merged pages."""
+        if not self.stamps:
+            return 0
+        from fpdf import FPDF
+
+        pdf = FPDF(unit="pt")
+        pdf.set_auto_page_break(False)
+        targets: List[int] = []
+        for page_idx in sorted(self.stamps):
+            media_box = self.writer.pages[page_idx].mediabox
+            page_h = float(media_box.height)
+            pdf.add_page(format=(float(media_box.width), page_h))
+            targets.append(page_idx)
+            for stamp in self.stamps[page_idx]:
+                x, y, w, h = stamp["rect"]
+                # fpdf2 uses top-left origin; PDF uses bottom-left
+                fpdf_y = page_h - y - h
+                try:
+                    if stamp["kind"] == "text":
+                        pdf.set_font(stamp["font"], stamp["font_style"], size=stamp["size"])
+                        pdf.set_xy(x, fpdf_y)
+                        pdf.cell(w=w, h=h, text=stamp["text"], align=stamp["align"])
+                    else:
+                        # fpdf2 takes the PIL image as it is: no PNG round trip.
+                        pdf.image(stamp["image"], x=x, y=fpdf_y, w=w, h=h)
+                except Exception as exc:
+                    import logging
+                    logging.getLogger(__name__).warning("Overlay stamp failed: %s", exc)
+
+        stamp_reader = PdfReader(io.BytesIO(pdf.output()))
+
+        for stamp_page, page_idx in zip(stamp_reader.pages, targets):
+            self.writer.pages[page_idx].merge_page(stamp_page)
+        self.stamps.clear()
+        return len(targets)
+
+
+def _apply_signature_overlays(batch: _OverlayBatch, overlays: List[Dict[str, Any]]) -> None:
+    """Queue drawn signature images and typed text overlays onto *batch*."""
     if not overlays:
         return
 
@@ -240,7 +378,7 @@ def _apply_signature_overlays(writer: PdfWriter, overlays: List[Dict[str, Any]])
         rect = overlay.get("rect", [0, 0, 200, 50])
         text_mode = overlay.get("text_mode", False)
 
-        if page_idx >= len(writer.pages):
+        if page_idx >= len(batch.writer.pages):
             continue
 
         x1, y1, x2, y2 = rect
@@ -249,15 +387,12 @@ def _apply_signature_overlays(writer: PdfWriter, overlays: List[Dict[str, Any]])
 
         if text_mode and data_url.strip():
             # Render typed text directly onto the PDF page
-            try:
-                _stamp_text_with_fpdf2(
-                    writer, page_idx, data_url.strip(), x1, y1, w, h,
-                    font_size=overlay.get("font_size"),
-                    font=overlay.get("font", "Helvetica"),
-                    align=overlay.get("align", "L"),
-                )
-            except Exception:
-                pass
+            batch.add_text(
+                page_idx, data_url.strip(), x1, y1, w, h,
+                font_size=overlay.get("font_size"),
+                font=overlay.get("font", "Helvetica"),
+                align=overlay.get("align", "L"),
+            )
             continue
 
         if not data_url.startswith("data:image"):
@@ -271,132 +406,134 @@ def _apply_signature_overlays(writer: PdfWriter, overlays: List[Dict[str, Any]])
 
         try:
             img = Image.open(io.BytesIO(img_bytes)).convert("RGBA")
-            _stamp_with_fpdf2(writer, page_idx, img, x1, y1, w, h)
+            batch.add_image(page_idx, img, x1, y1, w, h)
         except Exception as exc:
             import logging
             logging.getLogger(__name__).warning("Signature overlay failed: %s", exc)
 
 
-def _stamp_text_with_fpdf2(
-    writer: PdfWriter,
-    page_idx: int,
-    text: str,
-    x: float,
-    y: float,
-    w: float,
-    h: float,
-    font_size: Optional[float] = None,
-    font: str = "Helvetica",
-    font_style: str = "",
-    align: str = "L",
-) -> None:
-    """Use fpdf2 to stamp text onto the target page at given coordinates."""
-    from fpdf import FPDF
-
-    page = writer.pages[page_idx]
-    media_box = page.mediabox
-    page_w = float(media_box.width)
-    page_h = float(media_box.height)
-
-    # fpdf2 uses top-left origin; PDF uses bottom-left
-    fpdf_y = page_h - y - h
-
-    size = font_size if font_size else min(h * 0.8, 18)
-
-    pdf = FPDF(unit="pt", format=(page_w, page_h))
-    pdf.add_page()
-    pdf.set_auto_page_break(False)
-    pdf.set_font(font, font_style, size=size)
-    pdf.set_xy(x, fpdf_y)
-    pdf.cell(w=w, h=h, text=text, align=align)
-
-    stamp_bytes = pdf.output()
-    stamp_reader = PdfReader(io.BytesIO(stamp_bytes))
-    page.merge_page(stamp_reader.pages[0])
-
-
-def _stamp_with_fpdf2(writer: PdfWriter, page_idx: int, img, x: float, y: float, w: float, h: float) -> None:
-    """Use fpdf2 to create a stamp PDF and merge onto the target page."""
-    from fpdf import FPDF
-
-    page = writer.pages[page_idx]
-    media_box = page.mediabox
-    page_w = float(media_box.width)
-    page_h = float(media_box.height)
-
-    # Browser canvases are larger than most PDF signature boxes. Crop empty
-    # transparent margins and fit the ink without distorting its proportions.
-    alpha = img.getchannel("A") if img.mode == "RGBA" else None
-    bounds = alpha.getbbox() if alpha is not None else None
-    if bounds:
-        padding = max(2, int(max(img.size) * 0.01))
-        left = max(0, bounds[0] - padding)
-        top = max(0, bounds[1] - padding)
-        right = min(img.width, bounds[2] + padding)
-        bottom = min(img.height, bounds[3] + padding)
-        img = img.crop((left, top, right, bottom))
-
-    if img.width <= 0 or img.height <= 0:
-        return
-    scale = min(w / img.width, h / img.height)
-    draw_w = img.width * scale
-    draw_h = img.height * scale
-    draw_x = x + (w - draw_w) / 2
-    draw_y = y + (h - draw_h) / 2
+# ---------------------------------------------------------------------------
+# Main fill function
+# ---------------------------------------------------------------------------
 
-    with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp_img:
-        img.save(tmp_img, "PNG")
-        tmp_img_path = tmp_img.name
+# Optional post-processing of the finished document (see _optimize_writer).
+PDF_OPTIMIZE_OUTPUT = os.getenv("PDF_OPTIMIZE_OUTPUT", "0") != "0"
+# Linearized ("fast web view") output; always a full rewrite.
+PDF_LINEARIZE_OUTPUT = os.getenv("PDF_LINEARIZE_OUTPUT", "0") != "0"
 
-    # fpdf2 uses top-left origin; PDF uses bottom-left
-    fpdf_y = page_h - draw_y - draw_h
 
-    pdf = FPDF(unit="pt", format=(page_w, page_h))
-    pdf.add_page()
-    pdf.set_auto_page_break(False)
-    pdf.image(tmp_img_path, x=draw_x, y=fpdf_y, w=draw_w, h=draw_h)
+def _compress_new_streams(writer: PdfWriter) -> None:
+    """Flate-encode unfiltered streams: appearances and merged page content."""
+    # In an incremental update, re-encoding a template stream would copy it
+    # into the update section; only objects added by the render qualify.
+    if writer.incremental and not hasattr(writer, "_original_hash"):
+        return
+    first = len(writer._original_hash) if writer.incremental else 0
+    for position in range(first, len(writer._objects)):
+        stream = writer._objects[position]
+        if not isinstance(stream, StreamObject) or "/Filter" in stream:
+            continue
+        stream.get_data()  # a ContentStream may hold parsed operations only
+        encoded = stream.flate_encode(level=6)
+        encoded.indirect_reference = stream.indirect_reference
+        writer._objects[position] = encoded
 
-    stamp_bytes = pdf.output()
 
-    stamp_reader = PdfReader(io.BytesIO(stamp_bytes))
-    page.merge_page(stamp_reader.pages[0])
+def _optimize_writer(writer: PdfWriter) -> None:
+    _compress_new_streams(writer)
+    if not writer.incremental:
+        # Drops what the fill detached (widgets, the deleted XFA packets) and
+        # merges identical objects such as the font dictionary every overlay
+        # stamp brings. In an incremental update both stay in the template
+        # prefix anyway.
+        writer.compress_identical_objects(remove_duplicates=True, remove_unreferenced=True)
 
-    try:
-        Path(tmp_img_path).unlink()
-    except Exception:
-        pass
 
+def _write_document(
+    writer: PdfWriter, source: SourceDocument, stream: BinaryIO, optimize: bool, linearize: bool = False
+) -> None:
+    if optimize or linearize:
+        _optimize_writer(writer)
+    if linearize:
+        write_linearized(writer, stream)
+        return
+    if not writer.incremental:
+        if not optimize:
+            writer.write(stream)
+            return
+        write_compact(writer, stream)
+        return
+    # The original bytes are already in memory; pypdf would re-read them
+    # from the shared reader stream.
+    write_increment(writer, source.data, stream)
+
+
+def _write_output(
+    writer: PdfWriter,
+    source: SourceDocument,
+    out_pdf: Union[str, Path, BinaryIO],
+    optimize: bool = False,
+    linearize: bool = False,
+) -> Union[Path, BinaryIO]:
+    """Write to a path, or into any writable binary stream (BytesIO, SpooledTemporaryFile)."""
+    if hasattr(out_pdf, "write"):
+        _write_document(writer, source, out_pdf, optimize, linearize)
+        return out_pdf
+    out_pdf = Path(out_pdf)
+    out_pdf.parent.mkdir(parents=True, exist_ok=True)
+    with out_pdf.open("wb") as f:
+        _write_document(writer, source, f, optimize, linearize)
+    return out_pdf
 
-# ---------------------------------------------------------------------------
-# Main fill function
-# ---------------------------------------------------------------------------
 
 def fill_acroform_pdf(
     src_pdf: Union[str, Path],
     field_values: Dict[str, Any],
-    out_pdf: Union[str, Path],
+    out_pdf: Union[str, Path, BinaryIO],
     signature_overlays: Optional[List[Dict[str, Any]]] = None,
-) -> Path:
+    incremental: Optional[bool] = None,
+    optimize: Optional[bool] = None,
+    linearize: Optional[bool] = None,
+) -> Union[Path, BinaryIO]:
+    """
+    Fill *src_pdf* with *field_values* and write the flattened result to
+    *out_pdf*, which may be a filesystem path or a writable binary stream.
+
+    With *incremental* (default: per PDF_OUTPUT_MODE) the output is the template
+    file followed by an update section holding only the changed objects.
+    With *optimize* (default: PDF_OPTIMIZE_OUTPUT) new streams are
+    compressed, duplicate and unreferenced objects removed and full output is
+    packed into object streams.
+    With *linearize* the output is optimized and linearized for fast web
+    view, and never incremental; PDF_LINEARIZE_OUTPUT turns it on for calls
+    that pass none of the three.
+    """
+    if linearize is None:
+        linearize = PDF_LINEARIZE_OUTPUT and incremental is None and optimize is None
+    if optimize is None:
+        optimize = PDF_OPTIMIZE_OUTPUT
+    if linearize:
+        incremental = False
     src_pdf = Path(src_pdf)
-    out_pdf = Path(out_pdf)
-    out_pdf.parent.mkdir(parents=True, exist_ok=True)
 
-    reader = PdfReader(str(src_pdf))
+    source = load_source(src_pdf)
 
     # clone_from properly deep-copies all objects (AcroForm, Fields, XFA)
-    # so indirect references stay valid in the writer.
-    writer = PdfWriter(clone_from=reader)
+    # so indirect references stay valid in the writer. The source itself is
+    # parsed once per file hash and shared between renders; hot templates
+    # hand out writers that were cloned ahead of time.
+    writer = checkout_writer(source, incremental)
 
     # We generate appearances ourselves below. Asking a viewer to regenerate
     # them can paint the same value over the flattened page content.
+    overlays = _OverlayBatch(writer)
     acroform = writer._root_object.get("/AcroForm")
     if acroform is None:
         # No AcroForm — still apply text/signature overlays for flat PDFs
         if signature_overlays:
-            _apply_signature_overlays(writer, signature_overlays)
-        with out_pdf.open("wb") as f:
-            writer.write(f)
-        return out_pdf
+            _apply_signature_overlays(overlays, signature_overlays)
+        overlays.merge()
+        return _write_output(writer, source, out_pdf, optimize, linearize)
 
     try:
         acro_obj = acroform.get_object() if hasattr(acroform, "get_object") else acroform
@@ -405,7 +542,7 @@ def fill_acroform_pdf(
         pass
 
     # name fallbacks (long -> short)
-    safe_values = _with_name_fallbacks(reader, field_values)
+    safe_values = _with_name_fallbacks(field_catalog(source), field_values)
 
     # Safety net: never write data URIs as text into PDF form fields
     for k, v in list(safe_values.items()):
@@ -414,15 +551,23 @@ def fill_acroform_pdf(
 
     # Generate and flatten appearance streams so completed values remain
     # visible in browser PDF renderers that do not regenerate AcroForm/XFA
-    # appearances (including pdf.js and PDFium).
+    # appearances (including pdf.js and PDFium). Text widgets use the
+    # precomputed engine; buttons, choices and anything it cannot encode
+    # still go through pypdf, but only on the pages that hold them.
     appearances_written = False
     try:
-        writer.update_page_form_field_values(
-            list(writer.pages),
-            safe_values,
-            auto_regenerate=False,
-            flatten=True,
-        )
+        if FAST_APPEARANCES:
+            remaining_values = fill_text_appearances(writer, source, safe_values)
+            pages = pages_for_values(writer, source, remaining_values) if remaining_values else []
+        else:
+            remaining_values, pages = safe_values, list(writer.pages)
+        if remaining_values:
+            writer.update_page_form_field_values(
+                pages,
+                remaining_values,
+                auto_regenerate=False,
+                flatten=True,
+            )
         appearances_written = True
     except Exception:
         pass
@@ -438,28 +583,34 @@ def fill_acroform_pdf(
 
         # flatten=True merges appearances into the page but leaves the form
         # widgets active. Mobile viewers render both unless we remove them.
+        # Widget positions come from the per-template index; only button
+        # widgets are dereferenced to read their per-render /AS state.
+        index = widget_index(source)
         selected_buttons: List[tuple[int, List[float]]] = []
         for page_idx, page in enumerate(writer.pages):
             annotations = page.get("/Annots")
             if not annotations:
                 continue
-            remaining = ArrayObject()
-            for annotation_ref in annotations:
+            annotations = annotations.get_object()
+            page_widgets = index.by_page.get(page_idx, [])
+            if page_idx >= len(index.annotation_counts) or len(annotations) != index.annotation_counts[page_idx]:
+                page_widgets, _ = index_page(page, page_idx)
+            widget_positions = set()
+            for widget in page_widgets:
+                widget_positions.add(widget.annot_index)
+                if widget.field_type != "/Btn" or not widget.rect:
+                    continue
                 try:
-                    annotation = annotation_ref.get_object()
-                    if annotation.get("/Subtype") == "/Widget":
-                        if (
-                            annotation.get("/FT") == "/Btn"
-                            and str(annotation.get("/AS", "/Off")) != "/Off"
-                            and annotation.get("/Rect")
-                        ):
-                            selected_buttons.append(
-                                (page_idx, [float(value) for value in annotation["/Rect"]])
-                            )
-                        continue
+                    annotation = annotations[widget.annot_index].get_object()
+                    if annotation.get("/FT") == "/Btn" and str(annotation.get("/AS", "/Off")) != "/Off":
+                        selected_buttons.append((page_idx, list(widget.rect)))
                 except Exception:
                     pass
-                remaining.append(annotation_ref)
+            remaining = ArrayObject(
+                annotation_ref
+                for annot_index, annotation_ref in enumerate(annotations)
+                if annot_index not in widget_positions
+            )
             if remaining:
                 page[NameObject("/Annots")] = remaining
             else:
@@ -470,8 +621,7 @@ def fill_acroform_pdf(
         # Stamp the selected state into the static page before delivery.
         for page_idx, rect in selected_buttons:
             x1, y1, x2, y2 = rect
-            _stamp_text_with_fpdf2(
-                writer,
+            overlays.add_text(
                 page_idx,
                 "X",
                 x1,
@@ -488,9 +638,7 @@ def fill_acroform_pdf(
 
     # apply drawn signature image overlays
     if signature_overlays:
-        _apply_signature_overlays(writer, signature_overlays)
+        _apply_signature_overlays(overlays, signature_overlays)
 
-    with out_pdf.open("wb") as f:
-        writer.write(f)
-
-    return out_pdf
+    overlays.merge()
+    return _write_output(writer, source, out_pdf, optimize, linearize)
@@ -0,0 +1,661 @@
+"""
+Fast appearance streams for text widgets.
+
+pypdf's ``update_page_form_field_values`` matches every widget against every
+value, re-resolves the widget's font (parsing widths, encodings and font
+files) and re-derives its layout for each render. None of that depends on the
+submitted values, so it is computed here once per source document: the
+resolved font, the /DA size and colour, the BBox, border and quadding of
+every text widget, and the fixed part of its content stream. A render then
+only lays out the escaped text, writes the flattened XObject and merges the
+drawing commands into each page with a single content-stream update.
+
+The generated streams are byte-for-byte what pypdf's ``TextStreamAppearance``
+produces; ``compare_with_pypdf`` checks that on a template. Values this
+engine does not handle (buttons, choice fields, text the widget font cannot
+encode, right-to-left text) are returned to the caller for the pypdf path.
+
+This builds on pypdf internals (the appearance-stream and font modules and
+private reader/writer helpers), tested against the pypdf range pinned in
+requirements.txt. ``SUPPORTED`` is False when the installed pypdf lacks any
+of them; importing this module fails outright when the modules are gone.
+Callers then use ``update_page_form_field_values`` for every value.
+"""
+from __future__ import annotations
+
+import io
+import logging
+from dataclasses import dataclass, field
+from operator import attrgetter
+from pathlib import Path
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence, Set, Tuple, Union
+
+from pypdf import PdfReader, PdfWriter, Transformation
+from pypdf._utils import is_char_rtl
+from pypdf.errors import PyPdfError
+from pypdf.generic import (
+    ArrayObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    IndirectObject,
+    NameObject,
+    NumberObject,
+    RectangleObject,
+    TextStringObject,
+)
+from pypdf.generic._appearance_stream import (
+    DEFAULT_FONT_SIZE_IN_MULTILINE,
+    TEXT_SPACE_TO_GLYPH_SPACE_FACTOR,
+    BaseStreamAppearance,
+    BaseStreamConfig,
+    TextAlignment,
+    TextStreamAppearance,
+    WidthWordGlyphs,
+)
+from pypdf.generic._color import Color, DeviceGray
+from pypdf.generic._font import Font
+
+from .pdf_cache import SourceDocument, load_source
+
+
+# The private helpers used below, by owner.
+_INTERNALS = (
+    (PdfReader, "_get_qualified_field_name"),
+    (PdfWriter, "_add_object"),
+    (PdfWriter, "_merge_content_stream_to_page"),
+    (Font, "_add_to_writer"),
+    (Font, "_get_typographic_maps"),
+    (TextStreamAppearance, "_parse_default_appearance"),
+    (TextStreamAppearance, "_find_annotation_font_resource"),
+    (Transformation, "_to_cm"),
+    (NameObject, "_sanitize"),
+)
+
+
+def _has_internals() -> bool:
+    writer = PdfWriter()
+    return all(hasattr(owner, name) for owner, name in _INTERNALS) and all(
+        hasattr(writer, name) for name in ("_root_object", "_objects")
+    )
+
+
+SUPPORTED = _has_internals()
+
+
+_FF_MULTILINE = 1 << 12
+_FF_COMB = 1 << 24
+_MIN_AUTO_FONT_SIZE = 4.0
+_AUTO_FONT_SIZE_STEP = 0.2
+
+
+@dataclass
+class TextAppearance:
+    """Everything about one text widget's appearance that does not depend on its value."""
+
+    page: int
+    annot_index: int
+    parent_is_self: bool                # the widget is its own field dictionary
+    font_name: str
+    font: Font
+    encodable: Optional[FrozenSet[str]]  # characters the font can encode; None if it cannot encode any
+    reverse_cmap: Dict[str, str]
+    encoding_cmap: Dict[str, bytes]
+    font_size: float
+    color_operator: str
+    rewritten_da: Optional[str]         # /DA with the resolved font name, if it changed
+    bbox: Tuple[Any, Any, Any, Any]
+    matrix: Optional[ArrayObject]
+    head: bytes                         # background and border operators
+    margin: Any
+    field_width: float
+    field_height: float
+    leading_factor: float
+    multiline: bool
+    comb: bool
+    max_length: Optional[int]
+    alignment: int
+    cm: str                             # translation of the flattened XObject onto the page
+    prefix: bytes = b""                 # head + clip + BT + /DA, for a fixed font size
+
+    def supports(self, text: Any) -> bool:
+        if not isinstance(text, str) or self.encodable is None:
+            return False
+        if not self.encodable.issuperset(text):
+            return False
+        return text.isascii() or not any(is_char_rtl(char) for char in text)
+
+    def _glyphs(self, text: str) -> str:
+        reverse_cmap = self.reverse_cmap
+        return "".join(reverse_cmap.get(char, char) for char in text)
+
+    def _encode(self, glyphs: str) -> bytes:
+        encoding_cmap = self.encoding_cmap
+        return b"".join(
+            encoding_cmap.get(glyph, bytes((ord(glyph),)) if ord(glyph) < 256 else b"?") for glyph in glyphs
+        )
+
+    def _line(self, text: str, font_size: float) -> WidthWordGlyphs:
+        glyphs = self._glyphs(text)
+        return WidthWordGlyphs(
+            width=self.font.get_text_width(glyphs) * font_size / TEXT_SPACE_TO_GLYPH_SPACE_FACTOR,
+            word=text,
+            glyphs=glyphs,
+        )
+
+    def _opening(self, font_size: float) -> bytes:
+        margin = self.margin
+        return (
+            f"q\n/Tx BMC \nq\n"
+            f"{2 * max(margin, 1)} {margin} "
+            f"{round(self.field_width - 2 * max(margin, 1), 3)} {round(self.field_height - margin, 3)} re\n"
+            f"W\nBT\n{self.font_name} {font_size} Tf {self.color_operator}\n"
+        ).encode()
+
+    def _wrap(self, paragraphs: List[List[WidthWordGlyphs]], font_size: float) -> Tuple[List[WidthWordGlyphs], float]:
+        """Word-wrap *paragraphs*, shrinking the font until the lines fit (pypdf's ``_scale_text``)."""
+        font = self.font
+        while True:
+            wrapped: List[WidthWordGlyphs] = []
+            words: List[WidthWordGlyphs] = []
+            line_width: float = 0
+            space_width = font.space_width * font_size / TEXT_SPACE_TO_GLYPH_SPACE_FACTOR
+
+            def flush(width: float) -> None:
+                wrapped.append(WidthWordGlyphs(
+                    width=width,
+                    word=" ".join(map(attrgetter("word"), words)),
+                    glyphs=font.space_char.join(map(attrgetter("glyphs"), words)),
+                ))
+
+            for paragraph in paragraphs:
+                for i, word in enumerate(paragraph):
+                    word_width = word.width * font_size
+                    if line_width + word_width + (space_width if i else 0) > self.field_width and words:
+                        flush(line_width)
+                        words = [word]
+                        line_width = word_width
+                    elif not words and word_width > self.field_width:
+                        wrapped.append(WidthWordGlyphs(width=word_width, word=word.word, glyphs=word.glyphs))
+                        words = []
+                        line_width = 0
+                    else:
+                        if words:
+                            line_width += space_width
+                        words.append(word)
+                        line_width += word_width
+                if words:
+                    flush(line_width)
+                    words = []
+                    line_width = 0
+
+            height = font_size + (len(wrapped) - 1) * self.leading_factor * font_size
+            if height > self.field_height and font_size - _AUTO_FONT_SIZE_STEP >= _MIN_AUTO_FONT_SIZE:
+                font_size -= _AUTO_FONT_SIZE_STEP
+                continue
+            return wrapped, round(font_size, 1)
+
+    def _layout(self, text: str) -> Tuple[List[WidthWordGlyphs], float]:
+        font_size = self.font_size
+        if font_size == 0:
+            if self.multiline:
+                paragraphs: List[List[WidthWordGlyphs]] = []
+                for line in text.splitlines():
+                    if not line.strip():
+                        paragraphs.append([WidthWordGlyphs(width=0.0, word="", glyphs="")])
+                        continue
+                    paragraphs.append([
+                        WidthWordGlyphs(
+                            width=self.font.get_text_width(word) / TEXT_SPACE_TO_GLYPH_SPACE_FACTOR,
+                            word=word,
+                            glyphs=self._glyphs(word),
+                        )
+                        for word in line.split(" ")
+                    ])
+                return self._wrap(paragraphs, DEFAULT_FONT_SIZE_IN_MULTILINE)
+            glyphs = self._glyphs(text)
+            unscaled = self.font.get_text_width(glyphs) / TEXT_SPACE_TO_GLYPH_SPACE_FACTOR
+            font_size = round(max(
+                min(self.field_height / self.leading_factor, self.field_width / (unscaled or 1)),
+                _MIN_AUTO_FONT_SIZE,
+            ), 1)
+            return [WidthWordGlyphs(width=unscaled * font_size, word=text, glyphs=glyphs)], font_size
+        if self.comb:
+            limit = self.max_length or len(text)
+            return [self._line(char, font_size) for char in text[:limit]], font_size
+        return [self._line(line, font_size) for line in text.splitlines()], font_size
+
+    def content(self, text: str) -> bytes:
+        """Return the appearance stream data for *text*."""
+        lines, font_size = self._layout(text)
+        font_descriptor = self.font.font_descriptor
+        if self.multiline:
+            y_offset = (
+                self.field_height + self.margin
+                - font_descriptor.bbox[3] * font_size / TEXT_SPACE_TO_GLYPH_SPACE_FACTOR
+            )
+        else:
+            y_offset = self.margin + (
+                (self.field_height - font_descriptor.ascent * font_size / TEXT_SPACE_TO_GLYPH_SPACE_FACTOR) / 2
+            )
+
+        parts = [self.prefix if self.prefix and font_size == self.font_size else self.head + self._opening(font_size)]
+        width = self.bbox[2]
+        cell_width = width / self.max_length if self.comb and self.max_length else 0
+        current_x: float = 0
+        type0 = self.font.sub_type == "Type0"
+        for line_number, (line_width, _, glyphs) in enumerate(lines):
+            if cell_width:
+                x = line_number * cell_width + (cell_width - line_width) / 2
+            elif self.alignment == TextAlignment.RIGHT:
+                x = width - max(self.margin, 1) * 2 - line_width
+            elif self.alignment == TextAlignment.CENTER:
+                x = (width - line_width) / 2
+            else:
+                x = max(self.margin, 1) * 2
+            if line_number == 0:
+                y: float = y_offset
+            elif self.comb:
+                y = 0.0
+            else:
+                y = -font_size * self.leading_factor
+            parts.append(f"{round(x - current_x, 3)} {round(y, 3)} Td\n".encode())
+            current_x = x
+
+            encoded = self._encode(glyphs)
+            if type0:
+                parts.append(b"<" + encoded.hex().encode() + b"> Tj\n")
+            else:
+                escaped = encoded.replace(b"\\", b"\\\\").replace(b"(", rb"\(").replace(b")", rb"\)")
+                parts.append(b"(" + escaped + b") Tj\n")
+        parts.append(b"ET\nQ\nEMC\nQ\n")
+        return b"".join(parts)
+
+    def stream(self, text: str, font_ref: Any) -> DecodedStreamObject:
+        """Return the appearance XObject for *text*, laid out like ``TextStreamAppearance``."""
+        stream = DecodedStreamObject()
+        stream[NameObject("/Type")] = NameObject("/XObject")
+        stream[NameObject("/Subtype")] = NameObject("/Form")
+        stream[NameObject("/BBox")] = RectangleObject(self.bbox)
+        if self.matrix is not None:
+            stream[NameObject("/Matrix")] = ArrayObject(self.matrix)
+        data = self.content(text)
+        stream.set_data(data)
+        stream[NameObject("/Length")] = NumberObject(len(data))
+        stream[NameObject("/Resources")] = DictionaryObject({
+            NameObject("/Font"): DictionaryObject({NameObject(self.font_name): font_ref}),
+        })
+        return stream
+
+
+@dataclass
+class AppearanceIndex:
+    widgets: List[TextAppearance]
+    by_name: Dict[str, List[TextAppearance]]    # value key -> text widgets it fills
+    deferred: Set[str] = field(default_factory=set)  # keys that also match widgets left to pypdf
+    pages_by_name: Dict[str, Set[int]] = field(default_factory=dict)  # value key -> pages of its widgets
+    checked: Set[str] = field(default_factory=set)   # keys of buttons that are on in the template
+    annotation_counts: List[int] = field(default_factory=list)
+
+
+_FontMaps = Tuple[Optional[FrozenSet[str]], Dict[str, str], Dict[str, bytes]]
+
+
+def _font_maps(font: Font) -> _FontMaps:
+    """Return the characters *font* can encode and its unicode -> glyph -> bytes maps."""
+    if font.character_map:
+        encodable: Optional[FrozenSet[str]] = frozenset(font.character_map.values())
+    elif isinstance(font.encoding, dict):
+        encodable = frozenset(font.encoding.values())
+    else:
+        encodable = None
+    return (encodable, *font._get_typographic_maps())
+
+
+def _text_appearance(
+    page: Any,
+    page_idx: int,
+    annot_index: int,
+    acro_form: Any,
+    parent: Any,
+    annotation: Any,
+    fonts: Dict[Tuple[str, int], Tuple[str, Font]],
+    font_maps: Dict[int, _FontMaps],
+) -> TextAppearance:
+    """Resolve one widget the way ``TextStreamAppearance.from_text_annotation`` does."""
+    raw_rect = annotation["/Rect"]
+    if page.get_inherited("/Rotate") in {90, 270}:
+        rectangle = RectangleObject((0, 0, abs(raw_rect[3] - raw_rect[1]), abs(raw_rect[2] - raw_rect[0])))
+    else:
+        rectangle = RectangleObject((0, 0, abs(raw_rect[2] - raw_rect[0]), abs(raw_rect[3] - raw_rect[1])))
+
+    default_appearance = annotation.get_inherited("/DA", acro_form.get("/DA", None))
+    default_appearance = (
+        default_appearance.get_object() if default_appearance else TextStringObject("/Helv 0 Tf 0 g")
+    )
+    da_font_name, font_size, font_color = TextStreamAppearance._parse_default_appearance(default_appearance)
+    if da_font_name is None:
+        logging.getLogger(__name__).warning(
+            "Could not read a Tf operator from %r; defaulting to /Helv 0 Tf.", str(default_appearance)
+        )
+        da_font_name, font_size = "/Helv", 0.0
+    # Field-level /DR overrides the AcroForm one; both live as long as the reader.
+    resources = annotation.get_inherited("/DR", None)
+    font_key = (da_font_name, id(resources) if resources is not None else 0)
+    if font_key not in fonts:
+        fonts[font_key] = TextStreamAppearance._find_annotation_font_resource(da_font_name, annotation, acro_form, "")
+    font_name, font = fonts[font_key]
+
+    field_flags = parent.get("/Ff", 0)
+    border_width = 1
+    border_style = "/S"
+    if "/BS" in parent:
+        border_width = parent["/BS"].get("/W", border_width)
+        border_style = parent["/BS"].get("/S", border_style)
+    rotation = 0
+    border_color = background_color = None
+    characteristics = parent.get_inherited("/MK", None)
+    if isinstance(characteristics, DictionaryObject):
+        rotation = int(characteristics.get("/R", 0))
+        border_color = Color.from_normalized_values(characteristics.get("/BC"))
+        background_color = Color.from_normalized_values(characteristics.get("/BG"))
+    layout = BaseStreamConfig(
+        rectangle=rectangle,
+        border_width=border_width,
+        border_style=border_style,
+        border_color=border_color,
+        background_color=background_color,
+        rotation=rotation,
+    )
+    base = BaseStreamAppearance(layout)
+
+    factor = 2 if layout.border_style in {"/B", "/I"} else 1
+    margin = layout.border_width * factor
+    if id(font) not in font_maps:
+        font_maps[id(font)] = _font_maps(font)
+    encodable, reverse_cmap, encoding_cmap = font_maps[id(font)]
+
+    spec = TextAppearance(
+        page=page_idx,
+        annot_index=annot_index,
+        parent_is_self=parent is annotation,
+        font_name=font_name,
+        font=font,
+        encodable=encodable,
+        reverse_cmap=reverse_cmap,
+        encoding_cmap=encoding_cmap,
+        font_size=font_size,
+        color_operator=(font_color or DeviceGray()).as_operator(),
+        rewritten_da=(
+            default_appearance.replace(da_font_name, font_name) if font_name != da_font_name else None
+        ),
+        bbox=tuple(rectangle),
+        matrix=base.get("/Matrix"),
+        head=base._ap_stream_data,
+        margin=margin,
+        field_width=rectangle.width - 4 * max(margin, 1),
+        field_height=rectangle.height - 2 * margin,
+        leading_factor=(
+            (font.font_descriptor.bbox[3] - font.font_descriptor.bbox[1]) / TEXT_SPACE_TO_GLYPH_SPACE_FACTOR
+        ),
+        multiline=bool(field_flags & _FF_MULTILINE),
+        comb=bool(field_flags & _FF_COMB),
+        max_length=annotation.get("/MaxLen") if field_flags & _FF_COMB else None,
+        alignment=parent.get("/Q", TextAlignment.LEFT),
+        cm=Transformation().translate(raw_rect[0], raw_rect[1])._to_cm(),
+    )
+    if font_size != 0:
+        spec.prefix = spec.head + spec._opening(font_size)
+    return spec
+
+
+def build_appearance_index(reader: PdfReader) -> AppearanceIndex:
+    index = AppearanceIndex(widgets=[], by_name={})
+    acro_form = reader.trailer["/Root"].get("/AcroForm")
+    acro_form = acro_form.get_object() if acro_form is not None else DictionaryObject()
+    # Widgets overwhelmingly share a handful of fonts; resolve each one once.
+    fonts: Dict[Tuple[str, int], Tuple[str, Font]] = {}
+    font_maps: Dict[int, _FontMaps] = {}
+    for page_idx, page in enumerate(reader.pages):
+        annotations = page.get("/Annots")
+        annotations = annotations.get_object() if annotations else []
+        index.annotation_counts.append(len(annotations))
+        for annot_index, annotation_ref in enumerate(annotations):
+            annotation = annotation_ref.get_object()
+            if annotation.get("/Subtype", "") != "/Widget":
+                continue
+            # pypdf addresses a widget by the qualified name or the /T of the
+            # dictionary that carries /FT and /T (the widget or its parent).
+            if "/FT" in annotation and "/T" in annotation:
+                parent = annotation
+            else:
+                parent = annotation.get("/Parent", DictionaryObject()).get_object()
+            names = {reader._get_qualified_field_name(parent=parent)}
+            if parent.get("/T") is not None:
+                names.add(str(parent["/T"]))
+            for name in names:
+                index.pages_by_name.setdefault(name, set()).add(page_idx)
+            if str(annotation.get("/AS", "/Off")) != "/Off":
+                index.checked.update(names)
+
+            spec = None
+            if parent.get("/FT") == "/Tx" and "/Rect" in annotation:
+                try:
+                    spec = _text_appearance(
+                        page, page_idx, annot_index, acro_form, parent, annotation, fonts, font_maps
+                    )
+                except Exception as exc:
+                    logging.getLogger(__name__).warning("Appearance precompute failed for %s: %s", names, exc)
+            if spec is None:
+                index.deferred.update(names)
+                continue
+            index.widgets.append(spec)
+            for name in names:
+                index.by_name.setdefault(name, []).append(spec)
+    return index
+
+
+def appearance_index(source: SourceDocument) -> AppearanceIndex:
+    """Return the (cached) text appearance index of a parsed template."""
+    index = source.derived.get("appearances")
+    if index is None:
+        with source.lock:
+            index = source.derived.get("appearances")
+            if index is None:
+                index = source.derived["appearances"] = build_appearance_index(source.reader)
+    return index
+
+
+# ---------------------------------------------------------------------------
+# Render time
+# ---------------------------------------------------------------------------
+
+def _font_reference(writer: PdfWriter, acro_form: Any, page: Any, spec: TextAppearance) -> Any:
+    """Make the widget font available in /DR and the page resources, like pypdf does when flattening."""
+    name = NameObject(spec.font_name)
+    dr_fonts = acro_form.setdefault(NameObject("/DR"), DictionaryObject()).get_object()
+    dr_fonts = dr_fonts.setdefault(NameObject("/Font"), DictionaryObject()).get_object()
+    if name not in dr_fonts:
+        reference = spec.font._add_to_writer(writer, dr_fonts, name)
+    else:
+        reference = dr_fonts[name]
+    reference = getattr(reference, "indirect_reference", reference)
+    page_fonts = page["/Resources"].setdefault(NameObject("/Font"), DictionaryObject()).get_object()
+    if name not in page_fonts:
+        page_fonts[name] = reference
+    return reference
+
+
+def _appearance_for(
+    writer: PdfWriter, acro_form: Any, page: Any, annotation: Any, spec: TextAppearance, text: str
+) -> DecodedStreamObject:
+    font_ref = _font_reference(writer, acro_form, page, spec)
+    if spec.rewritten_da is not None:
+        annotation[NameObject("/DA")] = TextStringObject(spec.rewritten_da)
+    stream = spec.stream(text, font_ref)
+    # Keep entries of an existing appearance (e.g. /Matrix), as pypdf does.
+    existing = annotation.get("/AP")
+    if existing is not None:
+        for key, value in existing.get_object().get("/N", {}).items():
+            if key in {"/BBox", "/Length", "/Subtype", "/Type", "/Filter"}:
+                continue
+            if key == "/Resources":
+                if "/Font" not in value:
+                    value.get_object()[NameObject("/Font")] = DictionaryObject()
+                value["/Font"].get_object()[NameObject(spec.font_name)] = font_ref
+            else:
+                stream[key] = value
+    return stream
+
+
+def _attach(writer: PdfWriter, annotation: Any, stream: DecodedStreamObject) -> Any:
+    """Install *stream* as the widget's normal appearance and return its reference."""
+    appearance = annotation.get("/AP")
+    if appearance is None:
+        reference = writer._add_object(stream)
+        annotation[NameObject("/AP")] = DictionaryObject({NameObject("/N"): reference})
+        return reference
+    appearance = appearance.get_object()
+    current = appearance.raw_get("/N") if "/N" in appearance else None
+    if hasattr(current, "idnum"):
+        writer._objects[current.idnum - 1] = stream
+        stream.indirect_reference = IndirectObject(current.idnum, 0, writer)
+        return stream.indirect_reference
+    reference = writer._add_object(stream)
+    appearance[NameObject("/N")] = reference
+    return reference
+
+
+def _is_blank(value: Any) -> bool:
+    return value is None or value == "" or value == "/Off"
+
+
+def _matches_template(writer: PdfWriter, index: AppearanceIndex, page_indices: Any) -> bool:
+    """True if the given pages of *writer* still have the annotations the index was built from."""
+    pages = writer.pages
+    for page_idx in page_indices:
+        if page_idx >= len(index.annotation_counts) or page_idx >= len(pages):
+            return False
+        annotations = pages[page_idx].get("/Annots")
+        if (len(annotations.get_object()) if annotations else 0) != index.annotation_counts[page_idx]:
+            return False
+    return True
+
+
+def fill_text_appearances(writer: PdfWriter, source: SourceDocument, values: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Set, generate and flatten the text widgets of *writer* (cloned from
+    *source*) for *values*. Returns the values this engine did not handle,
+    to be passed to ``update_page_form_field_values``.
+
+    Blank values (None, "" and /Off) draw nothing once the widgets are
+    removed, so they are dropped here; an /Off for a button that is on in
+    the template is still returned so that pypdf switches it off.
+    """
+    acro_form = writer._root_object["/AcroForm"]
+    if "/Fields" not in acro_form:
+        raise PyPdfError("No /Fields dictionary in PDF of PdfWriter Object")
+    index = appearance_index(source)
+
+    leftover: Dict[str, Any] = {}
+    by_page: Dict[int, List[Tuple[int, int, str, str, TextAppearance]]] = {}
+    for order, (key, value) in enumerate(values.items()):
+        if _is_blank(value):
+            if key in index.checked:
+                leftover[key] = value
+            continue
+        specs = index.by_name.get(key)
+        if key in index.deferred or (specs and not all(spec.supports(value) for spec in specs)):
+            leftover[key] = value
+            continue
+        for spec in specs or ():
+            by_page.setdefault(spec.page, []).append((spec.annot_index, order, key, value, spec))
+
+    if not _matches_template(writer, index, by_page):
+        # The document does not look like the indexed template: let pypdf do it all.
+        return dict(values)
+    pages = writer.pages
+
+    for page_idx, entries in by_page.items():
+        page = pages[page_idx]
+        annotations = page["/Annots"]
+        resources = page["/Resources"]
+        xobjects = resources.setdefault(NameObject("/XObject"), DictionaryObject()).get_object()
+        commands: List[bytes] = []
+        # pypdf draws in annotation order, then in value order.
+        for annot_index, _, key, value, spec in sorted(entries, key=lambda entry: entry[:2]):
+            annotation = annotations[annot_index].get_object()
+            parent = annotation if spec.parent_is_self else annotation["/Parent"]
+            parent[NameObject("/V")] = TextStringObject(value)
+            stream = _appearance_for(writer, acro_form, page, annotation, spec, value)
+            reference = _attach(writer, annotation, stream)
+
+            name = base_name = NameObject(f"/Fm_{key}")._sanitize()
+            suffix = 1
+            while name in xobjects:
+                # Kids of one field share a name; each keeps its own appearance.
+                suffix += 1
+                name = NameObject(f"{base_name}_{suffix}")
+            xobjects[name] = reference
+            commands.append(f"q\n{spec.cm}\n{name} Do\nQ".encode())
+        if commands:
+            writer._merge_content_stream_to_page(page, b"\n".join(commands))
+    return leftover
+
+
+def pages_for_values(writer: PdfWriter, source: SourceDocument, values: Dict[str, Any]) -> List[Any]:
+    """Return the pages of *writer* that hold a widget addressed by one of *values*."""
+    index = appearance_index(source)
+    page_indices: Set[int] = set()
+    for key in values:
+        page_indices.update(index.pages_by_name.get(key, ()))
+    if not _matches_template(writer, index, range(len(writer.pages))):
+        return list(writer.pages)
+    return [writer.pages[page_idx] for page_idx in sorted(page_indices)]
+
+
+# ---------------------------------------------------------------------------
+# Comparison against pypdf
+# ---------------------------------------------------------------------------
+
+SAMPLE_TEXTS: Tuple[str, ...] = (
+    "",
+    "Jane Q. Public",
+    "123-45-6789",
+    "(555) 010-0199 \\ ext. 7",
+    "First line\nSecond line",
+    "A considerably longer value that has to wrap or shrink to fit inside a narrow form field " * 3,
+)
+
+
+def _serialized(stream: DecodedStreamObject) -> bytes:
+    buffer = io.BytesIO()
+    stream.write_to_stream(buffer)
+    return buffer.getvalue()
+
+
+def compare_with_pypdf(src_pdf: Union[str, Path], samples: Sequence[str] = SAMPLE_TEXTS) -> List[str]:
+    """
+    Generate every text widget of *src_pdf* with both this engine and
+    pypdf's ``TextStreamAppearance`` for each sample value, and return a
+    description of every appearance stream whose bytes differ.
+    """
+    source = load_source(src_pdf)
+    index = appearance_index(source)
+    writer = source.clone_writer()
+    acro_form = writer._root_object.get("/AcroForm")
+    mismatches: List[str] = []
+    for spec in index.widgets:
+        page = writer.pages[spec.page]
+        annotation = page["/Annots"][spec.annot_index].get_object()
+        parent = annotation if spec.parent_is_self else annotation["/Parent"]
+        for text in samples:
+            if not spec.supports(text):
+                continue
+            parent[NameObject("/V")] = TextStringObject(text)
+            expected = TextStreamAppearance.from_text_annotation(
+                writer, page, True, acro_form, parent, annotation
+            )
+            actual = _appearance_for(writer, acro_form, page, annotation, spec, text)
+            if _serialized(expected) != _serialized(actual):
+                mismatches.append(f"page {spec.page} annot {spec.annot_index}: {text[:24]!r}")
+    return mismatches
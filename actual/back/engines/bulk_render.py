@@ -0,0 +1,239 @@
+"""
+Bulk rendering: many records for one template in, a ZIP of PDFs out.
+
+Records are read incrementally from the request body (a JSON list, NDJSON or
+CSV), at most ``concurrency`` of them are rendered at a time, and each PDF is
+written to the ZIP and handed to the client as soon as it finishes. Server
+memory therefore depends on the window size, not on the batch size.
+
+A record that fails does not abort the batch: ``manifest.json``, written
+last, lists the file for every record or the reason it has none.
+"""
+from __future__ import annotations
+
+import asyncio
+import csv
+import json
+import os
+import zipfile
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List
+
+
+BULK_RENDER_MAX_RECORDS = int(os.getenv("BULK_RENDER_MAX_RECORDS", "10000"))
+# A JSON list has to be parsed whole, so its body is capped; NDJSON and CSV
+# are read a record at a time and only each record is.
+BULK_RENDER_MAX_JSON_BYTES = int(os.getenv("BULK_RENDER_MAX_JSON_BYTES", str(32 * 1024 * 1024)))
+BULK_RENDER_MAX_RECORD_BYTES = int(os.getenv("BULK_RENDER_MAX_RECORD_BYTES", str(1024 * 1024)))
+
+NDJSON_TYPES = {"application/x-ndjson", "application/ndjson", "application/jsonl", "application/x-jsonlines"}
+CSV_TYPES = {"text/csv", "application/csv"}
+
+
+class BulkInputError(ValueError):
+    """The request body is not a readable list of records."""
+
+
+class BulkInputTooLarge(BulkInputError):
+    """A record, or a JSON list body, is over its byte limit."""
+
+
+def _record_too_large() -> BulkInputTooLarge:
+    return BulkInputTooLarge(f"Records are limited to {BULK_RENDER_MAX_RECORD_BYTES} bytes each")
+
+
+async def _lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Split a byte stream into lines, keeping the line endings."""
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        *complete, pending = pending.split(b"\n")
+        if len(pending) > BULK_RENDER_MAX_RECORD_BYTES:
+            raise _record_too_large()
+        for line in complete:
+            if len(line) >= BULK_RENDER_MAX_RECORD_BYTES:
+                raise _record_too_large()
+            yield line + b"\n"
+    if pending:
+        yield pending
+
+
+def _record_data(record: Any, position: int) -> Dict[str, Any]:
+    """Accept either a bare ``data`` object or ``{"data": {...}}``."""
+    if isinstance(record, dict) and isinstance(record.get("data"), dict):
+        return record["data"]
+    if isinstance(record, dict):
+        return record
+    raise BulkInputError(f"Record {position} is not a JSON object")
+
+
+async def _ndjson_records(chunks: AsyncIterator[bytes]) -> AsyncIterator[Dict[str, Any]]:
+    position = 0
+    async for line in _lines(chunks):
+        if not line.strip():
+            continue
+        position += 1
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            raise BulkInputError(f"Record {position} is not valid JSON: {exc}") from exc
+        yield _record_data(record, position)
+
+
+async def _csv_records(chunks: AsyncIterator[bytes]) -> AsyncIterator[Dict[str, Any]]:
+    # A "\n" byte never occurs inside a multi-byte UTF-8 sequence, so lines
+    # decode independently; csv.reader rejoins quoted values that span lines.
+    buffered: List[str] = []
+    buffered_bytes = 0
+    header: List[str] = []
+    decoding = "utf-8-sig"
+    async for line in _lines(chunks):
+        buffered.append(line.decode(decoding))
+        decoding = "utf-8"
+        buffered_bytes += len(line)
+        if buffered_bytes > BULK_RENDER_MAX_RECORD_BYTES:
+            raise _record_too_large()
+        if "".join(buffered).count('"') % 2:
+            continue  # inside a quoted value that continues on the next line
+        try:
+            row = next(csv.reader(buffered), [])
+        except csv.Error as exc:
+            raise BulkInputError(f"Invalid CSV: {exc}") from exc
+        buffered.clear()
+        buffered_bytes = 0
+        if not header:
+            header = [name.strip() for name in row]
+            continue
+        if not any(cell.strip() for cell in row):
+            continue
+        # Empty cells are unanswered questions, as in the interactive form.
+        yield {name: value for name, value in zip(header, row) if name and value != ""}
+    if buffered:
+        raise BulkInputError("Invalid CSV: unterminated quoted value")
+
+
+async def _json_records(chunks: AsyncIterator[bytes]) -> AsyncIterator[Dict[str, Any]]:
+    parts: List[bytes] = []
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        if size > BULK_RENDER_MAX_JSON_BYTES:
+            raise BulkInputTooLarge(
+                f"JSON bodies are limited to {BULK_RENDER_MAX_JSON_BYTES} bytes; send larger batches as NDJSON or CSV"
+            )
+        parts.append(chunk)
+    body = b"".join(parts)
+    try:
+        payload = json.loads(body or b"null")
+    except ValueError as exc:
+        raise BulkInputError(f"Body is not valid JSON: {exc}") from exc
+    if isinstance(payload, dict) and isinstance(payload.get("records"), list):
+        payload = payload["records"]
+    if not isinstance(payload, list):
+        raise BulkInputError('Body must be a JSON list of records or {"records": [...]}')
+    for position, record in enumerate(payload, start=1):
+        yield _record_data(record, position)
+
+
+async def iter_records(chunks: AsyncIterator[bytes], content_type: str) -> AsyncIterator[Dict[str, Any]]:
+    """Yield the ``data`` object of every record in the body, by content type."""
+    kind = content_type.split(";", 1)[0].strip().lower()
+    if kind in NDJSON_TYPES:
+        records = _ndjson_records(chunks)
+    elif kind in CSV_TYPES:
+        records = _csv_records(chunks)
+    else:
+        records = _json_records(chunks)
+    count = 0
+    async for record in records:
+        count += 1
+        if count > BULK_RENDER_MAX_RECORDS:
+            raise BulkInputError(f"At most {BULK_RENDER_MAX_RECORDS} records per request")
+        yield record
+
+
+class _ZipSink:
+    """Write-only file object whose contents are drained after every ZIP member."""
+
+    def __init__(self) -> None:
+        self._chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _error_message(exc: BaseException) -> str:
+    # HTTPException from the render preparation carries its message in .detail.
+    return str(getattr(exc, "detail", None) or exc or type(exc).__name__)
+
+
+async def stream_zip(
+    records: AsyncIterator[Dict[str, Any]],
+    render: Callable[[Dict[str, Any]], Awaitable[bytes]],
+    file_name: Callable[[int], str],
+    concurrency: int,
+) -> AsyncIterator[bytes]:
+    """Render *records* at most *concurrency* at a time and yield the ZIP as it grows."""
+    sink = _ZipSink()
+    archive = zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED)
+    running: Dict[asyncio.Task, int] = {}
+    manifest: List[Dict[str, Any]] = []
+    input_error = None
+    exhausted = False
+    position = 0
+    try:
+        while True:
+            while not exhausted and len(running) < max(1, concurrency):
+                try:
+                    data = await records.__anext__()
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+                except BulkInputError as exc:
+                    input_error = str(exc)
+                    exhausted = True
+                    break
+                position += 1
+                running[asyncio.create_task(render(data))] = position
+            if not running:
+                break
+
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                record = running.pop(task)
+                try:
+                    content = task.result()
+                except Exception as exc:
+                    manifest.append({"record": record, "error": _error_message(exc)})
+                    continue
+                name = file_name(record)
+                # Deflating a few hundred kilobytes is CPU work; keep it off the event loop.
+                await asyncio.to_thread(archive.writestr, name, content)
+                manifest.append({"record": record, "file": name})
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+
+        manifest.sort(key=lambda entry: entry["record"])
+        summary = {
+            "records": position,
+            "rendered": sum(1 for entry in manifest if "file" in entry),
+            "failed": sum(1 for entry in manifest if "error" in entry),
+            "input_error": input_error,
+            "items": manifest,
+        }
+        archive.writestr("manifest.json", json.dumps(summary, indent=2))
+        archive.close()
+        yield sink.drain()
+    finally:
+        # The client went away, or the body could not be read: stop the window.
+        for task in running:
+            task.cancel()
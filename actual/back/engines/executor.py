@@ -0,0 +1,379 @@
+"""
+Worker processes for PDF renders (and packet merges).
+
+pypdf and fpdf2 are pure Python, so renders on the web server's thread pool
+only contend for the GIL and starve every other endpoint. Renders run here in
+a small set of worker processes instead. Each worker warms the source cache,
+appearance index and writer pool of the hot templates when it starts.
+
+Admission is bounded: at most ``workers + queue_max`` renders are accepted
+at once, and ``submit`` raises ``RenderBusy`` beyond that so the API can
+answer 503 with Retry-After instead of queueing without limit. The timeout
+counts from the moment a worker takes the job, not from submission, so time
+spent in the queue never fails a render. A render that exceeds it has its
+worker process terminated and replaced, because a process cannot be
+interrupted in the middle of a job; renders on the other workers carry on.
+"""
+from __future__ import annotations
+
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+
+# 0 renders in the calling thread (no worker processes), e.g. for tests.
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(min(4, os.cpu_count() or 1))))
+RENDER_QUEUE_MAX = int(os.getenv("RENDER_QUEUE_MAX", "16"))
+RENDER_TIMEOUT_SECONDS = float(os.getenv("RENDER_TIMEOUT_SECONDS", "30"))
+RENDER_RETRY_AFTER_SECONDS = int(os.getenv("RENDER_RETRY_AFTER_SECONDS", "2"))
+
+
+class RenderBusy(Exception):
+    """The render queue is full, or a worker is being replaced; retry later."""
+
+    def __init__(self, message: str, retry_after: int = RENDER_RETRY_AFTER_SECONDS):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RenderTimeout(Exception):
+    """A render did not finish within the configured timeout."""
+
+
+def _warm_worker(pdf_paths: Sequence[str]) -> None:
+    from .acroform import FAST_APPEARANCES
+    from .pdf_cache import load_source, prefill_writer_pool
+
+    for pdf_path in pdf_paths:
+        try:
+            prefill_writer_pool(pdf_path)
+            if FAST_APPEARANCES:
+                from .appearance import appearance_index
+
+                appearance_index(load_source(pdf_path))
+        except Exception as exc:
+            logging.getLogger(__name__).warning("Render worker warm-up failed for %s: %s", pdf_path, exc)
+
+
+def _cache_stats() -> Dict[str, Any]:
+    """This process's source cache and writer pool counters (see engines.pdf_cache)."""
+    from .pdf_cache import source_cache_stats, writer_pool_stats
+
+    return {"pdf_sources": source_cache_stats(), "writer_pools": writer_pool_stats()}
+
+
+def _add_counts(total: Dict[str, Any], counts: Dict[str, Any]) -> None:
+    for name, value in counts.items():
+        if isinstance(value, dict):
+            _add_counts(total.setdefault(name, {}), value)
+        elif isinstance(value, (int, float)):
+            total[name] = total.get(name, 0) + value
+
+
+def _worker_main(conn: Any, pdf_paths: Sequence[str]) -> None:
+    """Body of a worker process: warm up, then run jobs from *conn* one at a time.
+
+    Every reply carries the worker's cache counters, which live in this
+    process and not in the API's.
+    """
+    _warm_worker(pdf_paths)
+    conn.send(("ready", None, _cache_stats()))
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            return
+        if job is None:
+            return
+        fn, args = job
+        try:
+            reply = ("ok", fn(*args), _cache_stats())
+        except Exception as exc:
+            reply = ("error", exc, _cache_stats())
+        try:
+            conn.send(reply)
+        except Exception as exc:  # an exception that does not pickle
+            conn.send(("error", RuntimeError(f"{type(reply[1]).__name__}: {reply[1]} ({exc})"), reply[2]))
+
+
+def render_pdf_bytes(
+    src_pdf: str,
+    field_values: Dict[str, Any],
+    signature_overlays: Optional[List[Dict[str, Any]]] = None,
+    linearize: Optional[bool] = None,
+) -> bytes:
+    """Fill *src_pdf* and return the finished document (runs inside a worker)."""
+    from .acroform import fill_acroform_pdf
+
+    buffer = io.BytesIO()
+    fill_acroform_pdf(src_pdf, field_values, buffer, signature_overlays, linearize=linearize)
+    return buffer.getvalue()
+
+
+class _Job:
+    __slots__ = ("fn", "args", "future", "started", "worker")
+
+    def __init__(self, fn: Callable[..., Any], args: Tuple[Any, ...]):
+        self.fn = fn
+        self.args = args
+        self.future: Future = Future()
+        self.started: Future = Future()  # set to the start time when a worker takes the job
+        self.worker: Optional[_Worker] = None
+
+
+class _Worker:
+    """One worker process and the thread that feeds it jobs from the shared queue."""
+
+    def __init__(self, executor: "RenderExecutor", slot: int):
+        self.executor = executor
+        self.slot = slot
+        self.process: Optional[multiprocessing.process.BaseProcess] = None
+        self.job: Optional[_Job] = None
+        self.cache_stats: Dict[str, Any] = {}  # as of the process's last reply
+        self.stopped = False  # set when the executor terminated the process on purpose
+        self.closed = False
+        self.jobs = executor._jobs
+        self.thread = threading.Thread(target=self._serve, name=f"render-worker-{slot}", daemon=True)
+
+    def _spawn(self) -> Any:
+        executor = self.executor
+        warm_paths = executor._warm_paths() if callable(executor._warm_paths) else executor._warm_paths
+        # spawn, not fork: the server process runs threads (writer pool
+        # refills, the event loop) that must not be copied mid-operation.
+        context = multiprocessing.get_context("spawn")
+        conn, child = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child, tuple(str(path) for path in warm_paths)),
+            name=f"render-worker-{self.slot}",
+            daemon=True,
+        )
+        self.process.start()
+        child.close()
+        return conn
+
+    def _serve(self) -> None:
+        executor = self.executor
+        while not self.closed:
+            conn = self._spawn()
+            try:
+                _, _, self.cache_stats = conn.recv()  # "ready": warm-up does not count against any job
+            except (EOFError, OSError):
+                self._reap(conn)
+                time.sleep(1)
+                continue
+            while True:
+                job = self.jobs.get()
+                if job is None:
+                    self._reap(conn)
+                    return
+                if not job.future.set_running_or_notify_cancel():
+                    continue  # cancelled while it waited in the queue
+                with executor._lock:
+                    self.job, self.stopped, job.worker = job, False, self
+                job.started.set_result(time.monotonic())
+                try:
+                    conn.send((job.fn, job.args))
+                    status, value, self.cache_stats = conn.recv()
+                except (EOFError, OSError):
+                    with executor._lock:
+                        self.job = None
+                        stopped = self.stopped
+                        executor._stats["restarts"] += 1
+                    if stopped:
+                        job.future.set_exception(RenderTimeout("Render was stopped after the timeout"))
+                    else:
+                        job.future.set_exception(RenderBusy("Render worker exited"))
+                    self._reap(conn)
+                    break  # start a fresh process for this slot
+                with executor._lock:
+                    self.job = None
+                if status == "ok":
+                    job.future.set_result(value)
+                else:
+                    job.future.set_exception(value)
+
+    def _reap(self, conn: Any) -> None:
+        conn.close()
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+
+    def stop(self, job: _Job) -> bool:
+        """Terminate the process if it is still running *job*; the serving thread replaces it."""
+        with self.executor._lock:
+            if self.job is not job or self.process is None:
+                return False
+            self.stopped = True
+            process = self.process
+        process.terminate()  # just a signal: joining and respawning happen on the serving thread
+        return True
+
+
+class RenderExecutor:
+    def __init__(
+        self,
+        workers: int = RENDER_WORKERS,
+        queue_max: int = RENDER_QUEUE_MAX,
+        timeout: float = RENDER_TIMEOUT_SECONDS,
+        warm_paths: Union[Sequence[str], Callable[[], Sequence[str]]] = (),
+    ):
+        self.workers = max(0, workers)
+        self.queue_max = max(0, queue_max)
+        self.timeout = timeout
+        self._warm_paths = warm_paths
+        self._jobs: "queue.SimpleQueue[Optional[_Job]]" = queue.SimpleQueue()
+        self._workers: List[_Worker] = []
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._stats = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0, "timeouts": 0, "restarts": 0}
+
+    # -- worker lifecycle --------------------------------------------------
+
+    def start(self) -> None:
+        """Start and warm the worker processes ahead of the first render."""
+        with self._lock:
+            if self._workers or not self.workers:
+                return
+            # A fresh queue per generation: a shut down one may hold stop markers.
+            self._jobs = queue.SimpleQueue()
+            self._workers = [_Worker(self, slot) for slot in range(self.workers)]
+            workers = list(self._workers)
+        for worker in workers:
+            worker.thread.start()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            workers, self._workers = self._workers, []
+            for worker in workers:
+                worker.closed = True
+        while True:
+            try:
+                job = self._jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                job.future.cancel()
+        for worker in workers:
+            self._jobs.put(None)
+        for worker in workers:
+            if worker.process is not None:
+                worker.process.terminate()
+        for worker in workers:
+            worker.thread.join(timeout=10)
+
+    # -- submission --------------------------------------------------------
+
+    def _finished(self, future: Future) -> None:
+        with self._lock:
+            self._pending -= 1
+            if future.cancelled() or future.exception() is not None:
+                self._stats["failed"] += 1
+            else:
+                self._stats["completed"] += 1
+
+    def _submit(self, fn: Callable[..., bytes], *args: Any) -> _Job:
+        with self._lock:
+            if self._pending >= max(self.workers, 1) + self.queue_max:
+                self._stats["rejected"] += 1
+                raise RenderBusy("Render queue is full")
+            self._pending += 1
+            self._stats["submitted"] += 1
+
+        job = _Job(fn, args)
+        job.future.add_done_callback(self._finished)
+        if not self.workers:
+            job.future.set_running_or_notify_cancel()
+            job.started.set_result(time.monotonic())
+            try:
+                job.future.set_result(fn(*args))
+            except Exception as exc:
+                job.future.set_exception(exc)
+            return job
+        self.start()
+        self._jobs.put(job)
+        return job
+
+    def submit(
+        self,
+        src_pdf: Any,
+        field_values: Dict[str, Any],
+        signature_overlays: Optional[List[Dict[str, Any]]] = None,
+        linearize: Optional[bool] = None,
+    ) -> Future:
+        """Queue a render and return a future for the PDF bytes; raise RenderBusy if full."""
+        return self._submit(render_pdf_bytes, str(src_pdf), field_values, signature_overlays, linearize).future
+
+    async def _run(self, fn: Callable[..., bytes], *args: Any) -> bytes:
+        if not self.workers:
+            job = await asyncio.to_thread(self._submit, fn, *args)
+            return job.future.result()
+
+        job = self._submit(fn, *args)
+        try:
+            # Waiting for a free worker is bounded by admission, not by the timeout.
+            started = await asyncio.wrap_future(job.started)
+        except asyncio.CancelledError:
+            job.future.cancel()  # only succeeds while the job is still queued
+            raise
+        remaining = self.timeout - (time.monotonic() - started)
+        try:
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(job.future)), max(remaining, 0))
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._stats["timeouts"] += 1
+            # Already running in a worker: the only way to stop it is to take
+            # that one process down. Renders on the other workers carry on.
+            if job.worker is not None and job.worker.stop(job):
+                # The job fails as soon as its thread sees the process exit,
+                # which frees its admission slot; wait for that, not the respawn.
+                await asyncio.wait([asyncio.wrap_future(job.future)], timeout=5)
+            raise RenderTimeout(f"Render did not finish within {time.monotonic() - started:.0f}s")
+
+    async def render(
+        self,
+        src_pdf: Any,
+        field_values: Dict[str, Any],
+        signature_overlays: Optional[List[Dict[str, Any]]] = None,
+        linearize: Optional[bool] = None,
+    ) -> bytes:
+        """Render without blocking the event loop; raise RenderBusy or RenderTimeout."""
+        return await self._run(render_pdf_bytes, str(src_pdf), field_values, signature_overlays, linearize)
+
+    async def merge(self, documents: Sequence[Tuple[str, bytes]]) -> bytes:
+        """Merge rendered documents into one PDF on a worker (see engines.packet)."""
+        from .packet import merge_pdf_bytes
+
+        return await self._run(merge_pdf_bytes, list(documents))
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """Source cache and writer pool counters, summed over the worker processes.
+
+        Workers report them with every reply, so the numbers are as of each
+        worker's last job. Without workers, renders run here and the
+        counters are this process's own.
+        """
+        if not self.workers:
+            return _cache_stats()
+        total: Dict[str, Any] = {"pdf_sources": {}, "writer_pools": {}}
+        with self._lock:
+            workers = list(self._workers)
+        for worker in workers:
+            _add_counts(total, worker.cache_stats)
+        return total
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                **self._stats,
+                "workers": self.workers,
+                "queue_max": self.queue_max,
+                "pending": self._pending,
+            }
@@ -0,0 +1,56 @@
+"""
+Per-template AcroForm field-name catalog.
+
+``reader.get_fields()`` walks the whole field tree. The names never change
+for a given template file, so the walk happens once per source document
+(i.e. per file hash) and the render path resolves names by dict lookup.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from pypdf import PdfReader
+
+from .pdf_cache import SourceDocument
+
+
+@dataclass(frozen=True)
+class FieldCatalog:
+    names: Tuple[str, ...]                  # fully qualified names, in get_fields() order
+    full_names: FrozenSet[str]
+    short_aliases: Dict[str, List[str]]     # last segment -> qualified names using it
+
+    def fallback_name(self, name: str) -> Optional[str]:
+        """Short name to try when *name* is not a field of this PDF (None if there is none).
+
+        Only a last segment that some field of this PDF ends in is returned;
+        any other name could not fill anything.
+        """
+        if "." not in name:
+            return None
+        short = name.rsplit(".", 1)[1]
+        return short if short in self.short_aliases else None
+
+
+def build_field_catalog(reader: PdfReader) -> FieldCatalog:
+    names = tuple((reader.get_fields() or {}).keys())
+    short_aliases: Dict[str, List[str]] = {}
+    for name in names:
+        short_aliases.setdefault(name.split(".")[-1], []).append(name)
+    return FieldCatalog(
+        names=names,
+        full_names=frozenset(names),
+        short_aliases=short_aliases,
+    )
+
+
+def field_catalog(source: SourceDocument) -> FieldCatalog:
+    """Return the (cached) field catalog of a parsed template."""
+    catalog = source.derived.get("fields")
+    if catalog is None:
+        with source.lock:
+            catalog = source.derived.get("fields")
+            if catalog is None:
+                catalog = source.derived["fields"] = build_field_catalog(source.reader)
+    return catalog
@@ -0,0 +1,26 @@
+"""
+Merge independently rendered documents into one packet PDF.
+
+Each rendered form carries its own copy of the shared fonts and resources,
+plus objects the fill left unreferenced. Merging through a single writer and
+removing duplicate and unreferenced objects makes the packet much smaller
+than the concatenated downloads.
+"""
+from __future__ import annotations
+
+import io
+from typing import Sequence, Tuple
+
+from pypdf import PdfReader, PdfWriter
+
+
+def merge_pdf_bytes(documents: Sequence[Tuple[str, bytes]]) -> bytes:
+    """Merge ``(title, pdf bytes)`` pairs in order, one outline entry per document."""
+    writer = PdfWriter()
+    for title, content in documents:
+        writer.append(PdfReader(io.BytesIO(content)), outline_item=title or None)
+    writer.compress_identical_objects(remove_duplicates=True, remove_unreferenced=True)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
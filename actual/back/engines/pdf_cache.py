@@ -0,0 +1,286 @@
+"""
+Process-wide cache of parsed template PDFs.
+
+Parsing the xref table and object graph of an IRS/USCIS form dominates the
+cost of a render, yet the source document never changes between requests.
+Parsed readers are kept here, keyed by the SHA-256 of the file contents, and
+each render clones its writer from the in-memory object graph instead of
+re-reading the file.
+"""
+from __future__ import annotations
+
+import hashlib
+import io
+import logging
+import os
+import queue
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Deque, Dict, Optional, Tuple, Union
+
+from pypdf import PdfReader, PdfWriter
+
+
+# Budget for all cached sources together. The estimate per document is its
+# file size plus a fixed overhead per resolved object (measured at 2-5 KB
+# for the bundled IRS forms).
+SOURCE_CACHE_BUDGET_BYTES = int(os.getenv("PDF_SOURCE_CACHE_BYTES", str(128 * 1024 * 1024)))
+_OBJECT_OVERHEAD_BYTES = 4096
+
+
+def _parse_pool_sizes(raw: str) -> Dict[str, int]:
+    """Parse ``"w4-2026:2,w9-2026:2"`` into ``{"w4-2026": 2, "w9-2026": 2}``."""
+    sizes: Dict[str, int] = {}
+    for item in raw.split(","):
+        template_id, _, size = item.strip().partition(":")
+        if template_id and size.strip().isdigit():
+            sizes[template_id] = int(size)
+    return sizes
+
+
+# Pre-cloned writers kept ready per template folder name. Only hot templates
+# are worth the memory: a cloned i9-2025 writer holds ~7 MB of objects.
+WRITER_POOL_SIZES = _parse_pool_sizes(os.getenv("PDF_WRITER_POOL_SIZES", "w4-2026:2,w9-2026:2,i9-2025:2"))
+
+# "full" (the default) re-serializes the whole document. "incremental" writes
+# the template bytes unchanged and appends an update section with only the
+# objects a render added or modified; the unchanged prefix still holds the
+# template's widgets and XFA, and for small templates the result is larger,
+# so it is opt-in. An incremental clone hashes every object up front, which
+# only pays off when the clone is made ahead of time, so "auto" uses it for
+# pooled writers only.
+PDF_OUTPUT_MODE = os.getenv("PDF_OUTPUT_MODE", "full").strip().lower()
+
+
+def _incremental_output(pooled: bool) -> bool:
+    return PDF_OUTPUT_MODE == "incremental" or (PDF_OUTPUT_MODE == "auto" and pooled)
+
+
+# Render copies (engines.template_prep) live in this folder inside the
+# template folder and share the template's writer pool.
+RENDER_COPY_DIR = ".render"
+
+
+def _template_folder(path: Path) -> str:
+    folder = path.parent
+    return folder.parent.name if folder.name == RENDER_COPY_DIR else folder.name
+
+
+@dataclass
+class SourceDocument:
+    digest: str
+    path: Path
+    data: bytes
+    reader: PdfReader
+    cost: int
+    # pypdf resolves objects lazily from the shared stream, so concurrent
+    # clones of the same reader must be serialized.
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    # Indexes derived from the parsed document (widgets, field names, ...),
+    # built on first use and shared like the reader itself.
+    derived: Dict[str, Any] = field(default_factory=dict, repr=False)
+
+    def clone_writer(self, incremental: bool = False) -> PdfWriter:
+        with self.lock:
+            if incremental:
+                # The writer keeps a reference to the reader for its /Prev
+                # offset; the original bytes are written from self.data.
+                return PdfWriter(self.reader, incremental=True)
+            return PdfWriter(clone_from=self.reader)
+
+
+_sources: "OrderedDict[str, SourceDocument]" = OrderedDict()
+_stamps: Dict[str, Tuple[int, int, str]] = {}
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def _file_digest(path: Path) -> Tuple[str, bytes | None]:
+    """Return the content hash of *path*, reading it only when its stat changed."""
+    stat = path.stat()
+    key = str(path)
+    with _lock:
+        stamp = _stamps.get(key)
+    if stamp and stamp[:2] == (stat.st_mtime_ns, stat.st_size):
+        return stamp[2], None
+    data = path.read_bytes()
+    digest = hashlib.sha256(data).hexdigest()
+    with _lock:
+        _stamps[key] = (stat.st_mtime_ns, stat.st_size, digest)
+    return digest, data
+
+
+def source_digest(src_pdf: Union[str, Path]) -> str:
+    """Content hash of *src_pdf*; changes whenever the template file is replaced."""
+    return _file_digest(Path(src_pdf))[0]
+
+
+def _parse(path: Path, digest: str, data: bytes) -> SourceDocument:
+    reader = PdfReader(io.BytesIO(data))
+    # One throwaway clone resolves the whole object graph up front, which
+    # both validates the file and makes the cost estimate meaningful.
+    PdfWriter(clone_from=reader)
+    cost = len(data) + _OBJECT_OVERHEAD_BYTES * len(reader.resolved_objects)
+    return SourceDocument(digest=digest, path=path, data=data, reader=reader, cost=cost)
+
+
+def _evict_over_budget() -> None:
+    total = sum(source.cost for source in _sources.values())
+    # Always keep the most recently used document, even if it alone is
+    # larger than the budget: evicting it would just reparse it next time.
+    while total > SOURCE_CACHE_BUDGET_BYTES and len(_sources) > 1:
+        _, evicted = _sources.popitem(last=False)
+        total -= evicted.cost
+        _stats["evictions"] += 1
+
+
+def load_source(src_pdf: Union[str, Path]) -> SourceDocument:
+    """Return the parsed, shared document for *src_pdf*."""
+    path = Path(src_pdf)
+    digest, data = _file_digest(path)
+
+    with _lock:
+        source = _sources.get(digest)
+        if source is not None:
+            _sources.move_to_end(digest)
+            _stats["hits"] += 1
+            return source
+        _stats["misses"] += 1
+
+    source = _parse(path, digest, data if data is not None else path.read_bytes())
+    with _lock:
+        # Another thread may have parsed the same file meanwhile; keep one.
+        source = _sources.setdefault(digest, source)
+        _sources.move_to_end(digest)
+        _evict_over_budget()
+    return source
+
+
+def clear_source_cache() -> None:
+    with _lock:
+        _sources.clear()
+        _stamps.clear()
+
+
+def source_cache_stats() -> Dict[str, int]:
+    with _lock:
+        return {
+            **_stats,
+            "documents": len(_sources),
+            "bytes": sum(source.cost for source in _sources.values()),
+            "budget_bytes": SOURCE_CACHE_BUDGET_BYTES,
+        }
+
+
+# ---------------------------------------------------------------------------
+# Pre-cloned writer pool
+# ---------------------------------------------------------------------------
+
+@dataclass
+class _WriterPool:
+    source: SourceDocument
+    size: int
+    writers: Deque[PdfWriter] = field(default_factory=deque)
+    checkouts: int = 0
+    starved: int = 0
+
+
+_pools: Dict[str, _WriterPool] = {}
+_refills: "queue.Queue[str]" = queue.Queue()
+_refill_thread: Optional[threading.Thread] = None
+
+
+def _refill_worker() -> None:
+    while True:
+        template_id = _refills.get()
+        try:
+            while True:
+                with _lock:
+                    pool = _pools.get(template_id)
+                    if pool is None or len(pool.writers) >= pool.size:
+                        break
+                writer = pool.source.clone_writer(_incremental_output(pooled=True))
+                with _lock:
+                    # The template may have been replaced while cloning.
+                    if _pools.get(template_id) is pool:
+                        pool.writers.append(writer)
+        except Exception as exc:
+            logging.getLogger(__name__).warning("Writer pool refill failed for %s: %s", template_id, exc)
+        finally:
+            _refills.task_done()
+
+
+def _schedule_refill(template_id: str) -> None:
+    global _refill_thread
+    with _lock:
+        if _refill_thread is None or not _refill_thread.is_alive():
+            _refill_thread = threading.Thread(target=_refill_worker, name="pdf-writer-pool", daemon=True)
+            _refill_thread.start()
+    _refills.put(template_id)
+
+
+def _pool_for(source: SourceDocument) -> Optional[_WriterPool]:
+    """Return the pool for *source*'s template, replacing it if the file changed. Caller holds _lock."""
+    template_id = _template_folder(source.path)
+    size = WRITER_POOL_SIZES.get(template_id, 0)
+    if size <= 0:
+        return None
+    pool = _pools.get(template_id)
+    if pool is None or pool.source.digest != source.digest:
+        pool = _WriterPool(
+            source=source,
+            size=size,
+            checkouts=pool.checkouts if pool else 0,
+            starved=pool.starved if pool else 0,
+        )
+        _pools[template_id] = pool
+    return pool
+
+
+def checkout_writer(source: SourceDocument, incremental: Optional[bool] = None) -> PdfWriter:
+    """
+    Return a writer cloned from *source* that the caller may fill and discard.
+
+    Templates listed in PDF_WRITER_POOL_SIZES (keyed by their folder name)
+    are served from a pool of writers cloned ahead of time; the pool is
+    topped up by a background thread after every checkout. *incremental*
+    overrides PDF_OUTPUT_MODE; a writer in the other mode than the pool's is
+    cloned on the spot.
+    """
+    with _lock:
+        pool = _pool_for(source)
+    if pool is None or incremental not in (None, _incremental_output(pooled=True)):
+        return source.clone_writer(_incremental_output(pooled=False) if incremental is None else incremental)
+    with _lock:
+        writer = None
+        pool.checkouts += 1
+        if pool.writers:
+            writer = pool.writers.popleft()
+        else:
+            pool.starved += 1
+    _schedule_refill(_template_folder(source.path))
+    return writer if writer is not None else source.clone_writer(_incremental_output(pooled=True))
+
+
+def prefill_writer_pool(src_pdf: Union[str, Path]) -> None:
+    """Start cloning writers for *src_pdf* so the first render is not starved."""
+    source = load_source(src_pdf)
+    with _lock:
+        pool = _pool_for(source)
+    if pool is not None:
+        _schedule_refill(_template_folder(source.path))
+
+
+def writer_pool_stats() -> Dict[str, Dict[str, int]]:
+    with _lock:
+        return {
+            template_id: {
+                "size": pool.size,
+                "available": len(pool.writers),
+                "checkouts": pool.checkouts,
+                "starved": pool.starved,
+            }
+            for template_id, pool in _pools.items()
+        }
@@ -0,0 +1,473 @@
+"""
+Linearized ("fast web view") output, ISO 32000-1 Annex F.
+
+A linearized file starts with everything needed to show page 1: the
+linearization dictionary, a cross-reference section for the first-page
+objects, the catalog, a hint stream and page 1 with its resources. A viewer
+reading the file over HTTP range requests can draw page 1 from the first
+chunk and use the hint tables to fetch any other page directly.
+
+Layout (parts as numbered in Annex F; objects renumbered so that every
+section is a contiguous run of object numbers):
+
+    header, linearization dict, first-page xref stream   parts 1-3
+    catalog and open-document objects (/AcroForm ...)   part 4
+    hint stream                                          part 5
+    page 1 and everything it uses                        part 6
+    each further page with its private objects           part 7
+    objects shared by several further pages              part 8
+    everything else, non-stream objects packed           part 9
+    main xref stream                                     part 11
+
+Hint table offsets are taken as if the hint stream were absent, so the
+file is laid out once without it, the hints are computed from those
+offsets, and the hint stream is then inserted in front of page 1.
+"""
+from __future__ import annotations
+
+import io
+import struct
+import zlib
+from dataclasses import dataclass
+from typing import BinaryIO, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from pypdf import PdfWriter
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, PdfObject, StreamObject
+
+from .pdf_compact import OBJECTS_PER_STREAM, write_compact
+
+
+# Catalog entries a viewer reads before it shows any page.
+_OPEN_DOCUMENT_KEYS = {"/ViewerPreferences", "/PageMode", "/Threads", "/OpenAction", "/AcroForm"}
+_INHERITED_PAGE_KEYS = ("/Resources", "/MediaBox", "/CropBox", "/Rotate")
+# Enough room for the parameters of any file under 10 GB.
+_LINEARIZATION_DICT_BYTES = 128
+_OFFSET_PLACEHOLDER = 9_999_999_999
+
+_ROOT, _OPEN, _OUTLINES, _OTHER = "root", "open", "outlines", "other"
+
+
+def _serialize(obj: PdfObject, out: io.BytesIO, renumber: Dict[int, int]) -> None:
+    """Write *obj* like ``write_to_stream`` does, with references renumbered."""
+    if isinstance(obj, IndirectObject):
+        new_id = renumber.get(obj.idnum)
+        out.write(f"{new_id} 0 R".encode() if new_id else b"null")
+    elif isinstance(obj, DictionaryObject):
+        out.write(b"<<")
+        for key, value in obj.items():
+            if len(key) > 2 and key[1] == "%" and key[-1] == "%":
+                continue  # pypdf-internal entry
+            if isinstance(obj, StreamObject) and key == "/Length":
+                continue
+            key.write_to_stream(out)
+            out.write(b" ")
+            _serialize(value, out, renumber)
+            out.write(b"\n")
+        if isinstance(obj, StreamObject):
+            data = obj.get_data() if not obj._data else obj._data  # a ContentStream may hold operations only
+            out.write(f"/Length {len(data)}>>\nstream\n".encode())
+            out.write(data)
+            out.write(b"\nendstream")
+        else:
+            out.write(b">>")
+    elif isinstance(obj, ArrayObject):
+        out.write(b"[")
+        for item in obj:
+            out.write(b" ")
+            _serialize(item, out, renumber)
+        out.write(b" ]")
+    else:
+        obj.write_to_stream(out)
+
+
+class _BitWriter:
+    def __init__(self) -> None:
+        self.data = bytearray()
+        self._acc = 0
+        self._bits = 0
+
+    def write(self, value: int, bits: int) -> None:
+        for shift in range(bits - 1, -1, -1):
+            self._acc = (self._acc << 1) | ((value >> shift) & 1)
+            self._bits += 1
+            if self._bits == 8:
+                self.data.append(self._acc)
+                self._acc = self._bits = 0
+
+    def write_all(self, values: Iterable[int], bits: int) -> None:
+        """Write one hint-table item for every page or group; items start on a byte boundary."""
+        for value in values:
+            self.write(value, bits)
+        self.flush()
+
+    def flush(self) -> None:
+        if self._bits:
+            self.write(0, 8 - self._bits)
+
+
+class _Layout:
+    """Classifies objects into the Annex F parts from who uses them."""
+
+    def __init__(self, writer: PdfWriter):
+        self.writer = writer
+        self.page_ids = [page.indirect_reference.idnum for page in writer.pages]
+        self.users: Dict[int, Set[object]] = {}
+        self.page_objects: List[Set[int]] = []
+        for number, page_id in enumerate(self.page_ids):
+            self.page_objects.append(self._mark(page_id, number))
+        root = writer._root_object
+        self.root_id = root.indirect_reference.idnum
+        for key, value in root.items():
+            if key in _OPEN_DOCUMENT_KEYS:
+                self._mark_value(value, _OPEN)
+            elif key == "/Outlines":
+                self._mark_value(value, _OUTLINES)
+            else:
+                self._mark_value(value, _OTHER)
+        if isinstance(writer._info_obj, IndirectObject):
+            self._mark(writer._info_obj.idnum, _OTHER)
+        self.users.setdefault(self.root_id, set()).add(_ROOT)
+
+    def _object(self, idnum: int) -> Optional[PdfObject]:
+        objects = self.writer._objects
+        return objects[idnum - 1] if 0 < idnum <= len(objects) else None
+
+    def _mark(self, idnum: int, user: object) -> Set[int]:
+        return self._mark_value(IndirectObject(idnum, 0, self.writer), user, top=True)
+
+    def _mark_value(self, value: PdfObject, user: object, top: bool = False) -> Set[int]:
+        """Record *user* on every object reachable from *value* without entering other pages."""
+        seen: Set[int] = set()
+        pending: List[Tuple[PdfObject, bool]] = [(value, top)]
+        while pending:
+            value, is_top = pending.pop()
+            if isinstance(value, IndirectObject):
+                if value.idnum in seen:
+                    continue
+                target = self._object(value.idnum)
+                if target is None:
+                    continue
+                if isinstance(target, DictionaryObject) and target.get("/Type") == "/Page" and not is_top:
+                    continue
+                seen.add(value.idnum)
+                self.users.setdefault(value.idnum, set()).add(user)
+                value = target
+            if isinstance(value, DictionaryObject):
+                is_page = value.get("/Type") == "/Page"
+                pending.extend(
+                    (item, False) for key, item in value.items()
+                    if not (is_page and key == "/Parent")
+                )
+            elif isinstance(value, ArrayObject):
+                pending.extend((item, False) for item in value)
+        return seen
+
+    def parts(self) -> "_Parts":
+        open_document, first_private, first_shared, outlines, shared, other = [], [], [], [], [], []
+        private: Dict[int, List[int]] = {}
+        # "Shared" means shared between pages: an appearance stream that the
+        # structure tree also reaches still belongs to its page's section.
+        for idnum in sorted(self.users):
+            users = self.users[idnum]
+            pages = [user for user in users if isinstance(user, int)]
+            if _ROOT in users:
+                continue
+            if _OUTLINES in users:
+                outlines.append(idnum)
+            elif _OPEN in users:
+                open_document.append(idnum)
+            elif 0 in pages:
+                (first_private if len(pages) == 1 else first_shared).append(idnum)
+            elif len(pages) == 1:
+                private.setdefault(pages[0], []).append(idnum)
+            elif pages:
+                shared.append(idnum)
+            else:
+                other.append(idnum)
+
+        root = self.writer._root_object
+        outlines_ref = root.raw_get("/Outlines") if "/Outlines" in root else None
+        if isinstance(outlines_ref, IndirectObject) and outlines_ref.idnum in outlines:
+            # The outline hint table describes one run starting at /Outlines.
+            outlines.remove(outlines_ref.idnum)
+            outlines.insert(0, outlines_ref.idnum)
+        first_page = self.page_ids[0]
+        return _Parts(
+            open_document=[self.root_id] + open_document,
+            first_page=[first_page] + [idnum for idnum in first_private if idnum != first_page] + first_shared,
+            other_pages=[
+                [page_id] + [idnum for idnum in private.get(number, []) if idnum != page_id]
+                for number, page_id in enumerate(self.page_ids[1:], start=1)
+            ],
+            shared=shared,
+            outlines=outlines,
+            outlines_first=root.get("/PageMode") == "/UseOutlines",
+            other=other,
+        )
+
+
+@dataclass
+class _Parts:
+    open_document: List[int]      # part 4, catalog first
+    first_page: List[int]         # part 6, page object first
+    other_pages: List[List[int]]  # part 7, page object first in each
+    shared: List[int]             # part 8
+    outlines: List[int]           # end of part 6 or head of part 9, /Outlines first
+    outlines_first: bool
+    other: List[int]              # part 9
+
+
+def _push_inherited_attributes(writer: PdfWriter) -> None:
+    """Copy attributes inherited from the page tree onto the pages (viewers skip the tree)."""
+    for page in writer.pages:
+        for key in _INHERITED_PAGE_KEYS:
+            if key in page:
+                continue
+            node = page.get("/Parent")
+            while node is not None:
+                node = node.get_object()
+                if key in node:
+                    page[key] = node.raw_get(key)
+                    break
+                node = node.get("/Parent")
+
+
+def _object_bytes(idnum: int, body: bytes) -> bytes:
+    return f"{idnum} 0 obj\n".encode() + body + b"\nendobj\n"
+
+
+def _compressed_stream(dictionary: str, data: bytes) -> bytes:
+    encoded = zlib.compress(data, 6)
+    return f"<<{dictionary}/Filter/FlateDecode/Length {len(encoded)}>>\nstream\n".encode() + encoded + b"\nendstream"
+
+
+def _object_stream(members: Sequence[Tuple[int, bytes]]) -> bytes:
+    offsets, body = [], io.BytesIO()
+    for idnum, data in members:
+        offsets.append(f"{idnum} {body.tell()}")
+        body.write(data + b"\n")
+    head = (" ".join(offsets) + "\n").encode()
+    return _compressed_stream(f"/Type/ObjStm/N {len(members)}/First {len(head)}", head + body.getvalue())
+
+
+def _xref_rows(entries: Sequence[Tuple[int, int, int]]) -> bytes:
+    return b"".join(struct.pack(">BIH", *entry) for entry in entries)
+
+
+def _trailer_keys(writer: PdfWriter, renumber: Dict[int, int]) -> str:
+    out = io.BytesIO()
+    out.write(f"/Root {renumber[writer._root_object.indirect_reference.idnum]} 0 R".encode())
+    if isinstance(writer._info_obj, IndirectObject) and writer._info_obj.idnum in renumber:
+        out.write(f"/Info {renumber[writer._info_obj.idnum]} 0 R".encode())
+    if writer._ID:
+        out.write(b"/ID")
+        _serialize(writer._ID, out, renumber)
+    return out.getvalue().decode("latin-1")
+
+
+def _first_page_xref(
+    xref_id: int, first_id: int, offsets: Sequence[int], size: int, prev: int, trailer: str
+) -> bytes:
+    """Uncompressed, so its length depends only on the number widths in the dictionary."""
+    rows = _xref_rows([(1, offset, 0) for offset in offsets])
+    dictionary = (
+        f"<</Type/XRef/Index[{first_id} {len(offsets)}]/Size {size}/Prev {prev}"
+        f"/W[1 4 2]{trailer}/Length {len(rows)}>>\nstream\n"
+    )
+    return _object_bytes(xref_id, dictionary.encode("latin-1") + rows + b"\nendstream")
+
+
+def _padded(data: bytes, size: int) -> bytes:
+    if len(data) > size:
+        raise ValueError("reserved space for linearization data is too small")
+    return data[:-1] + b" " * (size - len(data)) + b"\n"
+
+
+def _hint_stream(
+    hint_id: int,
+    page_lengths: Sequence[int],
+    page_counts: Sequence[int],
+    page_shared: Sequence[Sequence[int]],
+    first_page_offset: int,
+    group_lengths: Sequence[int],
+    first_page_groups: int,
+    first_shared: Tuple[int, int],
+    outlines: Optional[Tuple[int, int, int, int]],
+) -> bytes:
+    """Page offset, shared object and outline hint tables (Annex F.4.1, F.4.2, F.4.6)."""
+    bits = _BitWriter()
+    min_objects, min_length = min(page_counts), min(page_lengths)
+    object_bits = (max(page_counts) - min_objects).bit_length()
+    length_bits = (max(page_lengths) - min_length).bit_length()
+    shared_count_bits = max(len(shared) for shared in page_shared).bit_length()
+    shared_id_bits = len(group_lengths).bit_length()
+    # Content streams are not located separately: each page counts as its own content.
+    for value, width in (
+        (min_objects, 32), (first_page_offset, 32), (object_bits, 16), (min_length, 32), (length_bits, 16),
+        (0, 32), (0, 16), (min_length, 32), (length_bits, 16),
+        (shared_count_bits, 16), (shared_id_bits, 16), (0, 16), (4, 16),
+    ):
+        bits.write(value, width)
+    bits.write_all((count - min_objects for count in page_counts), object_bits)
+    bits.write_all((length - min_length for length in page_lengths), length_bits)
+    bits.write_all((len(shared) for shared in page_shared), shared_count_bits)
+    bits.write_all((group for shared in page_shared for group in shared), shared_id_bits)
+    bits.flush()  # no fractional positions
+    bits.write_all((0 for _ in page_lengths), 0)  # content offsets
+    bits.write_all((length - min_length for length in page_lengths), length_bits)
+    dictionary = f"/S {len(bits.data)}"
+
+    min_group = min(group_lengths)
+    group_bits = (max(group_lengths) - min_group).bit_length()
+    for value, width in (
+        (first_shared[0], 32), (first_shared[1], 32), (first_page_groups, 32), (len(group_lengths), 32),
+        (0, 16), (min_group, 32), (group_bits, 16),
+    ):
+        bits.write(value, width)
+    bits.write_all((length - min_group for length in group_lengths), group_bits)
+    bits.write_all((0 for _ in group_lengths), 1)  # no signatures
+    bits.write_all((0 for _ in group_lengths), 0)  # one object per group
+
+    if outlines is not None:
+        dictionary += f"/O {len(bits.data)}"
+        bits.write_all(outlines, 32)  # first object, its location, object count, length
+    return _object_bytes(hint_id, _compressed_stream(dictionary, bytes(bits.data)))
+
+
+def write_linearized(writer: PdfWriter, stream: BinaryIO) -> None:
+    """Write *writer*'s document to *stream* linearized; falls back to ``write_compact`` when encrypted."""
+    if writer._encryption is not None or not writer.pages:
+        write_compact(writer, stream)
+        return
+    writer._resolve_links()
+    _push_inherited_attributes(writer)
+    layout = _Layout(writer)
+    parts = layout.parts()
+    part6 = parts.first_page + (parts.outlines if parts.outlines_first else [])
+    page_sections = [part6] + parts.other_pages
+    part9_top = [] if parts.outlines_first else list(parts.outlines)
+    part9_packed = []
+    for idnum in parts.other:
+        (part9_top if isinstance(writer._objects[idnum - 1], StreamObject) else part9_packed).append(idnum)
+    object_stream_count = -(-len(part9_packed) // OBJECTS_PER_STREAM)
+
+    # Main section first: object 1 is page 2, as the page offset hints assume.
+    renumber: Dict[int, int] = {}
+    for idnum in [idnum for section in parts.other_pages for idnum in section] + parts.shared + part9_top:
+        renumber[idnum] = len(renumber) + 1
+    first_object_stream = len(renumber) + 1
+    main_xref_id = first_object_stream + object_stream_count
+    for position, idnum in enumerate(part9_packed, start=main_xref_id + 1):
+        renumber[idnum] = position
+    lin_id = main_xref_id + 1 + len(part9_packed)
+    first_xref_id = lin_id + 1
+    for position, idnum in enumerate(parts.open_document, start=first_xref_id + 1):
+        renumber[idnum] = position
+    hint_id = first_xref_id + 1 + len(parts.open_document)
+    for position, idnum in enumerate(part6, start=hint_id + 1):
+        renumber[idnum] = position
+    size = hint_id + 1 + len(part6)
+
+    def written(idnums: Iterable[int]) -> List[Tuple[int, bytes]]:
+        """(new object number, bytes) of each object, in file order."""
+        result = []
+        for idnum in idnums:
+            out = io.BytesIO()
+            _serialize(writer._objects[idnum - 1], out, renumber)
+            result.append((renumber[idnum], out.getvalue()))
+        return result
+
+    head = f"%PDF-{max(writer.pdf_header[5:], '1.5')}\n".encode() + b"%\xe2\xe3\xcf\xd3\n"
+    trailer = _trailer_keys(writer, renumber)
+    first_xref_bytes = len(_first_page_xref(
+        first_xref_id, lin_id, [0] * (size - lin_id), size, _OFFSET_PLACEHOLDER, trailer
+    ))
+    before_hint = [(idnum, _object_bytes(idnum, data)) for idnum, data in written(parts.open_document)]
+    after_hint = [
+        (idnum, _object_bytes(idnum, data))
+        for idnum, data in written([idnum for section in page_sections for idnum in section] + parts.shared + part9_top)
+    ]
+    packed_entries: Dict[int, Tuple[int, int, int]] = {}
+    for stream_id, start in enumerate(range(0, len(part9_packed), OBJECTS_PER_STREAM), start=first_object_stream):
+        members = written(part9_packed[start:start + OBJECTS_PER_STREAM])
+        for index, (member_id, _) in enumerate(members):
+            packed_entries[member_id] = (2, stream_id, index)
+        after_hint.append((stream_id, _object_bytes(stream_id, _object_stream(members))))
+
+    # Offsets as if the hint stream were absent, which is what the hints hold.
+    offsets: Dict[int, int] = {}
+    position = len(head) + _LINEARIZATION_DICT_BYTES + first_xref_bytes
+    for idnum, data in before_hint:
+        offsets[idnum] = position
+        position += len(data)
+    hint_position = position
+    for idnum, data in after_hint:
+        offsets[idnum] = position
+        position += len(data)
+    lengths = {idnum: len(data) for idnum, data in before_hint + after_hint}
+
+    def span(idnums: Sequence[int]) -> int:
+        return sum(lengths[renumber[idnum]] for idnum in idnums)
+
+    groups = part6 + parts.shared
+    group_index = {idnum: index for index, idnum in enumerate(groups)}
+    shared = {idnum for idnum in groups if sum(isinstance(user, int) for user in layout.users[idnum]) > 1}
+    outlines = None
+    if parts.outlines:
+        first = renumber[parts.outlines[0]]
+        outlines = (first, offsets[first], len(parts.outlines), span(parts.outlines))
+    hint = _hint_stream(
+        hint_id,
+        page_lengths=[span(section) for section in page_sections],
+        page_counts=[len(section) for section in page_sections],
+        page_shared=[[]] + [
+            sorted(group_index[idnum] for idnum in layout.page_objects[number] if idnum in shared)
+            for number in range(1, len(page_sections))
+        ],
+        first_page_offset=offsets[renumber[part6[0]]],
+        group_lengths=[span([idnum]) for idnum in groups],
+        first_page_groups=len(part6),
+        first_shared=(renumber[parts.shared[0]], offsets[renumber[parts.shared[0]]]) if parts.shared else (0, 0),
+        outlines=outlines,
+    )
+
+    # Real offsets: everything after the hint stream moves by its length.
+    for idnum, _ in after_hint:
+        offsets[idnum] += len(hint)
+    offsets[hint_id] = hint_position
+    main_xref_offset = offsets[main_xref_id] = position + len(hint)
+    main_xref = _object_bytes(main_xref_id, _compressed_stream(
+        f"/Type/XRef/Size {lin_id}/W[1 4 2]",
+        _xref_rows([(0, 0, 65535)] + [
+            packed_entries.get(idnum) or (1, offsets[idnum], 0) for idnum in range(1, lin_id)
+        ]),
+    ))
+    first_xref_offset = len(head) + _LINEARIZATION_DICT_BYTES
+    first_xref = _first_page_xref(
+        first_xref_id,
+        lin_id,
+        [len(head), first_xref_offset] + [offsets[idnum] for idnum in range(first_xref_id + 1, size)],
+        size,
+        main_xref_offset,
+        trailer,
+    )
+    # A reader without linearization support starts from the end, at the
+    # first-page xref, and reaches the main one through /Prev.
+    tail = f"startxref\n{first_xref_offset}\n%%EOF\n".encode()
+    last = renumber[part6[-1]]
+    linearization = _object_bytes(lin_id, (
+        f"<</Linearized 1/L {main_xref_offset + len(main_xref) + len(tail)}"
+        f"/H [ {hint_position} {len(hint)} ]/O {renumber[part6[0]]}/E {offsets[last] + lengths[last]}"
+        f"/N {len(page_sections)}/T {main_xref_offset}>>"
+    ).encode())
+
+    stream.write(head)
+    stream.write(_padded(linearization, _LINEARIZATION_DICT_BYTES))
+    stream.write(_padded(first_xref, first_xref_bytes))
+    for _, data in before_hint:
+        stream.write(data)
+    stream.write(hint)
+    for _, data in after_hint:
+        stream.write(data)
+    stream.write(main_xref)
+    stream.write(tail)
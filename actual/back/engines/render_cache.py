@@ -0,0 +1,200 @@
+"""
+Content-addressed cache of rendered PDFs.
+
+Users download the same document repeatedly (retries, back/forward, a
+double-clicked "Download"), and a render is a pure function of the template
+PDF and the prepared field values and overlays. Finished documents are kept
+here under the SHA-256 of exactly those inputs, in a bytes-bounded in-memory
+LRU with an optional disk tier (RENDER_CACHE_DIR), so repeats skip
+``fill_acroform_pdf`` entirely.
+
+Rendered forms carry personal data, so entries expire after
+RENDER_CACHE_TTL_SECONDS and the disk tier is off unless configured.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+
+RENDER_CACHE_BYTES = int(os.getenv("RENDER_CACHE_BYTES", str(64 * 1024 * 1024)))
+RENDER_CACHE_TTL_SECONDS = float(os.getenv("RENDER_CACHE_TTL_SECONDS", "900"))
+RENDER_CACHE_DIR = os.getenv("RENDER_CACHE_DIR", "")
+RENDER_CACHE_DISK_BYTES = int(os.getenv("RENDER_CACHE_DISK_BYTES", str(512 * 1024 * 1024)))
+
+# Part of every key: bump when the renderer's output changes for the same inputs.
+_RENDERER_VERSION = "4"
+
+_entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+_memory_bytes = 0
+_disk_bytes: Optional[int] = None  # unknown until the directory is first scanned
+_lock = threading.Lock()
+_stats = {"hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+
+def render_key(
+    pdf_digest: str,
+    field_values: Dict[str, Any],
+    overlays: Optional[List[Dict[str, Any]]],
+    linearized: bool = False,
+    output_mode: str = "full",
+    optimized: bool = False,
+    signature_dpi: Optional[int] = None,
+) -> str:
+    """Hash the template content version, the canonicalized render inputs and the
+    output settings (PDF_OUTPUT_MODE, PDF_OPTIMIZE_OUTPUT, PDF_SIGNATURE_DPI) that shape the bytes."""
+    inputs = [
+        _RENDERER_VERSION,
+        pdf_digest,
+        field_values,
+        overlays or [],
+        {
+            "linearized": bool(linearized),
+            "output_mode": output_mode,
+            "optimized": bool(optimized),
+            "signature_dpi": signature_dpi,
+        },
+    ]
+    canonical = json.dumps(
+        inputs,
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _disk_path(key: str) -> Path:
+    return Path(RENDER_CACHE_DIR) / key[:2] / f"{key}.pdf"
+
+
+def _store_in_memory(key: str, content: bytes, stored_at: float) -> None:
+    """Insert and evict down to the budget. Caller holds _lock."""
+    global _memory_bytes
+    previous = _entries.pop(key, None)
+    if previous is not None:
+        _memory_bytes -= len(previous[1])
+    if len(content) > RENDER_CACHE_BYTES:
+        return
+    _entries[key] = (stored_at, content)
+    _memory_bytes += len(content)
+    while _memory_bytes > RENDER_CACHE_BYTES:
+        _, (_, evicted) = _entries.popitem(last=False)
+        _memory_bytes -= len(evicted)
+        _stats["evictions"] += 1
+
+
+def _read_disk(key: str, now: float) -> Optional[bytes]:
+    path = _disk_path(key)
+    try:
+        if now - path.stat().st_mtime > RENDER_CACHE_TTL_SECONDS:
+            path.unlink(missing_ok=True)
+            return None
+        return path.read_bytes()
+    except OSError:
+        return None
+
+
+def get_rendered(key: str) -> Optional[bytes]:
+    """Return the cached document for *key*, or None."""
+    global _memory_bytes
+    now = time.time()
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None:
+            if now - entry[0] <= RENDER_CACHE_TTL_SECONDS:
+                _entries.move_to_end(key)
+                _stats["hits"] += 1
+                return entry[1]
+            del _entries[key]
+            _memory_bytes -= len(entry[1])
+
+    content = _read_disk(key, now) if RENDER_CACHE_DIR else None
+    with _lock:
+        if content is None:
+            _stats["misses"] += 1
+            return None
+        _stats["hits"] += 1
+        _stats["disk_hits"] += 1
+        _store_in_memory(key, content, now)
+    return content
+
+
+def _prune_disk(root: Path) -> int:
+    """Delete expired files, then the oldest ones until under budget. Returns the bytes kept."""
+    now = time.time()
+    files = []
+    for path in root.glob("*/*.pdf"):
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        if now - stat.st_mtime > RENDER_CACHE_TTL_SECONDS:
+            path.unlink(missing_ok=True)
+        else:
+            files.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= RENDER_CACHE_DISK_BYTES * 0.9:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+    return total
+
+
+def _write_disk(key: str, content: bytes) -> None:
+    global _disk_bytes
+    path = _disk_path(key)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_suffix(f".{os.getpid()}.tmp")
+        temporary.write_bytes(content)
+        os.replace(temporary, path)
+    except OSError as exc:
+        logging.getLogger(__name__).warning("Render cache write failed: %s", exc)
+        return
+    with _lock:
+        if _disk_bytes is not None:
+            _disk_bytes += len(content)
+        scan = _disk_bytes is None or _disk_bytes > RENDER_CACHE_DISK_BYTES
+    if scan:
+        kept = _prune_disk(Path(RENDER_CACHE_DIR))
+        with _lock:
+            _disk_bytes = kept
+
+
+def put_rendered(key: str, content: bytes) -> None:
+    with _lock:
+        _stats["stores"] += 1
+        _store_in_memory(key, content, time.time())
+    if RENDER_CACHE_DIR:
+        _write_disk(key, content)
+
+
+def clear_render_cache() -> None:
+    global _memory_bytes
+    with _lock:
+        _entries.clear()
+        _memory_bytes = 0
+
+
+def render_cache_stats() -> Dict[str, Any]:
+    with _lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return {
+            **_stats,
+            "hit_rate": round(_stats["hits"] / lookups, 4) if lookups else 0.0,
+            "entries": len(_entries),
+            "bytes": _memory_bytes,
+            "budget_bytes": RENDER_CACHE_BYTES,
+            "disk_enabled": bool(RENDER_CACHE_DIR),
+            "disk_bytes": _disk_bytes,
+        }
@@ -0,0 +1,211 @@
+"""
+Asynchronous render jobs: submit, poll, download.
+
+Heavy templates can outlast proxy and mobile-client timeouts on the
+synchronous render endpoint. A job is accepted immediately, renders in the
+background on the render executor, and keeps its PDF in memory until
+RENDER_JOB_TTL_SECONDS after it finished, when the sweeper drops it.
+
+Submissions may carry a client-supplied idempotency key: resubmitting the
+same key with the same payload returns the existing job instead of rendering
+again, and reusing a key for a different payload is refused. Keys are scoped
+to the submitting principal (e.g. client address) and template, so one
+client's key never replays or blocks another's job. A failed job does not
+hold its key, so retrying after an error renders again.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import secrets
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+RENDER_JOB_TTL_SECONDS = float(os.getenv("RENDER_JOB_TTL_SECONDS", "600"))
+RENDER_JOB_MAX = int(os.getenv("RENDER_JOB_MAX", "200"))
+RENDER_JOB_SWEEP_SECONDS = float(os.getenv("RENDER_JOB_SWEEP_SECONDS", "30"))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class RenderJobConflict(Exception):
+    """The idempotency key was already used for a different payload."""
+
+
+class RenderJobsFull(Exception):
+    """Too many unfinished jobs are held; retry later."""
+
+
+@dataclass
+class RenderJob:
+    job_id: str
+    template_id: str
+    fingerprint: str
+    idempotency_key: Optional[str] = None
+    principal: str = ""
+    status: str = QUEUED
+    stage: str = QUEUED
+    progress: float = 0.0
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    error_status: Optional[int] = None
+    result: Optional[bytes] = field(default=None, repr=False)
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+
+    @property
+    def key_scope(self) -> Optional[Tuple[str, str, str]]:
+        """Where this job's idempotency key is looked up, or None without one."""
+        return (self.principal, self.template_id, self.idempotency_key) if self.idempotency_key else None
+
+    def advance(self, stage: str, progress: float) -> None:
+        """Report a step of the render (shown to pollers)."""
+        self.stage = stage
+        self.progress = max(self.progress, progress)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    def expires_at(self, ttl: float) -> Optional[float]:
+        return self.finished_at + ttl if self.finished_at is not None else None
+
+    def describe(self, ttl: float) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "template_id": self.template_id,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": round(self.progress, 2),
+            "error": self.error,
+            "size": len(self.result) if self.result is not None else None,
+            "created_at": self.created_at,
+            "expires_at": self.expires_at(ttl),
+        }
+
+
+class RenderJobStore:
+    def __init__(self, ttl: float = RENDER_JOB_TTL_SECONDS, max_jobs: int = RENDER_JOB_MAX):
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self._jobs: Dict[str, RenderJob] = {}
+        self._by_key: Dict[Tuple[str, str, str], str] = {}
+        self._lock = threading.Lock()
+        self._stats = {"submitted": 0, "replayed": 0, "completed": 0, "failed": 0, "expired": 0}
+
+    def submit(
+        self,
+        template_id: str,
+        fingerprint: str,
+        run: Callable[[RenderJob], Awaitable[bytes]],
+        idempotency_key: Optional[str] = None,
+        principal: str = "",
+    ) -> Tuple[RenderJob, bool]:
+        """Start *run* as a background job; return ``(job, created)``.
+
+        Must be called from the event loop. Raises RenderJobConflict when
+        *principal* used *idempotency_key* on *template_id* for a job with a
+        different fingerprint, and RenderJobsFull when ``max_jobs`` jobs are
+        still held.
+        """
+        self.sweep()
+        scope = (principal, template_id, idempotency_key) if idempotency_key else None
+        with self._lock:
+            if scope:
+                existing = self._jobs.get(self._by_key.get(scope, ""))
+                if existing is not None and existing.status != FAILED:
+                    if existing.fingerprint != fingerprint:
+                        raise RenderJobConflict("Idempotency key was already used for a different request")
+                    self._stats["replayed"] += 1
+                    return existing, False
+            if len(self._jobs) >= self.max_jobs:
+                raise RenderJobsFull("Too many render jobs are pending")
+            job = RenderJob(
+                job_id=secrets.token_urlsafe(16),
+                template_id=template_id,
+                fingerprint=fingerprint,
+                idempotency_key=idempotency_key,
+                principal=principal,
+            )
+            self._jobs[job.job_id] = job
+            if scope:
+                self._by_key[scope] = job.job_id
+            self._stats["submitted"] += 1
+        job.task = asyncio.get_running_loop().create_task(self._execute(job, run))
+        return job, True
+
+    async def _execute(self, job: RenderJob, run: Callable[[RenderJob], Awaitable[bytes]]) -> None:
+        job.status = RUNNING
+        try:
+            result = await run(job)
+        except asyncio.CancelledError:
+            job.error, job.status = "Render job was cancelled", FAILED
+            raise
+        except Exception as exc:
+            # HTTPException from the render preparation carries .status_code and .detail.
+            job.error = str(getattr(exc, "detail", None) or exc)
+            job.error_status = getattr(exc, "status_code", 500)
+            job.status = FAILED
+            if job.error_status >= 500:
+                logging.getLogger(__name__).warning("Render job %s failed: %s", job.job_id, job.error)
+        else:
+            job.result = result
+            job.status = DONE
+            job.advance(DONE, 1.0)
+        finally:
+            job.finished_at = time.time()
+            job.task = None
+            with self._lock:
+                self._stats["completed" if job.status == DONE else "failed"] += 1
+
+    def get(self, job_id: str) -> Optional[RenderJob]:
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        expires_at = job.expires_at(self.ttl)
+        if expires_at is not None and expires_at <= time.time():
+            return None
+        return job
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Drop finished jobs past their TTL; return how many were removed."""
+        now = time.time() if now is None else now
+        with self._lock:
+            expired = [
+                job for job in self._jobs.values()
+                if job.finished_at is not None and job.finished_at + self.ttl <= now
+            ]
+            for job in expired:
+                del self._jobs[job.job_id]
+                if job.key_scope and self._by_key.get(job.key_scope) == job.job_id:
+                    del self._by_key[job.key_scope]
+            self._stats["expired"] += len(expired)
+        return len(expired)
+
+    async def sweep_forever(self, interval: float = RENDER_JOB_SWEEP_SECONDS) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            self.sweep()
+
+    def cancel_all(self) -> None:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            if job.task is not None:
+                job.task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            jobs = list(self._jobs.values())
+            return {
+                **self._stats,
+                "held": len(jobs),
+                "running": sum(1 for job in jobs if not job.finished),
+                "result_bytes": sum(len(job.result) for job in jobs if job.result is not None),
+                "ttl_seconds": self.ttl,
+                "max_jobs": self.max_jobs,
+            }
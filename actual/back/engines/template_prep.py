@@ -0,0 +1,128 @@
+"""
+Render copies of template PDFs.
+
+Government forms arrive with parts a filled, flattened render never uses:
+XFA packets (up to 800 KB decompressed on the W-4), JavaScript, Reader
+usage rights, XMP metadata, thumbnails and unused form fonts. Every render
+used to clone them and then throw them away. ``build_render_copy`` writes a
+copy without them to ``.render/`` next to the original. The copy is named
+after the original's content hash, so a replaced PDF is never rendered from
+a stale copy. The render path picks it up via ``render_source_path``.
+"""
+from __future__ import annotations
+
+import io
+import logging
+import re
+from pathlib import Path
+from typing import Dict, Optional, Set, Union
+
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import DictionaryObject, NameObject
+
+from .pdf_cache import RENDER_COPY_DIR, source_digest
+from .pdf_compact import write_compact
+
+
+# Fonts kept in /DR whatever the DA strings say: pypdf falls back to Helv,
+# and checkbox appearances use ZapfDingbats.
+_ALWAYS_KEPT_FONTS = {"/Helv", "/ZaDb"}
+_DA_FONT = re.compile(r"/([^\s/\[\]()<>{}%]+)\s+[-+\d.]+\s+Tf")
+
+
+def render_copy_path(pdf_path: Path, digest: str) -> Path:
+    return pdf_path.parent / RENDER_COPY_DIR / f"{pdf_path.stem}-{digest[:16]}.pdf"
+
+
+def render_source_path(pdf_path: Union[str, Path]) -> Path:
+    """The render copy built from *pdf_path*'s current contents, or *pdf_path* itself."""
+    pdf_path = Path(pdf_path)
+    try:
+        copy = render_copy_path(pdf_path, source_digest(pdf_path))
+    except OSError:
+        return pdf_path
+    return copy if copy.is_file() else pdf_path
+
+
+def _delete(container: DictionaryObject, key: str, removed: Dict[str, int]) -> None:
+    if key in container:
+        del container[NameObject(key)]
+        removed[key] = removed.get(key, 0) + 1
+
+
+def strip_for_render(writer: PdfWriter) -> Dict[str, int]:
+    """Remove what a flattened render does not need; return counts by key."""
+    removed: Dict[str, int] = {}
+    root = writer._root_object
+    acro_form = root.get("/AcroForm")
+    acro_form = acro_form.get_object() if acro_form is not None else None
+
+    # XFA stays when there are no AcroForm fields: it is then the fill's fallback.
+    if acro_form is not None and acro_form.get("/Fields"):
+        _delete(acro_form, "/XFA", removed)
+        _delete(acro_form, "/CO", removed)  # calculation order for form JavaScript
+
+    for key in ("/Perms", "/Metadata", "/PieceInfo", "/OpenAction", "/AA"):
+        _delete(root, key, removed)
+    names = root.get("/Names")
+    if names is not None:
+        _delete(names.get_object(), "/JavaScript", removed)
+
+    for page in writer.pages:
+        for key in ("/Thumb", "/PieceInfo", "/AA"):
+            _delete(page, key, removed)
+
+    used_fonts: Set[str] = set(_ALWAYS_KEPT_FONTS)
+    for obj in writer._objects:
+        if isinstance(obj, DictionaryObject):
+            if obj.get("/Subtype") == "/Widget" or "/FT" in obj:
+                _delete(obj, "/AA", removed)  # format/keystroke/calculate scripts
+            if "/DA" in obj:
+                used_fonts.update(f"/{name}" for name in _DA_FONT.findall(str(obj["/DA"])))
+    resources = acro_form.get("/DR") if acro_form is not None else None
+    fonts = resources.get_object().get("/Font") if resources is not None else None
+    if fonts is not None:
+        fonts = fonts.get_object()
+        for name in [name for name in fonts if name not in used_fonts]:
+            del fonts[name]
+            removed["/DR fonts"] = removed.get("/DR fonts", 0) + 1
+
+    # Whatever only the removed entries referenced becomes unreachable here.
+    writer.compress_identical_objects(remove_duplicates=True, remove_unreferenced=True)
+    return removed
+
+
+def build_render_copy(pdf_path: Union[str, Path]) -> Optional[Path]:
+    """
+    Write the render copy of *pdf_path* and remove copies of earlier versions.
+
+    Returns None, leaving renders on the original, when the PDF is encrypted
+    or the copy would not have the same pages and fields.
+    """
+    pdf_path = Path(pdf_path)
+    log = logging.getLogger(__name__)
+    data = pdf_path.read_bytes()
+    reader = PdfReader(io.BytesIO(data))
+    if reader.is_encrypted:
+        return None
+
+    writer = PdfWriter(clone_from=reader)
+    strip_for_render(writer)
+    buffer = io.BytesIO()
+    write_compact(writer, buffer)
+    copy_data = buffer.getvalue()
+
+    copy_reader = PdfReader(io.BytesIO(copy_data))
+    if len(copy_reader.pages) != len(reader.pages) or set(copy_reader.get_fields() or {}) != set(reader.get_fields() or {}):
+        log.warning("Render copy of %s changed its pages or fields; rendering from the original", pdf_path)
+        return None
+
+    target = render_copy_path(pdf_path, source_digest(pdf_path))
+    target.parent.mkdir(exist_ok=True)
+    for stale in target.parent.glob(f"{pdf_path.stem}-*.pdf"):
+        if stale != target and len(stale.stem) == len(target.stem):
+            stale.unlink(missing_ok=True)
+    temporary = target.with_suffix(".tmp")
+    temporary.write_bytes(copy_data)
+    temporary.replace(target)
+    return target
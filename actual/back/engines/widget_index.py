@@ -0,0 +1,139 @@
+"""
+Per-template index of form widgets.
+
+Walking every page's /Annots and dereferencing each annotation to find
+widgets, their field names, types and rectangles is the same work for every
+render of a template. The index is built once per source document (i.e. per
+file hash) and reused by the render path and the field-rect endpoints.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from pypdf import PdfReader
+
+from .pdf_cache import SourceDocument
+
+
+@dataclass(frozen=True)
+class WidgetInfo:
+    page: int
+    annot_index: int                    # position in the page's /Annots array
+    object_number: Optional[int]        # None for direct (inline) annotations
+    name: str                           # fully qualified field name
+    partial_name: str                   # the widget's own /T ("" for kids of a named field)
+    parent_name: str                    # nearest /T up the /Parent chain
+    field_type: str                     # /FT, inherited from parent fields
+    rect: Optional[Tuple[float, float, float, float]]
+    on_states: Tuple[str, ...]          # /AP /N export values other than /Off
+    page_width: float
+    page_height: float
+
+    @property
+    def short_name(self) -> str:
+        return self.partial_name or self.parent_name
+
+
+@dataclass
+class WidgetIndex:
+    widgets: List[WidgetInfo]
+    by_page: Dict[int, List[WidgetInfo]]
+    annotation_counts: List[int]        # len(/Annots) per page, to detect drift
+    # Every annotation with a /T of its own or on a /Parent, widgets or not,
+    # in page and /Annots order: what the field-rect endpoints report.
+    named: List[WidgetInfo]
+
+
+def index_page(page: Any, page_idx: int, others: Optional[List[WidgetInfo]] = None) -> Tuple[List[WidgetInfo], int]:
+    """
+    Return the widgets on *page* and its total number of annotations.
+
+    Named annotations that are not widgets are appended to *others* when given.
+    """
+    annotations = page.get("/Annots")
+    if not annotations:
+        return [], 0
+    annotations = annotations.get_object()
+    page_box = page.mediabox
+    page_width, page_height = float(page_box.width), float(page_box.height)
+
+    widgets: List[WidgetInfo] = []
+    for annot_index, annotation_ref in enumerate(annotations):
+        try:
+            annotation = annotation_ref.get_object()
+            is_widget = annotation.get("/Subtype") == "/Widget"
+            if not is_widget and (others is None or not (annotation.get("/T") or annotation.get("/Parent"))):
+                continue
+
+            partial_name = str(annotation.get("/T") or "")
+            field_type = annotation.get("/FT")
+            names = [partial_name] if partial_name else []
+            parent_name = ""
+            parent = annotation.get("/Parent")
+            while parent is not None:
+                parent_obj = parent.get_object()
+                parent_title = parent_obj.get("/T")
+                if parent_title:
+                    names.append(str(parent_title))
+                    parent_name = parent_name or str(parent_title)
+                if field_type is None:
+                    field_type = parent_obj.get("/FT")
+                parent = parent_obj.get("/Parent")
+
+            rect = annotation.get("/Rect")
+            on_states: Tuple[str, ...] = ()
+            appearance = annotation.get("/AP")
+            if appearance is not None:
+                normal = appearance.get_object().get("/N")
+                normal = normal.get_object() if normal is not None else None
+                if hasattr(normal, "keys"):
+                    on_states = tuple(str(key) for key in normal.keys() if str(key) != "/Off")
+
+            reference = getattr(annotation_ref, "idnum", None)
+            (widgets if is_widget else others).append(WidgetInfo(
+                page=page_idx,
+                annot_index=annot_index,
+                object_number=reference,
+                name=".".join(reversed(names)),
+                partial_name=partial_name,
+                parent_name=parent_name,
+                field_type=str(field_type or ""),
+                rect=tuple(float(value) for value in rect) if rect else None,
+                on_states=on_states,
+                page_width=page_width,
+                page_height=page_height,
+            ))
+        except Exception:
+            continue
+    return widgets, len(annotations)
+
+
+def build_widget_index(reader: PdfReader) -> WidgetIndex:
+    widgets: List[WidgetInfo] = []
+    by_page: Dict[int, List[WidgetInfo]] = {}
+    counts: List[int] = []
+    named: List[WidgetInfo] = []
+    for page_idx, page in enumerate(reader.pages):
+        others: List[WidgetInfo] = []
+        page_widgets, count = index_page(page, page_idx, others)
+        counts.append(count)
+        if page_widgets:
+            by_page[page_idx] = page_widgets
+            widgets.extend(page_widgets)
+        named.extend(sorted(
+            (info for info in page_widgets + others if info.partial_name or info.parent_name),
+            key=lambda info: info.annot_index,
+        ))
+    return WidgetIndex(widgets=widgets, by_page=by_page, annotation_counts=counts, named=named)
+
+
+def widget_index(source: SourceDocument) -> WidgetIndex:
+    """Return the (cached) widget index of a parsed template."""
+    index = source.derived.get("widgets")
+    if index is None:
+        with source.lock:
+            index = source.derived.get("widgets")
+            if index is None:
+                index = source.derived["widgets"] = build_widget_index(source.reader)
+    return index
@@ -1,14 +1,19 @@
 from __future__ import annotations
 
+import asyncio
+import copy
+import hashlib
 import json
+import logging
 import os
 import smtplib
 import secrets
+import threading
 import time
-import uuid
 from datetime import datetime, timezone
 from html import escape
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
+from contextlib import asynccontextmanager, contextmanager
 from io import BytesIO
 from email.message import EmailMessage
 from pathlib import Path
@@ -21,15 +26,20 @@ import re
 import httpx
 from fastapi import FastAPI, HTTPException, Query, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, HTMLResponse, Response, JSONResponse
-from starlette.background import BackgroundTask
+from fastapi.responses import FileResponse, HTMLResponse, Response, JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 from pypdf import PdfReader
 
-from .core.mapping import build_pdf_field_values
-from .core.template_store import load_template, list_templates, load_template_meta
-from .core.transforms import apply_transforms, matches_conditions
-from .core.formula import FormulaError, formula_dependencies
+from .core.template_store import (
+    TemplateBundle,
+    TemplateCatalog,
+    invalidate_template_cache,
+    load_template,
+    template_cache_stats,
+)
+from .core.mapping import LogicSession, logic_rule_errors
+from .core.transforms import TransformProgram, TransformRun, matches_conditions
+from .core.formula import FormulaError, formula_cache_stats, formula_dependencies
 from .core.tax_rules import calculate_standard_deduction
 from .core.admin_auth import (
     ADMIN_USERNAME,
@@ -41,9 +51,30 @@ from .core.admin_auth import (
     verify_session_token,
 )
 from .core.analytics import metrics as analytics_metrics, record_event
-from .engines.acroform import fill_acroform_pdf
+from .engines.acroform import PDF_LINEARIZE_OUTPUT, PDF_OPTIMIZE_OUTPUT, SIGNATURE_DPI
+from .engines.bulk_render import BulkInputError, BulkInputTooLarge, iter_records, stream_zip
+from .engines.executor import RENDER_RETRY_AFTER_SECONDS, RenderBusy, RenderExecutor, RenderTimeout
+from .engines.field_catalog import field_catalog
+from .engines.pdf_cache import PDF_OUTPUT_MODE, WRITER_POOL_SIZES, load_source, source_digest
+from .engines.render_jobs import DONE, FAILED, RenderJob, RenderJobConflict, RenderJobStore, RenderJobsFull
+from .engines.render_cache import get_rendered, put_rendered, render_cache_stats, render_key
+from .engines.template_prep import build_render_copy, render_copy_path, render_source_path
+from .engines.widget_index import widget_index
+
+
+
+@asynccontextmanager
+async def _lifespan(_app: FastAPI):
+    # Spawn and warm the render workers before the first request needs them.
+    render_executor.start()
+    sweeper = asyncio.create_task(render_jobs.sweep_forever())
+    yield
+    sweeper.cancel()
+    render_jobs.cancel_all()
+    render_executor.shutdown()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=_lifespan)
 
 
 @app.get("/api/tax-rules/{year}/standard-deduction")
@@ -89,7 +120,9 @@ app.add_middleware(
     CORSMiddleware,
     allow_origins=CORS_ORIGINS,
     allow_methods=["GET", "POST", "PUT", "OPTIONS"],
-    allow_headers=["Content-Type", "Authorization", "X-Admin-Key"],
+    allow_headers=["Content-Type", "Authorization", "X-Admin-Key", "Range"],
+    # Viewers loading a linearized PDF in pieces need to see these.
+    expose_headers=["Accept-Ranges", "Content-Range", "Content-Length"],
 )
 
 # Admin API key: set ADMIN_API_KEY env var to protect /api/admin/* endpoints
@@ -100,6 +133,7 @@ ADMIN_COOKIE_SECURE = os.getenv("ADMIN_COOKIE_SECURE", "1") != "0"
 RATE_LIMIT_WINDOW = int(os.getenv("RATE_LIMIT_WINDOW", "60"))        # seconds
 RATE_LIMIT_MAX = int(os.getenv("RATE_LIMIT_MAX", "120"))             # requests per window
 RATE_LIMIT_RENDER_MAX = int(os.getenv("RATE_LIMIT_RENDER_MAX", "10"))  # PDF renders per window
+PACKET_MAX_TEMPLATES = int(os.getenv("PACKET_MAX_TEMPLATES", "8"))      # templates per packet render
 
 _rate_buckets: Dict[str, list[float]] = defaultdict(list)
 
@@ -152,7 +186,9 @@ async def rate_limit_middleware(request: Request, call_next):
     ip = _get_client_ip(request)
     try:
         # Stricter limit for PDF rendering
-        if path.startswith("/api/render/"):
+        if path.startswith(("/api/render/", "/api/packets/")) or (
+            path.startswith("/api/render-jobs/") and request.method == "POST"
+        ):
             _check_rate_limit(f"render:{ip}", RATE_LIMIT_RENDER_MAX)
         else:
             _check_rate_limit(ip)
@@ -165,11 +201,69 @@ async def rate_limit_middleware(request: Request, call_next):
 BASE_DIR = Path(__file__).resolve().parent  # actual/back
 DATA_DIR = BASE_DIR / "data"
 TEMPLATES_ROOT = DATA_DIR / "templates"
-OUTPUT_DIR = DATA_DIR / "output"
 I18N_DIR = DATA_DIR / "i18n"
 ADMIN_PAGE = BASE_DIR / "static" / "scenario-admin.html"
 
 DEFAULT_LOCALE = "en"
+template_catalog = TemplateCatalog(TEMPLATES_ROOT)
+
+
+# Templates that have no render copy yet (added before copies existed, or
+# copied in by hand) get one built in the background on their first render.
+BUILD_RENDER_COPIES = os.getenv("BUILD_RENDER_COPIES", "1") != "0"
+_render_copy_builds: set[str] = set()  # digests of template PDFs whose copy was attempted
+_render_copy_builds_lock = threading.Lock()
+
+
+def _build_render_copy_once(pdf_path: Path, digest: str) -> None:
+    """Build the render copy of one version of a template PDF, in the background and at most once."""
+    with _render_copy_builds_lock:
+        if not BUILD_RENDER_COPIES or digest in _render_copy_builds:
+            return
+        _render_copy_builds.add(digest)
+
+    def build() -> None:
+        try:
+            build_render_copy(pdf_path)
+        except Exception as exc:
+            logging.getLogger(__name__).warning("Render copy of %s failed: %s", pdf_path, exc)
+
+    threading.Thread(target=build, name="render-copy", daemon=True).start()
+
+
+def _render_source(bundle: TemplateBundle) -> tuple[Path, str]:
+    """The PDF renders of *bundle* read (its render copy, if built) and that file's digest.
+
+    Resolved once per loaded bundle: a new PDF written through the admin API
+    reloads the bundle, and with it this value. While the bundle has no
+    render copy, each call checks whether one has been built since.
+    """
+    source = bundle.derived.get("render_source")
+    if source is None:
+        path = render_source_path(bundle.pdf_path)
+        source = bundle.derived["render_source"] = (path, source_digest(path))
+    if source[0] == bundle.pdf_path:
+        copy = render_copy_path(bundle.pdf_path, source[1])
+        if copy.is_file():
+            source = bundle.derived["render_source"] = (copy, source_digest(copy))
+        else:
+            _build_render_copy_once(bundle.pdf_path, source[1])
+    return source
+
+
+def _hot_template_pdfs() -> list[Path]:
+    """PDFs every render worker loads at start-up: the templates that have a writer pool."""
+    paths = []
+    for template_id in WRITER_POOL_SIZES:
+        try:
+            paths.append(_render_source(load_template(TEMPLATES_ROOT, template_id))[0])
+        except Exception:
+            continue
+    return paths
+
+
+render_executor = RenderExecutor(warm_paths=_hot_template_pdfs)
+render_jobs = RenderJobStore()
 MAX_TEMPLATE_PDF_BYTES = int(os.getenv("MAX_TEMPLATE_PDF_BYTES", str(20 * 1024 * 1024)))
 
 
@@ -182,6 +276,10 @@ class FeedbackPayload(BaseModel):
 
 class ResolveQuestionsPayload(BaseModel):
     answers: dict = Field(default_factory=dict)
+    # Optional client-chosen id for one pass through a form: transforms are
+    # then recomputed only for the answers that changed since its last call.
+    # Pass the same flow_id to the render to end the flow.
+    flow_id: Optional[str] = Field(default=None, pattern=r"^[A-Za-z0-9_-]{16,64}$")
 
 
 class AdminLoginPayload(BaseModel):
@@ -286,13 +384,81 @@ def _is_field_visible(field: dict, answers: dict) -> bool:
     return True
 
 
-def _resolve_visible_fields(schema: dict, answers: dict) -> list[dict]:
+# Last transform run per (client, template, flow id), so each
+# resolve-questions call in a flow only reruns the transforms its changed
+# answers affect. The runs hold answers (personal data): they expire after
+# QUESTION_FLOW_TTL_SECONDS without a call, or when the flow's document is
+# rendered, and one client keeps at most QUESTION_FLOWS_PER_CLIENT of them,
+# so it cannot push everyone else's flows out.
+QUESTION_FLOW_CACHE_SIZE = int(os.getenv("QUESTION_FLOW_CACHE_SIZE", "512"))
+QUESTION_FLOW_TTL_SECONDS = float(os.getenv("QUESTION_FLOW_TTL_SECONDS", "900"))
+QUESTION_FLOWS_PER_CLIENT = int(os.getenv("QUESTION_FLOWS_PER_CLIENT", "8"))
+
+_FlowKey = tuple[str, str, str]
+_question_flows: "OrderedDict[_FlowKey, tuple[TransformProgram, TransformRun, float]]" = OrderedDict()
+_question_flow_counts: Dict[str, int] = defaultdict(int)
+_question_flows_lock = threading.Lock()
+
+
+def _drop_question_flow(key: _FlowKey) -> None:
+    """Forget one flow. Caller holds _question_flows_lock."""
+    if _question_flows.pop(key, None) is not None:
+        _question_flow_counts[key[0]] -= 1
+        if not _question_flow_counts[key[0]]:
+            del _question_flow_counts[key[0]]
+
+
+def _expire_question_flows(now: float) -> None:
+    """Drop flows idle for longer than the TTL. Caller holds _question_flows_lock."""
+    # Entries are kept in order of last use, so the expired ones come first.
+    while _question_flows:
+        key, (_, _, last_used) = next(iter(_question_flows.items()))
+        if now - last_used <= QUESTION_FLOW_TTL_SECONDS:
+            break
+        _drop_question_flow(key)
+
+
+def _end_question_flow(client: str, template_id: str, flow_id: Any) -> None:
+    if isinstance(flow_id, str):
+        with _question_flows_lock:
+            _drop_question_flow((client, template_id, flow_id))
+
+
+def _apply_flow_transforms(bundle: TemplateBundle, answers: dict, flow_id: Optional[str], client: str = "") -> dict:
+    program = bundle.transform_program
+    if not flow_id or QUESTION_FLOW_CACHE_SIZE <= 0:
+        return program.apply(answers)
+    key = (client, bundle.template_id, flow_id)
+    now = time.monotonic()
+    with _question_flows_lock:
+        _expire_question_flows(now)
+        cached = _question_flows.get(key)
+    # Changes are always diffed against the cached answers, never taken
+    # from the client, so a run stays exact whoever shares the flow id.
+    previous = cached[1] if cached and cached[0] is program else None
+    run = program.apply_incremental(answers, previous)
+    with _question_flows_lock:
+        if key not in _question_flows:
+            if _question_flow_counts[client] >= max(QUESTION_FLOWS_PER_CLIENT, 1):
+                _drop_question_flow(next(other for other in _question_flows if other[0] == client))
+            _question_flow_counts[client] += 1
+        _question_flows[key] = (program, run, now)
+        _question_flows.move_to_end(key)
+        while len(_question_flows) > QUESTION_FLOW_CACHE_SIZE:
+            _drop_question_flow(next(iter(_question_flows)))
+    return run.result
+
+
+def _resolve_visible_fields(
+    bundle: TemplateBundle, answers: dict, flow_id: Optional[str] = None, client: str = ""
+) -> list[dict]:
+    schema = bundle.schema
     fields = schema.get("fields", []) if isinstance(schema, dict) else []
     resolved_answers = dict(answers)
     for field in fields:
         if field.get("hidden") and "defaultValue" in field:
-            resolved_answers.setdefault(field.get("key"), field["defaultValue"])
-    resolved_answers = apply_transforms(resolved_answers, schema.get("transforms", []))
+            resolved_answers.setdefault(field.get("key"), copy.deepcopy(field["defaultValue"]))
+    resolved_answers = _apply_flow_transforms(bundle, resolved_answers, flow_id, client)
     return [f for f in fields if not f.get("hidden") and _is_field_visible(f, resolved_answers)]
 
 
@@ -508,10 +674,30 @@ def api_admin_analytics(request: Request, days: int = Query(30, ge=1, le=365)):
     return analytics_metrics(days)
 
 
+@app.get("/api/admin/cache-stats")
+def api_admin_cache_stats(request: Request):
+    _require_admin_key(request)
+    return {
+        "templates": template_cache_stats(),
+        # Parsed sources and writer pools live in the render workers.
+        **render_executor.cache_stats(),
+        "render_executor": render_executor.stats(),
+        "render_results": render_cache_stats(),
+        "render_jobs": render_jobs.stats(),
+        "formulas": formula_cache_stats(),
+    }
+
+
 # ---------------------------------------------------------------------------
 # Admin endpoints
 # ---------------------------------------------------------------------------
 
+def _invalidate_template(template_id: str) -> None:
+    """Forget everything derived from a template folder after it was rewritten."""
+    invalidate_template_cache(template_id)
+    template_catalog.invalidate(template_id)
+
+
 @app.get("/admin/scenario-builder", response_class=HTMLResponse)
 def admin_scenario_builder(request: Request):
     _require_admin_key(request)
@@ -523,14 +709,7 @@ def admin_scenario_builder(request: Request):
 @app.get("/api/admin/templates")
 def api_admin_list_templates(request: Request):
     _require_admin_key(request)
-    template_ids = list_templates(TEMPLATES_ROOT, include_unpublished=True)
-    templates = []
-    for tid in template_ids:
-        try:
-            templates.append(load_template_meta(TEMPLATES_ROOT, tid, include_unpublished=True))
-        except Exception:
-            continue
-    return {"templates": templates}
+    return {"templates": [entry.meta for entry in template_catalog.entries(include_unpublished=True)]}
 
 
 @app.get("/api/admin/templates/{template_id}/bundle")
@@ -555,8 +734,8 @@ def api_admin_pdf_fields(template_id: str, request: Request):
         bundle = load_template(TEMPLATES_ROOT, template_id, include_unpublished=True)
     except Exception as exc:
         raise HTTPException(404, str(exc))
-    fields = PdfReader(str(bundle.pdf_path)).get_fields() or {}
-    return {"count": len(fields), "fields": list(fields.keys())}
+    fields = field_catalog(load_source(bundle.pdf_path)).names
+    return {"count": len(fields), "fields": list(fields)}
 
 
 @app.get("/api/admin/templates/{template_id}/pdf-field-rects")
@@ -567,28 +746,17 @@ def api_admin_pdf_field_rects(template_id: str, request: Request):
     except Exception as exc:
         raise HTTPException(404, str(exc))
 
-    reader = PdfReader(str(bundle.pdf_path))
-    result: list[dict] = []
-    for page_idx, page in enumerate(reader.pages):
-        for annot_ref in page.get("/Annots", []) or []:
-            annotation = annot_ref.get_object()
-            field_name = annotation.get("/T")
-            if not field_name:
-                parent = annotation.get("/Parent")
-                while parent and not field_name:
-                    parent_obj = parent.get_object() if hasattr(parent, "get_object") else parent
-                    field_name = parent_obj.get("/T")
-                    parent = parent_obj.get("/Parent")
-            rect = annotation.get("/Rect")
-            if not field_name or not rect:
-                continue
-            result.append({
-                "name": str(field_name),
-                "page": page_idx,
-                "rect": [float(value) for value in rect],
-                "page_width": float(page.mediabox.width),
-                "page_height": float(page.mediabox.height),
-            })
+    result = [
+        {
+            "name": widget.short_name,
+            "page": widget.page,
+            "rect": list(widget.rect),
+            "page_width": widget.page_width,
+            "page_height": widget.page_height,
+        }
+        for widget in widget_index(load_source(bundle.pdf_path)).named
+        if widget.short_name and widget.rect
+    ]
     return {"count": len(result), "fields": result}
 
 
@@ -706,6 +874,7 @@ def api_admin_save_bundle(template_id: str, payload: dict, request: Request):
                 known_keys.add(output)
         known_keys.update((transform.get("set") or {}).keys())
 
+    validation_errors.extend(logic_rule_errors(mapping_json))
     if validation_errors:
         raise HTTPException(400, {"message": "Invalid form schema", "errors": validation_errors})
 
@@ -725,6 +894,7 @@ def api_admin_save_bundle(template_id: str, payload: dict, request: Request):
     finally:
         for temporary, _ in pending_files:
             temporary.unlink(missing_ok=True)
+        _invalidate_template(template_id)
 
     return {"status": "saved", "template_id": template_id}
 
@@ -789,6 +959,11 @@ def api_admin_create_template(payload: CreateTemplatePayload, request: Request):
                 raise HTTPException(400, "Uploaded PDF could not be parsed")
 
             (target_dir / pdf_filename).write_bytes(pdf_bytes)
+            # Renders fall back to the uploaded file if the copy cannot be built.
+            try:
+                build_render_copy(target_dir / pdf_filename)
+            except Exception as exc:
+                logging.getLogger(__name__).warning("Render copy of %s failed: %s", template_id, exc)
         else:
             # Create a minimal blank PDF placeholder
             (target_dir / pdf_filename).write_bytes(
@@ -871,9 +1046,7 @@ def api_admin_create_template(payload: CreateTemplatePayload, request: Request):
         pdf_fields: list[str] = []
         if payload.pdf_base64:
             try:
-                reader = PdfReader(str(target_dir / pdf_filename))
-                raw_fields = reader.get_fields() or {}
-                pdf_fields = list(raw_fields.keys())
+                pdf_fields = list(field_catalog(load_source(target_dir / pdf_filename)).names)
             except Exception:
                 pass
 
@@ -887,6 +1060,8 @@ def api_admin_create_template(payload: CreateTemplatePayload, request: Request):
         import shutil
         shutil.rmtree(target_dir, ignore_errors=True)
         raise HTTPException(500, f"Failed to create template: {e}")
+    finally:
+        _invalidate_template(template_id)
 
     return {
         "status": "created",
@@ -1013,15 +1188,6 @@ def _utc_date_from_timestamp(timestamp: float) -> str:
     return datetime.fromtimestamp(timestamp, tz=timezone.utc).date().isoformat()
 
 
-def _template_lastmod(template_id: str) -> str:
-    template_dir = TEMPLATES_ROOT / template_id
-    newest_mtime = max(
-        (path.stat().st_mtime for path in template_dir.rglob("*") if path.is_file()),
-        default=template_dir.stat().st_mtime if template_dir.exists() else time.time(),
-    )
-    return _utc_date_from_timestamp(newest_mtime)
-
-
 def _url_entry(path: str, changefreq: str, priority: str, lastmod: str) -> str:
     loc = escape(f"{BASE_SITE_URL}{path}", quote=True)
     return (
@@ -1037,18 +1203,16 @@ def _url_entry(path: str, changefreq: str, priority: str, lastmod: str) -> str:
 @app.get("/sitemap.xml")
 def sitemap_xml():
     """Generate sitemap.xml with all template pages and static pages."""
-    template_ids = list_templates(TEMPLATES_ROOT)
-
     today = datetime.now(timezone.utc).date().isoformat()
     urls = [
         _url_entry(page["path"], page["changefreq"], page["priority"], today)
         for page in STATIC_PAGES
     ]
 
-    for tid in template_ids:
+    for entry in template_catalog.entries():
+        tid, meta = entry.template_id, entry.meta
         try:
-            meta = load_template_meta(TEMPLATES_ROOT, tid)
-            lastmod = _template_lastmod(tid)
+            lastmod = _utc_date_from_timestamp(entry.last_modified)
             urls.append(_url_entry(f"/{tid}", "weekly", "0.9", lastmod))
             for guide in meta.get("seo_guides", []):
                 if not isinstance(guide, dict) or guide.get("published", True) is False:
@@ -1104,7 +1268,7 @@ def robots_txt():
 def api_seo_meta(template_id: str):
     """Return SEO metadata for a template — used by SSR/prerender."""
     try:
-        meta = load_template_meta(TEMPLATES_ROOT, template_id)
+        meta = template_catalog.get(template_id).meta
     except Exception:
         raise HTTPException(404, f"Template '{template_id}' not found")
 
@@ -1164,20 +1328,12 @@ def api_seo_meta(template_id: str):
 @app.get("/api/meta")
 def api_meta():
     """App-level metadata: supported locales, template count, computed stats."""
-    template_ids = list_templates(TEMPLATES_ROOT)
-    total_fields = 0
-    for tid in template_ids:
-        try:
-            bundle = load_template(TEMPLATES_ROOT, tid)
-            total_fields += len(bundle.schema.get("fields", []))
-        except Exception:
-            pass
-
+    entries = template_catalog.entries()
     return {
         "locales": _supported_locales(),
         "default_locale": DEFAULT_LOCALE,
-        "template_count": len(template_ids),
-        "total_fields": total_fields,
+        "template_count": len(entries),
+        "total_fields": sum(entry.field_count for entry in entries),
     }
 
 
@@ -1201,20 +1357,15 @@ def api_list_templates(
     country: Optional[str] = Query(None, description="Filter by country code"),
     tag: Optional[str] = Query(None, description="Filter by tag"),
 ):
-    template_ids = list_templates(TEMPLATES_ROOT)
     results = []
 
-    for tid in template_ids:
-        try:
-            meta = load_template_meta(TEMPLATES_ROOT, tid)
-        except Exception:
-            continue
-
-        if category and meta.get("category", "") != category:
+    for entry in template_catalog.entries():
+        meta = entry.meta
+        if category and entry.category != category:
             continue
-        if country and meta.get("country", "") != country:
+        if country and entry.country != country:
             continue
-        if tag and tag not in meta.get("tags", []):
+        if tag and tag not in entry.tags:
             continue
 
         if q:
@@ -1236,7 +1387,7 @@ def api_list_templates(
 @app.get("/api/templates/{template_id}")
 def api_template_detail(template_id: str):
     try:
-        meta = load_template_meta(TEMPLATES_ROOT, template_id)
+        meta = template_catalog.get(template_id).meta
     except Exception as e:
         raise HTTPException(404, str(e))
     return meta
@@ -1261,14 +1412,14 @@ def api_template_schema(
 
 
 @app.post("/api/templates/{template_id}/resolve-questions")
-def api_resolve_questions(template_id: str, payload: ResolveQuestionsPayload):
+def api_resolve_questions(template_id: str, payload: ResolveQuestionsPayload, request: Request):
     try:
         bundle = load_template(TEMPLATES_ROOT, template_id)
     except Exception as e:
         raise HTTPException(404, str(e))
 
     answers = payload.answers if isinstance(payload.answers, dict) else {}
-    visible_fields = _resolve_visible_fields(bundle.schema, answers)
+    visible_fields = _resolve_visible_fields(bundle, answers, payload.flow_id, _get_client_ip(request))
     return {"fields": visible_fields}
 
 
@@ -1279,9 +1430,8 @@ def api_pdf_fields(template_id: str):
     except Exception as e:
         raise HTTPException(404, str(e))
 
-    reader = PdfReader(str(bundle.pdf_path))
-    fields = reader.get_fields() or {}
-    return {"count": len(fields), "fields": list(fields.keys())}
+    fields = field_catalog(load_source(bundle.pdf_path)).names
+    return {"count": len(fields), "fields": list(fields)}
 
 
 @app.get("/api/templates/{template_id}/pdf-field-rects")
@@ -1292,44 +1442,19 @@ def api_pdf_field_rects(template_id: str):
     except Exception as e:
         raise HTTPException(404, str(e))
 
-    reader = PdfReader(str(bundle.pdf_path))
     result: list[dict] = []
-
-    for page_idx, page in enumerate(reader.pages):
-        page_box = page.mediabox
-        page_w = float(page_box.width)
-        page_h = float(page_box.height)
-
-        annotations = page.get("/Annots")
-        if not annotations:
+    for widget in widget_index(load_source(bundle.pdf_path)).named:
+        # An annotation's own /T, or the qualified name of the field it belongs to.
+        field_name = widget.partial_name or widget.name
+        if not field_name or not widget.rect:
             continue
-        for annot_ref in annotations:
-            annot = annot_ref.get_object()
-            field_name = annot.get("/T")
-            if not field_name:
-                # Walk up parent chain for partial names
-                parent = annot.get("/Parent")
-                parts = []
-                while parent:
-                    parent_obj = parent.get_object() if hasattr(parent, "get_object") else parent
-                    if parent_obj.get("/T"):
-                        parts.append(str(parent_obj["/T"]))
-                    parent = parent_obj.get("/Parent")
-                if parts:
-                    field_name = ".".join(reversed(parts))
-
-            rect = annot.get("/Rect")
-            if not field_name or not rect:
-                continue
-
-            x1, y1, x2, y2 = [float(v) for v in rect]
-            result.append({
-                "name": str(field_name),
-                "page": page_idx,
-                "rect": [x1, y1, x2, y2],
-                "page_width": page_w,
-                "page_height": page_h,
-            })
+        result.append({
+            "name": field_name,
+            "page": widget.page,
+            "rect": list(widget.rect),
+            "page_width": widget.page_width,
+            "page_height": widget.page_height,
+        })
 
     return {"count": len(result), "fields": result}
 
@@ -1349,43 +1474,354 @@ def api_pdf_file(template_id: str):
     )
 
 
-@app.post("/api/render/{template_id}")
-def api_render(template_id: str, payload: dict):
-    data = payload.get("data")
-    if not isinstance(data, dict):
-        raise HTTPException(400, 'payload must be: {"data": {..}}')
-
+def _prepare_render(
+    template_id: str,
+    data: dict,
+    logic: Optional[LogicSession] = None,
+    include_unpublished: bool = False,
+) -> tuple[TemplateBundle, Dict[str, Any], list]:
+    """
+    Resolve the template and turn form answers into PDF field values and overlays.
+
+    With *logic*, a session over the template's mapping plan, the mapping's
+    logic rules recompute only what changed since the session's last record.
+    Admin callers pass *include_unpublished* to render draft templates.
+    """
     try:
-        bundle = load_template(TEMPLATES_ROOT, template_id)
+        bundle = load_template(TEMPLATES_ROOT, template_id, include_unpublished=include_unpublished)
     except Exception as e:
         raise HTTPException(404, str(e))
 
     if bundle.engine != "acroform":
         raise HTTPException(400, f"Unsupported engine for now: {bundle.engine}")
 
-    # Inject default values from hidden fields
+    # Inject default values from hidden fields. The defaults belong to the
+    # shared bundle: copy them before transforms get to change them.
     hidden_defaults = _collect_hidden_defaults(bundle.schema)
     for k, v in hidden_defaults.items():
         if k not in data:
-            data[k] = v
+            data[k] = copy.deepcopy(v)
 
     # Use declarative transforms from schema if available, else legacy enrichment
     schema_transforms = bundle.schema.get("transforms")
     if schema_transforms:
-        prepared_data = apply_transforms(data, schema_transforms)
+        prepared_data = _compiled(bundle, "transform_program").apply(data)
     else:
         prepared_data = enrich_form_data(template_id, data)
-    pdf_field_values, sig_overlays = build_pdf_field_values(prepared_data, bundle.mapping)
+    plan = _compiled(bundle, "mapping_plan")
+    if logic is not None and logic.plan is plan:
+        pdf_field_values, sig_overlays = logic.build(prepared_data)
+    else:
+        pdf_field_values, sig_overlays = plan.build(prepared_data)
+    return bundle, pdf_field_values, sig_overlays
 
-    request_id = uuid.uuid4().hex[:12]
-    out_path = OUTPUT_DIR / f"{template_id}_{request_id}.pdf"
-    fill_acroform_pdf(bundle.pdf_path, pdf_field_values, out_path, sig_overlays)
 
-    return FileResponse(
-        path=str(out_path),
+def _compiled(bundle: TemplateBundle, name: str) -> Any:
+    """The bundle's mapping_plan or transform_program, or a 500 naming the broken template file."""
+    try:
+        return getattr(bundle, name)
+    except Exception as e:
+        source = "mapping" if name == "mapping_plan" else "schema transforms"
+        raise HTTPException(500, f"Template {bundle.template_id} has an invalid {source}: {e}")
+
+
+@contextmanager
+def _executor_http_errors():
+    """Translate render executor back-pressure into HTTP errors."""
+    try:
+        yield
+    except RenderBusy as exc:
+        raise HTTPException(503, "Renderer is busy, please retry shortly.", headers={"Retry-After": str(exc.retry_after)})
+    except RenderTimeout:
+        raise HTTPException(504, "Rendering took too long.")
+
+
+# Renders in progress by cache key, so identical concurrent requests (a
+# double-clicked download) share one render instead of queueing two.
+_renders_in_flight: Dict[str, asyncio.Future] = {}
+
+
+async def _render_bytes(
+    bundle: TemplateBundle, pdf_field_values: Dict[str, Any], sig_overlays: list, linearize: bool = False
+) -> bytes:
+    """Render on the process pool, translating executor back-pressure into HTTP errors.
+
+    Finished documents are cached by the hash of the template content and the
+    prepared values, so repeated downloads of the same document skip rendering.
+    Renders read the template's render copy when one was built.
+    """
+    pdf_path, pdf_digest = _render_source(bundle)
+    # Hashing the values and the disk tier's file I/O stay off the event loop.
+    key = await asyncio.to_thread(
+        render_key,
+        pdf_digest,
+        pdf_field_values,
+        sig_overlays,
+        linearize,
+        PDF_OUTPUT_MODE,
+        PDF_OPTIMIZE_OUTPUT,
+        SIGNATURE_DPI,
+    )
+    cached = await asyncio.to_thread(get_rendered, key)
+    if cached is not None:
+        return cached
+    while key in _renders_in_flight:
+        in_flight = _renders_in_flight[key]
+        try:
+            # A failed shared render raises its own error here too.
+            return await asyncio.shield(in_flight)
+        except asyncio.CancelledError:
+            if not in_flight.cancelled():
+                raise
+            # The request that started the render went away; render here instead.
+
+    in_flight = asyncio.get_running_loop().create_future()
+    _renders_in_flight[key] = in_flight
+    try:
+        with _executor_http_errors():
+            content = await render_executor.render(pdf_path, pdf_field_values, sig_overlays, linearize)
+        try:
+            await asyncio.to_thread(put_rendered, key, content)
+        except Exception as exc:  # e.g. a full disk: the render itself succeeded
+            logging.getLogger(__name__).warning("Could not cache render %s: %s", key[:12], exc)
+    except Exception as exc:
+        in_flight.set_exception(exc)
+        in_flight.exception()  # retrieved: no "never retrieved" warning when nobody waited
+        raise
+    except BaseException:
+        in_flight.cancel()
+        raise
+    else:
+        in_flight.set_result(content)
+    finally:
+        _renders_in_flight.pop(key, None)
+    return content
+
+
+_BYTE_RANGE = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+def _pdf_response(content: bytes, filename: str, byte_range: Optional[str] = None) -> Response:
+    """A PDF download that honours a single ``Range``, so a viewer can fetch a linearized file in pieces."""
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"', "Accept-Ranges": "bytes"}
+    match = _BYTE_RANGE.fullmatch(byte_range.strip()) if byte_range else None
+    if match is None or match.groups() == ("", ""):
+        # No range, several ranges or a malformed one: the whole file is a valid answer.
+        return Response(content=content, media_type="application/pdf", headers=headers)
+    first, last = match.groups()
+    if first and last and int(first) > int(last):
+        # An invalid range such as bytes=9-3 is ignored, not refused (RFC 9110, 14.2).
+        return Response(content=content, media_type="application/pdf", headers=headers)
+    size = len(content)
+    if first:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    else:
+        start, end = max(size - int(last), 0), size - 1  # suffix range: the last N bytes
+    if start > end:
+        raise HTTPException(416, "Requested range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return Response(content=content[start:end + 1], status_code=206, media_type="application/pdf", headers=headers)
+
+
+@app.post("/api/render/{template_id}")
+async def api_render(
+    template_id: str,
+    payload: dict,
+    request: Request,
+    linearize: Optional[bool] = Query(None, description="Linearize for fast web view (default: PDF_LINEARIZE_OUTPUT)"),
+):
+    data = payload.get("data")
+    if not isinstance(data, dict):
+        raise HTTPException(400, 'payload must be: {"data": {..}}')
+    # Rendering completes a question flow; its answers are not needed after this.
+    _end_question_flow(_get_client_ip(request), template_id, payload.get("flow_id"))
+
+    # Template loads, transforms and mapping run on a thread, not the event loop.
+    bundle, pdf_field_values, sig_overlays = await asyncio.to_thread(_prepare_render, template_id, data)
+    # Rendered in memory on a worker process, so a burst of renders does not
+    # hold the GIL that every other request needs.
+    content = await _render_bytes(
+        bundle, pdf_field_values, sig_overlays, PDF_LINEARIZE_OUTPUT if linearize is None else linearize
+    )
+
+    # Identical renders come from the render cache, so a viewer fetching a
+    # linearized result in ranges does not render it again for each piece.
+    return _pdf_response(content, f"{template_id}.pdf", request.headers.get("range"))
+
+
+async def _run_render_job(job: RenderJob, template_id: str, data: dict, linearize: bool) -> bytes:
+    job.advance("preparing", 0.1)
+    bundle, pdf_field_values, sig_overlays = await asyncio.to_thread(_prepare_render, template_id, data)
+    job.advance("rendering", 0.3)
+    return await _render_bytes(bundle, pdf_field_values, sig_overlays, linearize)
+
+
+@app.post("/api/render-jobs/{template_id}", status_code=202)
+async def api_submit_render_job(
+    template_id: str,
+    payload: dict,
+    request: Request,
+    linearize: Optional[bool] = Query(None, description="Linearize for fast web view (default: PDF_LINEARIZE_OUTPUT)"),
+):
+    """Queue a render and return its job id at once; poll, then download the result.
+
+    An ``Idempotency-Key`` header makes retries return the same job. The
+    result URL answers range requests, so a viewer can show page 1 of a
+    linearized result before the rest has arrived.
+    """
+    data = payload.get("data")
+    if not isinstance(data, dict):
+        raise HTTPException(400, 'payload must be: {"data": {..}}')
+    if linearize is None:
+        linearize = PDF_LINEARIZE_OUTPUT
+    _end_question_flow(_get_client_ip(request), template_id, payload.get("flow_id"))
+    fingerprint = hashlib.sha256(
+        json.dumps([template_id, data, linearize], sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")
+    ).hexdigest()
+    key = request.headers.get("idempotency-key", "").strip()[:200] or None
+    try:
+        job, created = render_jobs.submit(
+            template_id,
+            fingerprint,
+            lambda job: _run_render_job(job, template_id, data, linearize),
+            idempotency_key=key,
+            principal=_get_client_ip(request),
+        )
+    except RenderJobConflict as exc:
+        raise HTTPException(409, str(exc))
+    except RenderJobsFull as exc:
+        raise HTTPException(503, str(exc), headers={"Retry-After": str(RENDER_RETRY_AFTER_SECONDS)})
+
+    return JSONResponse(
+        status_code=202 if created else 200,
+        content=job.describe(render_jobs.ttl),
+        headers={"Location": f"/api/render-jobs/{job.job_id}"},
+    )
+
+
+def _render_job_or_404(job_id: str) -> RenderJob:
+    job = render_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(404, "Render job not found or expired")
+    return job
+
+
+@app.get("/api/render-jobs/{job_id}")
+def api_render_job_status(job_id: str):
+    return _render_job_or_404(job_id).describe(render_jobs.ttl)
+
+
+@app.get("/api/render-jobs/{job_id}/result")
+def api_render_job_result(job_id: str, request: Request):
+    job = _render_job_or_404(job_id)
+    if job.status == FAILED:
+        raise HTTPException(job.error_status or 500, job.error or "Render failed")
+    if job.status != DONE:
+        raise HTTPException(409, f"Render job is {job.status}", headers={"Retry-After": "1"})
+    return _pdf_response(job.result, f"{job.template_id}.pdf", request.headers.get("range"))
+
+
+@app.post("/api/packets/render")
+async def api_render_packet(payload: dict, request: Request):
+    """Render several templates from one answer set and return them as one PDF.
+
+    Payload: ``{"templates": ["w4-2026", "i9-2025", ...], "data": {...}}``.
+    Templates render concurrently (each through the render cache), then a
+    worker merges them in the given order with shared resources de-duplicated.
+    """
+    template_ids = payload.get("templates")
+    data = payload.get("data")
+    if not isinstance(data, dict) or not isinstance(template_ids, list) or not template_ids \
+            or not all(isinstance(template_id, str) for template_id in template_ids):
+        raise HTTPException(400, 'payload must be: {"templates": ["<template id>", ..], "data": {..}}')
+    if len(template_ids) > PACKET_MAX_TEMPLATES:
+        raise HTTPException(400, f"A packet holds at most {PACKET_MAX_TEMPLATES} templates")
+    # The middleware charged one render; every further template counts too.
+    ip = _get_client_ip(request)
+    for _ in template_ids[1:]:
+        _check_rate_limit(f"render:{ip}", RATE_LIMIT_RENDER_MAX)
+
+    # Each template gets its own copy: hidden defaults and transforms differ per schema.
+    prepared = await asyncio.gather(
+        *(asyncio.to_thread(_prepare_render, template_id, copy.deepcopy(data)) for template_id in template_ids)
+    )
+    documents = await asyncio.gather(
+        *(_render_bytes(bundle, values, overlays) for bundle, values, overlays in prepared)
+    )
+    titles = [bundle.meta.get("title") or bundle.template_id for bundle, _, _ in prepared]
+    with _executor_http_errors():
+        content = await render_executor.merge(list(zip(titles, documents)))
+
+    return Response(
+        content=content,
         media_type="application/pdf",
-        filename=f"{template_id}.pdf",
-        background=BackgroundTask(out_path.unlink, missing_ok=True),
+        headers={"Content-Disposition": 'attachment; filename="packet.pdf"'},
+    )
+
+
+async def _bulk_render_record(
+    template_id: str, data: dict, logic: Optional[LogicSession] = None, attempts: int = 5
+) -> bytes:
+    """Render one bulk record, waiting out back-pressure from interactive renders."""
+    bundle, pdf_field_values, sig_overlays = await asyncio.to_thread(
+        _prepare_render, template_id, data, logic, include_unpublished=True
+    )
+    for attempt in range(attempts):
+        try:
+            return await render_executor.render(_render_source(bundle)[0], pdf_field_values, sig_overlays)
+        except RenderBusy as exc:
+            if attempt == attempts - 1:
+                raise
+            await asyncio.sleep(exc.retry_after)
+    raise RenderBusy("Render queue is full")
+
+
+@app.post("/api/admin/templates/{template_id}/bulk-render")
+async def api_admin_bulk_render(template_id: str, request: Request):
+    """Render one PDF per record and stream them back as a ZIP.
+
+    The body is a JSON list of ``data`` objects (or ``{"records": [...]}``),
+    NDJSON with one record per line, or CSV with field keys in the header row.
+    Records are rendered a few at a time, one per render worker, so bulk jobs
+    leave queue room for interactive renders. They bypass the render result
+    cache, which is meant for repeated downloads.
+    """
+    _require_admin_key(request)
+    try:
+        bundle = load_template(TEMPLATES_ROOT, template_id, include_unpublished=True)
+    except Exception as e:
+        raise HTTPException(404, str(e))
+    if bundle.engine != "acroform":
+        raise HTTPException(400, f"Unsupported engine for now: {bundle.engine}")
+
+    records = iter_records(request.stream(), request.headers.get("content-type", ""))
+    try:
+        first = await records.__anext__()
+    except StopAsyncIteration:
+        raise HTTPException(400, "No records to render")
+    except BulkInputTooLarge as exc:
+        raise HTTPException(413, str(exc))
+    except BulkInputError as exc:
+        raise HTTPException(400, str(exc))
+
+    async def all_records():
+        yield first
+        async for record in records:
+            yield record
+
+    # Records usually differ in a few columns; the session reruns only the
+    # mapping logic that depends on them.
+    logic = LogicSession(_compiled(bundle, "mapping_plan"))
+    archive = stream_zip(
+        all_records(),
+        lambda data: _bulk_render_record(template_id, data, logic),
+        lambda position: f"{template_id}-{position:05d}.pdf",
+        concurrency=max(render_executor.workers, 1),
+    )
+    return StreamingResponse(
+        archive,
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{template_id}-bulk.zip"'},
     )
 
 
@@ -0,0 +1,381 @@
+import asyncio
+import io
+import json
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+import zipfile
+from collections import defaultdict
+from pathlib import Path
+from unittest import mock
+
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+REPO_ROOT = BACKEND_ROOT.parents[1]
+sys.path.insert(0, str(BACKEND_ROOT))
+sys.path.insert(0, str(REPO_ROOT))
+
+from fastapi import HTTPException  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from actual.back import fillable_processor  # noqa: E402
+from actual.back.engines.executor import RenderExecutor, RenderTimeout  # noqa: E402
+from actual.back.engines.render_cache import clear_render_cache  # noqa: E402
+from actual.back.engines.template_prep import build_render_copy, render_source_path  # noqa: E402
+
+ADMIN_KEY = "test-admin-key"
+
+
+class ApiTestCase(unittest.TestCase):
+    def setUp(self):
+        # Render inline: no worker processes for endpoint tests.
+        patches = [
+            mock.patch.object(fillable_processor, "render_executor", RenderExecutor(workers=0, queue_max=4)),
+            mock.patch.object(fillable_processor, "ADMIN_API_KEY", ADMIN_KEY),
+            # Every test client shares one address; start each test with a fresh rate limit.
+            mock.patch.object(fillable_processor, "_rate_buckets", defaultdict(list)),
+            # Keep render copies out of the repository's template folders.
+            mock.patch.object(fillable_processor, "BUILD_RENDER_COPIES", False),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.client = TestClient(fillable_processor.app)
+
+
+class CacheStatsTests(ApiTestCase):
+    def test_cache_stats_report_the_renderers_caches(self):
+        response = self.client.get("/api/admin/cache-stats", headers={"x-admin-key": ADMIN_KEY})
+
+        self.assertEqual(response.status_code, 200)
+        stats = response.json()
+        self.assertIn("budget_bytes", stats["pdf_sources"])
+        self.assertIsInstance(stats["writer_pools"], dict)
+        self.assertEqual(stats["render_executor"]["workers"], 0)
+
+
+class TemplateRootTestCase(ApiTestCase):
+    """Serves a copy of the W-9 as "w9-2026" and as the unpublished "w9-draft"."""
+
+    def setUp(self):
+        super().setUp()
+        self.root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root)
+        source = fillable_processor.TEMPLATES_ROOT / "w9-2026"
+        shutil.copytree(source, self.root / "w9-2026")
+        shutil.copytree(source, self.root / "w9-draft")
+        meta_path = self.root / "w9-draft" / "template.json"
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        meta.update({"id": "w9-draft", "published": False})
+        meta_path.write_text(json.dumps(meta), encoding="utf-8")
+
+        patch = mock.patch.object(fillable_processor, "TEMPLATES_ROOT", self.root)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+
+class RenderSourceTests(TemplateRootTestCase):
+    def test_render_copy_is_resolved_once_per_loaded_bundle(self):
+        copy = build_render_copy(self.root / "w9-2026" / "w9-2026.pdf")
+        rendered_from = []
+        executor = fillable_processor.render_executor
+        render = executor.render
+
+        async def recording_render(src_pdf, *args):
+            rendered_from.append(Path(src_pdf))
+            return await render(src_pdf, *args)
+
+        with mock.patch.object(fillable_processor, "render_source_path", wraps=render_source_path) as resolve, \
+                mock.patch.object(executor, "render", side_effect=recording_render):
+            for name in ("First Filer", "Second Filer"):
+                response = self.client.post("/api/render/w9-2026", json={"data": {"legal_name": name}})
+                self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(resolve.call_count, 1)
+        self.assertEqual(rendered_from, [copy, copy])
+
+    def test_templates_without_a_render_copy_get_one_on_first_use(self):
+        pdf_path = self.root / "w9-2026" / "w9-2026.pdf"
+        clear_render_cache()
+        self.addCleanup(clear_render_cache)
+        rendered_from = []
+        executor = fillable_processor.render_executor
+        render = executor.render
+
+        async def recording_render(src_pdf, *args):
+            rendered_from.append(Path(src_pdf))
+            return await render(src_pdf, *args)
+
+        with mock.patch.object(fillable_processor, "BUILD_RENDER_COPIES", True), \
+                mock.patch.object(fillable_processor, "_render_copy_builds", set()), \
+                mock.patch.object(executor, "render", side_effect=recording_render):
+            response = self.client.post("/api/render/w9-2026", json={"data": {"legal_name": "First Filer"}})
+            self.assertEqual(response.status_code, 200)
+            deadline = time.monotonic() + 30
+            while render_source_path(pdf_path) == pdf_path and time.monotonic() < deadline:
+                time.sleep(0.05)
+            response = self.client.post("/api/render/w9-2026", json={"data": {"legal_name": "Second Filer"}})
+            self.assertEqual(response.status_code, 200)
+
+        copy = render_source_path(pdf_path)
+        self.assertNotEqual(copy, pdf_path)
+        # The bundle loaded before the copy existed switches to it.
+        self.assertEqual(rendered_from, [pdf_path, copy])
+
+
+class PrepareRenderTests(TemplateRootTestCase):
+    def _edit(self, name, change):
+        path = self.root / "w9-2026" / name
+        document = json.loads(path.read_text(encoding="utf-8"))
+        path.write_text(json.dumps(change(document)), encoding="utf-8")
+        fillable_processor.invalidate_template_cache("w9-2026")
+
+    def test_hidden_defaults_are_copied_into_each_request(self):
+        def add_hidden_field(schema):
+            schema["fields"].append({"key": "hidden_list", "hidden": True, "defaultValue": ["shared"]})
+            return schema
+
+        self._edit("schema.json", add_hidden_field)
+        data = {"legal_name": "Copy Filer"}
+        bundle, _, _ = fillable_processor._prepare_render("w9-2026", data)
+        data["hidden_list"].append("changed")
+
+        default = next(field for field in bundle.schema["fields"] if field["key"] == "hidden_list")["defaultValue"]
+        self.assertEqual(default, ["shared"])
+
+    def test_malformed_mapping_breaks_renders_but_not_the_schema(self):
+        self._edit("mapping.json", lambda mapping: ["not", "a", "mapping"])
+
+        self.assertEqual(self.client.get("/api/templates/w9-2026/schema").status_code, 200)
+        response = self.client.post("/api/render/w9-2026", json={"data": {"legal_name": "Broken"}})
+        self.assertEqual(response.status_code, 500)
+        self.assertIn("invalid mapping", response.json()["detail"])
+
+
+class QuestionFlowTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        with fillable_processor._question_flows_lock:
+            fillable_processor._question_flows.clear()
+            fillable_processor._question_flow_counts.clear()
+
+    def _resolve(self, flow_id):
+        return self.client.post(
+            "/api/templates/w9-2026/resolve-questions", json={"answers": {"legal_name": "Flow Filer"}, "flow_id": flow_id}
+        )
+
+    def _flow_ids(self):
+        return [key[2] for key in fillable_processor._question_flows]
+
+    def test_short_or_unsafe_flow_ids_are_rejected(self):
+        for flow_id in ("abc", "a" * 65, "flow/" + "a" * 16):
+            with self.subTest(flow_id=flow_id):
+                self.assertEqual(self._resolve(flow_id).status_code, 422)
+
+    def test_rendering_ends_the_flow(self):
+        flow_id = "flow-" + "a" * 16
+        self.assertEqual(self._resolve(flow_id).status_code, 200)
+        self.assertEqual(self._flow_ids(), [flow_id])
+
+        response = self.client.post("/api/render/w9-2026", json={"data": {"legal_name": "Flow Filer"}, "flow_id": flow_id})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._flow_ids(), [])
+
+    def test_idle_flows_expire(self):
+        self._resolve("flow-" + "b" * 16)
+        with mock.patch.object(fillable_processor, "QUESTION_FLOW_TTL_SECONDS", -1):
+            self._resolve("flow-" + "c" * 16)
+
+        self.assertEqual(self._flow_ids(), ["flow-" + "c" * 16])
+
+    def test_one_client_cannot_push_out_other_clients_flows(self):
+        other = ("203.0.113.9", "w9-2026", "flow-" + "d" * 16)
+        with fillable_processor._question_flows_lock:
+            fillable_processor._question_flows[other] = (None, None, time.monotonic())
+            fillable_processor._question_flow_counts[other[0]] += 1
+
+        with mock.patch.object(fillable_processor, "QUESTION_FLOWS_PER_CLIENT", 2):
+            for index in range(5):
+                self.assertEqual(self._resolve(f"flow-{index:016d}").status_code, 200)
+
+        self.assertEqual(self._flow_ids(), [other[2], f"flow-{3:016d}", f"flow-{4:016d}"])
+
+
+class SharedRenderTests(ApiTestCase):
+    """Identical concurrent renders share one render through _renders_in_flight."""
+
+    def setUp(self):
+        super().setUp()
+        self.bundle = fillable_processor.load_template(fillable_processor.TEMPLATES_ROOT, "w9-2026")
+        clear_render_cache()
+        self.addCleanup(clear_render_cache)
+
+    def _render_twice(self, render, values):
+        async def both():
+            with mock.patch.object(fillable_processor.render_executor, "render", side_effect=render):
+                runs = [fillable_processor._render_bytes(self.bundle, values, []) for _ in range(2)]
+                return await asyncio.wait_for(asyncio.gather(*runs, return_exceptions=True), 10)
+
+        return asyncio.run(both())
+
+    def test_waiters_get_the_render_when_caching_it_fails(self):
+        calls = []
+
+        async def render(*args):
+            calls.append(args)
+            await asyncio.sleep(0.05)
+            return b"%PDF-shared"
+
+        with mock.patch.object(fillable_processor, "put_rendered", side_effect=OSError("disk full")):
+            results = self._render_twice(render, {"f1_01[0]": "Disk Full Filer"})
+
+        self.assertEqual(results, [b"%PDF-shared", b"%PDF-shared"])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(fillable_processor._renders_in_flight, {})
+
+    def test_waiters_get_the_error_of_the_shared_render(self):
+        async def render(*args):
+            await asyncio.sleep(0.05)
+            raise RenderTimeout("too slow")
+
+        results = self._render_twice(render, {"f1_01[0]": "Timed Out Filer"})
+
+        self.assertEqual([type(result) for result in results], [HTTPException, HTTPException])
+        self.assertEqual([result.status_code for result in results], [504, 504])
+
+
+class AdminBulkRenderTests(TemplateRootTestCase):
+
+    def _bulk(self, template_id, body, content_type="application/json"):
+        return self.client.post(
+            f"/api/admin/templates/{template_id}/bulk-render",
+            content=body,
+            headers={"content-type": content_type, "x-admin-key": ADMIN_KEY},
+        )
+
+    def test_records_stream_back_as_a_zip_of_pdfs(self):
+        body = json.dumps([{"name": "First Filer"}, {"name": "Second Filer"}])
+        response = self._bulk("w9-2026", body)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["content-type"], "application/zip")
+        with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+            manifest = json.loads(archive.read("manifest.json"))
+            self.assertEqual((manifest["rendered"], manifest["failed"]), (2, 0))
+            self.assertEqual([entry["file"] for entry in manifest["items"]], ["w9-2026-00001.pdf", "w9-2026-00002.pdf"])
+            for entry in manifest["items"]:
+                self.assertTrue(archive.read(entry["file"]).startswith(b"%PDF"))
+
+    def test_draft_templates_can_be_bulk_rendered(self):
+        response = self._bulk("w9-draft", json.dumps([{"name": "Draft Filer"}]))
+
+        self.assertEqual(response.status_code, 200)
+        with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+            manifest = json.loads(archive.read("manifest.json"))
+            self.assertEqual(manifest["items"], [{"record": 1, "file": "w9-draft-00001.pdf"}])
+            self.assertTrue(archive.read("w9-draft-00001.pdf").startswith(b"%PDF"))
+
+    def test_empty_body_is_rejected(self):
+        for body in (b"", b"[]"):
+            with self.subTest(body=body):
+                response = self._bulk("w9-2026", body)
+                self.assertEqual(response.status_code, 400)
+
+    def test_oversized_json_body_is_rejected_with_413(self):
+        body = json.dumps([{"name": "Filer"}] * 10)
+        with mock.patch("actual.back.engines.bulk_render.BULK_RENDER_MAX_JSON_BYTES", 64):
+            response = self._bulk("w9-2026", body)
+
+        self.assertEqual(response.status_code, 413)
+
+    def test_bulk_render_requires_the_admin_key(self):
+        response = self.client.post(
+            "/api/admin/templates/w9-2026/bulk-render",
+            content=json.dumps([{"name": "Filer"}]),
+            headers={"content-type": "application/json", "x-admin-key": "wrong"},
+        )
+
+        self.assertIn(response.status_code, (401, 503))
+
+
+class RenderRangeTests(ApiTestCase):
+    def _render(self, **headers):
+        return self.client.post(
+            "/api/render/w9-2026?linearize=true", json={"data": {"legal_name": "Range Filer"}}, headers=headers
+        )
+
+    def test_direct_render_answers_range_requests(self):
+        whole = self._render()
+        self.assertEqual(whole.status_code, 200)
+        self.assertEqual(whole.headers["accept-ranges"], "bytes")
+
+        response = self._render(range="bytes=0-99")
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, whole.content[:100])
+        self.assertEqual(response.headers["content-range"], f"bytes 0-99/{len(whole.content)}")
+
+
+class RenderJobResultRangeTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        # The lifespan keeps one event loop alive for the job's background task.
+        self.client.__enter__()
+        self.addCleanup(self.client.__exit__, None, None, None)
+        submitted = self.client.post("/api/render-jobs/w9-2026?linearize=true", json={"data": {"legal_name": "Range Filer"}})
+        self.assertIn(submitted.status_code, (200, 202))
+        self.url = f"/api/render-jobs/{submitted.json()['job_id']}"
+        for _ in range(200):
+            if self.client.get(self.url).json()["status"] == "done":
+                break
+            time.sleep(0.05)
+        self.url += "/result"
+        self.content = self.client.get(self.url).content
+        self.assertTrue(self.content.startswith(b"%PDF"))
+
+    def _get(self, byte_range):
+        return self.client.get(self.url, headers={"range": byte_range})
+
+    def test_single_range_returns_partial_content(self):
+        response = self._get("bytes=0-99")
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, self.content[:100])
+        self.assertEqual(response.headers["content-range"], f"bytes 0-99/{len(self.content)}")
+
+    def test_open_ended_range_runs_to_the_end(self):
+        response = self._get("bytes=100-")
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, self.content[100:])
+
+    def test_suffix_range_returns_the_last_bytes(self):
+        response = self._get("bytes=-50")
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, self.content[-50:])
+        size = len(self.content)
+        self.assertEqual(response.headers["content-range"], f"bytes {size - 50}-{size - 1}/{size}")
+
+    def test_range_past_the_end_is_not_satisfiable(self):
+        size = len(self.content)
+        for byte_range in (f"bytes={size}-", f"bytes={size + 10}-{size + 20}", "bytes=-0"):
+            with self.subTest(byte_range=byte_range):
+                response = self._get(byte_range)
+                self.assertEqual(response.status_code, 416)
+                self.assertEqual(response.headers["content-range"], f"bytes */{size}")
+
+    def test_multiple_or_malformed_ranges_return_the_whole_file(self):
+        for byte_range in ("bytes=0-9,20-29", "bytes=-", "bytes=abc", "items=0-9", "bytes=9-3"):
+            with self.subTest(byte_range=byte_range):
+                response = self._get(byte_range)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.content, self.content)
+                self.assertNotIn("content-range", response.headers)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import asyncio
+import io
+import json
+import sys
+import unittest
+import zipfile
+from pathlib import Path
+from unittest import mock
+
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BACKEND_ROOT))
+
+from engines import bulk_render  # noqa: E402
+from engines.bulk_render import BulkInputError, BulkInputTooLarge, iter_records, stream_zip  # noqa: E402
+
+
+async def _chunks(body: bytes, size: int = 7):
+    for start in range(0, len(body), size):
+        yield body[start:start + size]
+
+
+def _records(body: bytes, content_type: str) -> list:
+    async def collect():
+        return [record async for record in iter_records(_chunks(body), content_type)]
+
+    return asyncio.run(collect())
+
+
+class IterRecordsTests(unittest.TestCase):
+    def test_json_list_accepts_bare_and_wrapped_records(self):
+        body = json.dumps({"records": [{"name": "A"}, {"data": {"name": "B"}}]}).encode()
+
+        self.assertEqual(_records(body, "application/json"), [{"name": "A"}, {"name": "B"}])
+
+    def test_ndjson_skips_blank_lines(self):
+        body = b'{"name": "A"}\n\n{"data": {"name": "B"}}'
+
+        self.assertEqual(_records(body, "application/x-ndjson"), [{"name": "A"}, {"name": "B"}])
+
+    def test_csv_uses_header_keys_and_drops_empty_cells(self):
+        body = '\ufeffname,address\n"Ann ""Jr""","1 Main St\nApt 2"\nBob,\n'.encode()
+
+        self.assertEqual(
+            _records(body, "text/csv; charset=utf-8"),
+            [{"name": 'Ann "Jr"', "address": "1 Main St\nApt 2"}, {"name": "Bob"}],
+        )
+
+    def test_non_object_record_is_rejected(self):
+        with self.assertRaises(BulkInputError):
+            _records(b"[1]", "application/json")
+
+    def test_oversized_json_body_is_refused_before_it_is_buffered(self):
+        body = json.dumps([{"name": "A" * 100}]).encode()
+        with mock.patch.object(bulk_render, "BULK_RENDER_MAX_JSON_BYTES", 64), \
+                self.assertRaises(BulkInputTooLarge):
+            _records(body, "application/json")
+
+    def test_streamed_formats_limit_each_record(self):
+        long_value = "A" * 100
+        bodies = {
+            "application/x-ndjson": (b'{"name": "B"}', f'{{"name": "B"}}\n{{"name": "{long_value}"}}'.encode()),
+            "text/csv": (b"name\nB\n", f'name\nB\n"{long_value}\n{long_value}"\n'.encode()),
+        }
+        for content_type, (small, large) in bodies.items():
+            with self.subTest(content_type=content_type), \
+                    mock.patch.object(bulk_render, "BULK_RENDER_MAX_RECORD_BYTES", 64):
+                self.assertEqual(_records(small, content_type), [{"name": "B"}])
+                with self.assertRaises(BulkInputTooLarge):
+                    _records(large, content_type)
+
+
+class StreamZipTests(unittest.TestCase):
+    def test_zip_holds_every_rendered_record_and_a_manifest(self):
+        async def render(data):
+            if data.get("fail"):
+                raise ValueError("bad record")
+            await asyncio.sleep(0.01 * data["delay"])
+            return b"%PDF-" + data["name"].encode()
+
+        async def records():
+            for name, delay in (("a", 3), ("b", 1), ("c", 2)):
+                yield {"name": name, "delay": delay}
+            yield {"fail": True}
+
+        async def collect():
+            stream = stream_zip(records(), render, lambda position: f"doc-{position}.pdf", concurrency=2)
+            return b"".join([chunk async for chunk in stream])
+
+        archive = zipfile.ZipFile(io.BytesIO(asyncio.run(collect())))
+        manifest = json.loads(archive.read("manifest.json"))
+
+        self.assertEqual(archive.read("doc-1.pdf"), b"%PDF-a")
+        self.assertEqual(archive.read("doc-3.pdf"), b"%PDF-c")
+        self.assertEqual((manifest["records"], manifest["rendered"], manifest["failed"]), (4, 3, 1))
+        self.assertEqual(manifest["items"][3], {"record": 4, "error": "bad record"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,250 @@
+import json
+import random
+import sys
+import unittest
+from pathlib import Path
+
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BACKEND_ROOT))
+
+from core.mapping import LogicSession, build_pdf_field_values, compile_mapping, logic_rule_errors  # noqa: E402
+
+TEMPLATES = BACKEND_ROOT / "data" / "templates"
+
+VALUES = [
+    None, "", " ", True, False, 0, 1, 2.5, "0", "1", "yes", "Jane Q. Public",
+    "123-45-6789", "12-3456789", "12345", "1/2/2024", "12-31-99", "2024-01-02",
+    "a, b,, c", "  spaced  ", "1,234.50", "data:image/png;base64,iVBORw0KGgo=",
+]
+
+SYNTHETIC = {
+    "first": "f_first",
+    "names": ["f_name_1", "f_name_2"],
+    "empty_list": [],
+    "agree": {"type": "checkbox", "field": "f_agree", "checked_value": "/On"},
+    "color": {"type": "radio", "field": "f_color", "value_map": {"red": "/R", "1": "/One"}},
+    "status": {
+        "type": "radio_group",
+        "choices": [
+            {"value": "single", "field": "f_single"},
+            {"value": "married", "field": "f_married", "export_on": "/2"},
+            {"value": "single", "field": "f_single_again"},
+            {"value": "none"},
+            {"value": 1, "field": "f_number"},
+        ],
+    },
+    "ssn": {"type": "split", "fields": ["s1", "s2", "s3"], "pattern": [3, 2, 4]},
+    "dob": {"type": "date_split", "fields": {"yyyy": "f_year", "mm": "f_month"}},
+    "tags": {"type": "spread", "separator": ",", "fields": ["t1", "t2"]},
+    "boxes": {
+        "type": "value_to_checkboxes",
+        "all_fields": ["b1", "b2", "b3"],
+        "mapping": {"1": {"b1": "/On"}, "yes": {"b2": "/On", "b9": "/X"}},
+    },
+    "sign": {"type": "signature", "field": "f_sign"},
+    "sign_overlay": {"type": "signature", "page": 1, "rect": [1, 2, 3, 4], "font_size": 9},
+    "note": {"type": "text_overlay", "page": 0, "font": "Courier", "align": "R"},
+    "tin": {"type": "tin_split", "ssn": ["t_ssn1", "t_ssn2", "t_ssn3"], "ein": ["t_ein1", "t_ein2"]},
+    "tin_ein": {"type": "tin_split", "ein": ["e1", "e2"], "prefer": "ein"},
+    "plain": {"field": "f_plain"},
+    "other_type": {"type": "checkbox_group", "field": "f_other"},
+    "no_field": {"type": "text"},
+    "remember": {"type": "set_var", "name": "saved", "from": "first"},
+    "total": {"type": "math", "operation": "add", "inputs": ["agree", "var:saved", "ssn"], "output_key": "first"},
+    "diff": {"type": "math", "operation": "subtract", "inputs": ["ssn", "dob", "tags"], "output_key": "d", "var_name": "d"},
+    "times": {"type": "math", "operation": "multiply", "inputs": ["ssn"], "factor": "2.5", "output_key": "m"},
+    "ratio": {"type": "math", "operation": "divide", "inputs": ["ssn", "agree"], "output_key": "r"},
+    "ratio_default": {"type": "math", "operation": "divide", "inputs": ["ssn"], "divisor": 0, "output_key": "r2"},
+    "power": {"type": "math", "operation": "pow", "inputs": ["agree", "tags"], "output_key": "p"},
+    "cube": {"type": "math", "operation": "pow", "inputs": ["agree"], "exp": 3, "output_key": "p3"},
+    "rest": {"type": "math", "operation": "mod", "inputs": ["ssn", "agree"], "output_key": "mo"},
+    "lowest": {"type": "math", "operation": "min", "inputs": ["ssn", "agree"], "output_key": "lo"},
+    "highest": {"type": "math", "operation": "MAX", "inputs": ["ssn", "agree"], "output_key": "hi"},
+    "mean": {"type": "math", "operation": "avg", "inputs": ["ssn", "agree", "var:d"], "output_key": "av"},
+    "rounded": {"type": "math", "operation": "round", "inputs": ["tags"], "precision": 1, "output_key": "ro"},
+    "nothing": {"type": "math", "operation": "avg", "inputs": "not-a-list", "output_key": "av0"},
+    "compare": {"type": "if", "left": "ssn", "op": "gt", "right": "agree", "true": "var:d", "output_key": "sign"},
+    "equal": {"type": "if", "left": "color", "op": "neq", "right": "var:saved", "true": "X", "false": "var:missing",
+              "output_key": "note"},
+    "m": "f_m", "r": "f_r", "r2": "f_r2", "p": "f_p", "mo": "f_mo", "lo": "f_lo", "hi": "f_hi", "av": "f_av",
+    "ro": "f_ro", "av0": "f_av0", "d": "f_d", "p3": "f_p3",
+}
+
+# A chain of logic rules with variables, a self-normalizing rule and two
+# branches that do not depend on each other.
+LOGIC = {
+    "wages": "f_wages",
+    "tips": "f_tips",
+    "rate": "f_rate",
+    "income": {"type": "math", "operation": "add", "inputs": ["wages", "tips"], "output_key": "income",
+               "var_name": "income"},
+    "keep_rate": {"type": "set_var", "name": "rate", "from": "rate"},
+    "tax": {"type": "math", "operation": "multiply", "inputs": ["var:income", "var:rate"], "output_key": "tax"},
+    "rounded": {"type": "math", "operation": "round", "inputs": ["tax"], "output_key": "tax"},
+    "owes": {"type": "if", "left": "tax", "op": "gt", "right": "paid", "true": "var:income", "false": "no",
+             "output_key": "owes"},
+    "label": {"type": "if", "left": "name", "op": "eq", "right": "alias", "true": "hidden", "false": "shown",
+              "output_key": "name"},
+    "tax_out": "f_tax", "owes_out": {"field": "f_owes"}, "name": "f_name", "paid": "f_paid",
+}
+LOGIC_VALUES = [None, "", "0", "1", 1, True, 1.0, "2.5", "10", "abc", "1,000"]
+
+
+def _random_data(mapping, rng, extra_values):
+    pool = VALUES + extra_values
+    return {key: rng.choice(pool) for key in mapping if rng.random() < 0.85}
+
+
+def _choice_values(mapping):
+    """Values the mapping itself reacts to: radio and checkbox-table keys."""
+    values = []
+    for rule in mapping.values():
+        if isinstance(rule, dict):
+            values += [choice.get("value") for choice in rule.get("choices") or [] if isinstance(choice, dict)]
+            values += list((rule.get("mapping") or {}).keys()) + list((rule.get("value_map") or {}).keys())
+    return [value for value in values if isinstance(value, str)]
+
+
+class MappingPlanTests(unittest.TestCase):
+    def assertSameResult(self, mapping, data):
+        try:
+            expected = build_pdf_field_values(data, mapping)
+        except Exception as exc:  # e.g. an overflowing pow
+            with self.assertRaises(type(exc)):
+                compile_mapping(mapping).build(data)
+            return
+        actual = compile_mapping(mapping).build(data)
+        self.assertEqual(actual, expected)
+        self.assertEqual(list(actual[0]), list(expected[0]))  # same field order
+
+    def test_plan_matches_interpreter_on_every_template(self):
+        rng = random.Random(1234)
+        for mapping_path in sorted(TEMPLATES.glob("*/mapping.json")):
+            mapping = json.loads(mapping_path.read_text(encoding="utf-8"))
+            extra = _choice_values(mapping)
+            with self.subTest(template=mapping_path.parent.name):
+                for _ in range(200):
+                    self.assertSameResult(mapping, _random_data(mapping, rng, extra))
+
+    def test_plan_matches_interpreter_on_every_rule_type(self):
+        rng = random.Random(5678)
+        extra = _choice_values(SYNTHETIC) + ["red"]
+        for _ in range(2000):
+            self.assertSameResult(SYNTHETIC, _random_data(SYNTHETIC, rng, extra))
+
+    def test_overlays_get_their_own_default_rect(self):
+        plan = compile_mapping({"sign": {"type": "signature"}})
+        first, second = (plan.build({"sign": "data:image/png;base64,AA=="})[1][0] for _ in range(2))
+        self.assertEqual(first["rect"], [0, 0, 200, 50])
+        self.assertIsNot(first["rect"], second["rect"])
+
+    def test_malformed_rules_fail_like_the_interpreter(self):
+        malformed = {
+            "box": {"type": "checkbox"},
+            "parts": {"type": "split", "fields": ["a", "b"], "pattern": ["1", "2"]},
+            "when": {"type": "value_to_checkboxes", "all_fields": ["w"], "mapping": {"x": ["w"]}},
+            "date": {"type": "date_split", "fields": "mm"},
+        }
+        plan = compile_mapping(malformed)
+        for key, value in (("box", "1"), ("parts", "12"), ("when", "x"), ("date", "1/2/2024")):
+            with self.subTest(rule=key):
+                with self.assertRaises(Exception) as expected:
+                    build_pdf_field_values({key: value}, malformed)
+                with self.assertRaises(type(expected.exception)):
+                    plan.build({key: value})
+        # Entries whose value is absent are never evaluated, as before.
+        self.assertEqual(plan.build({"when": "y"}), build_pdf_field_values({"when": "y"}, malformed))
+
+    def test_incremental_logic_matches_a_full_run(self):
+        rng = random.Random(42)
+        for mapping in (LOGIC, SYNTHETIC):
+            plan = compile_mapping(mapping)
+            keys = sorted(set(mapping) | {"paid", "name", "alias", "income", "tax"})
+            session = LogicSession(plan)
+            data = {}
+            for _ in range(1500):
+                data = dict(data)
+                for key in rng.sample(keys, rng.randint(0, 3)):
+                    if rng.random() < 0.2:
+                        data.pop(key, None)
+                    else:
+                        data[key] = rng.choice(LOGIC_VALUES + VALUES[:6])
+                try:
+                    expected = build_pdf_field_values(data, mapping)
+                except Exception as exc:
+                    with self.assertRaises(type(exc)):
+                        session.build(data)
+                    session = LogicSession(plan)
+                    continue
+                self.assertEqual(session.build(data), expected)
+                full = plan.run_logic(data)
+                self.assertEqual(session.last.state, full.state)
+                self.assertEqual(session.last.variables, full.variables)
+
+    def test_incremental_logic_reruns_only_dependent_rules(self):
+        plan = compile_mapping(LOGIC)
+        runs = []
+        for index, node in enumerate(plan.logic):
+            node.step = (lambda step, index: lambda *args: (runs.append(index), step(*args))[1])(node.step, index)
+        data = {"wages": "100", "tips": "20", "rate": "0.1", "paid": "5", "name": "Ann", "alias": "Ann"}
+        first = plan.run_logic(data)
+        self.assertEqual(len(runs), len(plan.logic))
+
+        runs.clear()
+        second = plan.run_logic(dict(data, name="Bob"), first)
+        self.assertEqual(runs, [5])  # only "label"
+        self.assertEqual((first.state["name"], second.state["name"]), ("hidden", "shown"))
+
+        runs.clear()
+        third = plan.run_logic(dict(data, wages="101", name="Bob"), second, changed={"wages"})
+        self.assertEqual(runs, [0, 2, 3, 4])  # not "keep_rate" or "label"
+        self.assertEqual(third.state, plan.run_logic(dict(data, wages="101", name="Bob")).state)
+
+        # The sum comes out the same, so nothing downstream of "income" runs again.
+        runs.clear()
+        fourth = plan.run_logic(dict(data, wages=100, tips=20.0, name="Bob"), second)
+        self.assertEqual(runs, [0])
+        self.assertIs(fourth.state["owes"], second.state["owes"])
+
+        runs.clear()
+        self.assertIs(plan.run_logic(second.inputs, second).state, second.state)
+        self.assertEqual(runs, [])
+
+    def test_logic_rule_cycles_are_reported(self):
+        self.assertEqual(logic_rule_errors(LOGIC), [])
+        # "remember" reads the "first" that "total" writes from "remember"'s variable.
+        self.assertEqual(logic_rule_errors(SYNTHETIC), ["Logic rules 'remember' -> 'total' -> 'remember' depend on each other"])
+        cyclic = {
+            "a": {"type": "math", "operation": "add", "inputs": ["var:b"], "output_key": "a"},
+            "b": {"type": "set_var", "name": "b", "from": "c"},
+            "c": {"type": "if", "left": "a", "op": "eq", "right": "1", "true": "x", "output_key": "c"},
+            "d": {"type": "math", "operation": "add", "inputs": ["d"], "output_key": "d"},
+        }
+        self.assertEqual(logic_rule_errors(cyclic), ["Logic rules 'a' -> 'c' -> 'b' -> 'a' depend on each other"])
+
+    def test_rewriting_an_earlier_output_is_not_a_cycle(self):
+        running_total = {
+            "r1": {"type": "math", "operation": "add", "inputs": ["a", "b"], "output_key": "total"},
+            "r2": {"type": "math", "operation": "add", "inputs": ["total", "c"], "output_key": "total"},
+            "r3": {"type": "math", "operation": "add", "inputs": ["total", "d"], "output_key": "total"},
+        }
+        self.assertEqual(logic_rule_errors(running_total), [])
+        reassigned = {
+            "keep": {"type": "set_var", "name": "x", "from": "a"},
+            "bump": {"type": "math", "operation": "add", "inputs": ["var:x", "b"], "output_key": "y", "var_name": "x"},
+            "again": {"type": "set_var", "name": "x", "from": "var:x"},
+            "use": {"type": "math", "operation": "add", "inputs": ["var:x"], "output_key": "z"},
+        }
+        self.assertEqual(logic_rule_errors(reassigned), [])
+
+        # Reading the total before any rule computes it only matters when the
+        # rules computing it depend on the reader.
+        early = {"show": {"type": "math", "operation": "add", "inputs": ["total"], "output_key": "e"}, **running_total}
+        self.assertEqual(logic_rule_errors(early), [])
+        early["show"]["output_key"] = "a"
+        self.assertIn("Logic rules 'show' -> 'r1' -> 'show' depend on each other", logic_rule_errors(early))
+
+
+if __name__ == "__main__":
+    unittest.main()
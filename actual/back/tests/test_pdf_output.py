@@ -1,8 +1,15 @@
+import base64
+import io
 import json
+import logging
+import re
 import sys
 import tempfile
+import time
 import unittest
+import zlib
 from pathlib import Path
+from unittest import mock
 
 from pypdf import PdfReader
 
@@ -13,6 +20,17 @@ sys.path.insert(0, str(BACKEND_ROOT))
 from core.mapping import build_pdf_field_values  # noqa: E402
 from core.transforms import apply_transforms  # noqa: E402
 from engines.acroform import fill_acroform_pdf  # noqa: E402
+from engines.appearance import compare_with_pypdf  # noqa: E402
+from engines.field_catalog import field_catalog  # noqa: E402
+from engines.packet import merge_pdf_bytes  # noqa: E402
+from engines.widget_index import build_widget_index, widget_index  # noqa: E402
+from engines.pdf_cache import (  # noqa: E402
+    checkout_writer,
+    load_source,
+    prefill_writer_pool,
+    source_cache_stats,
+    writer_pool_stats,
+)
 
 
 class CompletedPdfTests(unittest.TestCase):
@@ -84,6 +102,289 @@ class CompletedPdfTests(unittest.TestCase):
         self.assertEqual(widgets, [])
         self.assertIn("X", text)
 
+    def test_cached_source_is_not_changed_by_previous_renders(self):
+        source = BACKEND_ROOT / "data" / "templates" / "w9-2026" / "w9-2026.pdf"
+        with tempfile.TemporaryDirectory() as directory:
+            first = Path(directory) / "first.pdf"
+            second = Path(directory) / "second.pdf"
+            fill_acroform_pdf(source, {"f1_01[0]": "First Filer"}, first)
+            hits = source_cache_stats()["hits"]
+            fill_acroform_pdf(source, {"f1_01[0]": "Second Filer"}, second)
+            text = "\n".join(page.extract_text() or "" for page in PdfReader(second).pages)
+
+        self.assertEqual(source_cache_stats()["hits"], hits + 1)
+        self.assertIn("Second Filer", text)
+        self.assertNotIn("First Filer", text)
+
+    def test_widget_index_describes_buttons_once_per_template(self):
+        source = load_source(BACKEND_ROOT / "data" / "templates" / "w9-2026" / "w9-2026.pdf")
+        index = widget_index(source)
+        self.assertIs(widget_index(source), index)
+
+        checkbox = next(widget for widget in index.widgets if widget.partial_name == "c1_1[0]")
+        self.assertEqual(checkbox.field_type, "/Btn")
+        self.assertEqual(checkbox.on_states, ("/1",))
+        self.assertTrue(checkbox.name.endswith(".c1_1[0]"))
+        self.assertEqual(len(checkbox.rect), 4)
+
+    def test_widget_index_lists_named_annotations_that_are_not_widgets(self):
+        from pypdf import PdfWriter
+        from pypdf.generic import ArrayObject, DictionaryObject, FloatObject, NameObject, TextStringObject
+
+        writer = PdfWriter()
+        writer.add_blank_page(200, 200)
+        note = DictionaryObject({
+            NameObject("/Type"): NameObject("/Annot"),
+            NameObject("/Subtype"): NameObject("/Text"),
+            NameObject("/T"): TextStringObject("reviewer"),
+            NameObject("/Rect"): ArrayObject([FloatObject(1), FloatObject(2), FloatObject(3), FloatObject(4)]),
+        })
+        writer.add_annotation(0, note)
+        buffer = io.BytesIO()
+        writer.write(buffer)
+
+        index = build_widget_index(PdfReader(io.BytesIO(buffer.getvalue())))
+        self.assertEqual(index.widgets, [])
+        self.assertEqual([(info.partial_name, info.page, info.rect) for info in index.named], [("reviewer", 0, (1, 2, 3, 4))])
+
+    def test_field_catalog_resolves_long_names_without_walking_the_tree(self):
+        source = load_source(BACKEND_ROOT / "data" / "templates" / "w9-2026" / "w9-2026.pdf")
+        catalog = field_catalog(source)
+        self.assertIs(field_catalog(source), catalog)
+
+        full_name = next(name for name in catalog.names if name.endswith(".f1_01[0]"))
+        self.assertIn(full_name, catalog.short_aliases["f1_01[0]"])
+        self.assertEqual(catalog.fallback_name("form1[0].Missing[0].f1_01[0]"), "f1_01[0]")
+        self.assertIsNone(catalog.fallback_name("f1_01[0]"))
+        # A last segment no field uses is no fallback at all.
+        self.assertIsNone(catalog.fallback_name("form1[0].Missing[0].nothing[0]"))
+
+    def test_render_into_memory_buffer(self):
+        source = BACKEND_ROOT / "data" / "templates" / "w9-2026" / "w9-2026.pdf"
+        buffer = io.BytesIO()
+        self.assertIs(fill_acroform_pdf(source, {"f1_01[0]": "Buffered Filer"}, buffer), buffer)
+
+        reader = PdfReader(io.BytesIO(buffer.getvalue()))
+        self.assertIn("Buffered Filer", "\n".join(page.extract_text() or "" for page in reader.pages))
+
+    def test_hot_template_writers_come_from_the_pool(self):
+        source_path = BACKEND_ROOT / "data" / "templates" / "w4-2026" / "w4-2026.pdf"
+        prefill_writer_pool(source_path)
+        deadline = time.monotonic() + 30
+        while writer_pool_stats()["w4-2026"]["available"] < 1 and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        before = writer_pool_stats()["w4-2026"]
+        first = checkout_writer(load_source(source_path))
+        second = checkout_writer(load_source(source_path))
+        after = writer_pool_stats()["w4-2026"]
+
+        self.assertIsNot(first, second)
+        self.assertEqual(after["checkouts"] - before["checkouts"], 2)
+        self.assertLessEqual(after["starved"] - before["starved"], 1)
+
+    def test_text_appearances_match_pypdf_on_every_template(self):
+        # pypdf warns once per widget about fonts missing from /DR.
+        pypdf_logger = logging.getLogger("pypdf")
+        self.addCleanup(pypdf_logger.setLevel, pypdf_logger.level)
+        pypdf_logger.setLevel(logging.ERROR)
+
+        for template_dir in sorted((BACKEND_ROOT / "data" / "templates").iterdir()):
+            meta = json.loads((template_dir / "template.json").read_text(encoding="utf-8"))
+            with self.subTest(template=template_dir.name):
+                self.assertEqual(compare_with_pypdf(template_dir / meta["pdf"]), [])
+
+    def test_text_values_do_not_go_through_pypdf_appearances(self):
+        source = BACKEND_ROOT / "data" / "templates" / "w9-2026" / "w9-2026.pdf"
+        buffer = io.BytesIO()
+        with mock.patch(
+            "pypdf.generic._appearance_stream.TextStreamAppearance.from_text_annotation",
+            side_effect=AssertionError("pypdf appearance generated"),
+        ):
+            fill_acroform_pdf(source, {"f1_01[0]": "Fast (Path) Filer", "f1_02[0]": "Trade Name"}, buffer)
+
+        reader = PdfReader(io.BytesIO(buffer.getvalue()))
+        text = reader.pages[0].extract_text()
+        self.assertIn("Fast (Path) Filer", text)
+        self.assertIn("Trade Name", text)
+        self.assertFalse(reader.pages[0].get("/Annots"))
+
+    def test_pypdf_without_the_fast_engine_internals_still_fills_text(self):
+        source = BACKEND_ROOT / "data" / "templates" / "w9-2026" / "w9-2026.pdf"
+        buffer = io.BytesIO()
+        with mock.patch("engines.acroform.FAST_APPEARANCES", False), \
+                mock.patch("engines.acroform.fill_text_appearances", side_effect=AssertionError("fast engine used")):
+            fill_acroform_pdf(source, {"f1_01[0]": "Public Path Filer"}, buffer)
+
+        reader = PdfReader(io.BytesIO(buffer.getvalue()))
+        self.assertIn("Public Path Filer", reader.pages[0].extract_text())
+        self.assertFalse(reader.pages[0].get("/Annots"))
+
+    def test_only_pages_with_filled_values_get_appearances(self):
+        source = BACKEND_ROOT / "data" / "templates" / "w4-2026" / "w4-2026.pdf"
+        buffer = io.BytesIO()
+        fill_acroform_pdf(source, {"f1_01[0]": "Page One", "f3_01[0]": "", "f4_01[0]": None, "c1_1[0]": "/Off"}, buffer)
+
+        reader = PdfReader(io.BytesIO(buffer.getvalue()))
+        drawn = [
+            [name for name in page["/Resources"].get("/XObject", {}) if name.startswith("/Fm_")]
+            for page in reader.pages
+        ]
+        self.assertEqual(drawn, [["/Fm_f1_01_0_"]] + [[]] * (len(reader.pages) - 1))
+        self.assertIn("Page One", reader.pages[0].extract_text())
+        self.assertEqual([page.get("/Annots") for page in reader.pages], [None] * len(reader.pages))
+
+    def test_incremental_output_appends_only_changes_to_the_template(self):
+        source = BACKEND_ROOT / "data" / "templates" / "w4-2026" / "w4-2026.pdf"
+        values = {"f1_01[0]": "Incremental", "c1_1[0]": "/1"}
+        full, incremental = io.BytesIO(), io.BytesIO()
+        fill_acroform_pdf(source, values, full, incremental=False, optimize=False)
+        fill_acroform_pdf(source, values, incremental, incremental=True, optimize=False)
+
+        template = source.read_bytes()
+        self.assertTrue(incremental.getvalue().startswith(template))
+        self.assertLess(len(incremental.getvalue()), len(full.getvalue()))
+
+        full_reader = PdfReader(io.BytesIO(full.getvalue()))
+        reader = PdfReader(io.BytesIO(incremental.getvalue()))
+        self.assertEqual(
+            [page.extract_text() for page in reader.pages],
+            [page.extract_text() for page in full_reader.pages],
+        )
+        self.assertEqual([page.get("/Annots") for page in reader.pages], [None] * len(reader.pages))
+        self.assertNotIn("/XFA", reader.trailer["/Root"]["/AcroForm"])
+        self.assertEqual(reader.trailer["/Root"]["/AcroForm"]["/Fields"], [])
+
+    def test_incremental_update_lists_its_own_xref_stream(self):
+        source = BACKEND_ROOT / "data" / "templates" / "w9-2026" / "w9-2026.pdf"
+        buffer = io.BytesIO()
+        fill_acroform_pdf(source, {"f1_01[0]": "Listed Xref"}, buffer, incremental=True, optimize=False)
+
+        data = buffer.getvalue()
+        xref_location = int(data[data.rindex(b"startxref") + len(b"startxref"):].split()[0])
+        xref_id = int(data[xref_location:].split()[0])
+        reader = PdfReader(io.BytesIO(data), strict=True)
+        self.assertEqual(reader.xref[0][xref_id], xref_location)
+        self.assertEqual(reader.get_object(xref_id)["/Type"], "/XRef")
+        self.assertIn("Listed Xref", reader.pages[0].extract_text())
+
+    def test_full_output_is_the_default(self):
+        from engines import pdf_cache
+
+        self.assertEqual(pdf_cache.PDF_OUTPUT_MODE, "full")
+        self.assertFalse(pdf_cache._incremental_output(pooled=True))
+
+    def test_pypdf_without_the_increment_internals_still_writes_incremental_output(self):
+        source = BACKEND_ROOT / "data" / "templates" / "w4-2026" / "w4-2026.pdf"
+        buffer = io.BytesIO()
+        with mock.patch("engines.pdf_compact._INCREMENT_INTERNALS", ("_missing_increment_writer",)):
+            fill_acroform_pdf(source, {"f1_01[0]": "Public Increment"}, buffer, incremental=True, optimize=True)
+
+        self.assertTrue(buffer.getvalue().startswith(source.read_bytes()))
+        reader = PdfReader(io.BytesIO(buffer.getvalue()))
+        self.assertIn("Public Increment", reader.pages[0].extract_text())
+        self.assertEqual([page.get("/Annots") for page in reader.pages], [None] * len(reader.pages))
+
+    def test_optimized_output_is_smaller_and_renders_the_same(self):
+        source = BACKEND_ROOT / "data" / "templates" / "w9-2026" / "w9-2026.pdf"
+        values = {"f1_01[0]": "Optimized Filer", "f1_02[0]": "Optimized LLC"}
+        overlays = [{"value": "Signed", "page": 0, "rect": [50, 50, 250, 80], "text_mode": True}]
+        for incremental in (False, True):
+            with self.subTest(incremental=incremental):
+                plain, optimized = io.BytesIO(), io.BytesIO()
+                fill_acroform_pdf(source, values, plain, overlays, incremental=incremental, optimize=False)
+                fill_acroform_pdf(source, values, optimized, overlays, incremental=incremental, optimize=True)
+
+                self.assertLess(len(optimized.getvalue()), len(plain.getvalue()))
+                expected = PdfReader(io.BytesIO(plain.getvalue())).pages[0].extract_text()
+                self.assertEqual(PdfReader(io.BytesIO(optimized.getvalue())).pages[0].extract_text(), expected)
+
+    def test_signature_image_is_embedded_at_box_resolution_without_temp_files(self):
+        from PIL import Image, ImageDraw
+
+        canvas = Image.new("RGBA", (1600, 400), (0, 0, 0, 0))
+        ImageDraw.Draw(canvas).line([(40, 300), (500, 60), (900, 340), (1560, 80)], fill=(20, 40, 160, 255), width=12)
+        png = io.BytesIO()
+        canvas.save(png, "PNG")
+        overlays = [{
+            "value": "data:image/png;base64," + base64.b64encode(png.getvalue()).decode(),
+            "page": 0,
+            "rect": [50, 50, 250, 90],
+        }]
+        source = BACKEND_ROOT / "data" / "templates" / "w9-2026" / "w9-2026.pdf"
+        output = io.BytesIO()
+        with mock.patch.object(tempfile, "NamedTemporaryFile", side_effect=AssertionError("temp file written")):
+            fill_acroform_pdf(source, {}, output, overlays)
+
+        xobjects = PdfReader(output).pages[0]["/Resources"]["/XObject"]
+        images = [ref.get_object() for ref in xobjects.values() if ref.get_object()["/Subtype"] == "/Image"]
+        self.assertEqual(len(images), 1)
+        image = images[0]
+        self.assertLessEqual(image["/Width"], 556)  # 200 pt at 200 dpi
+        self.assertLessEqual(image["/Height"], 112)
+        self.assertEqual(image["/ColorSpace"][0], "/Indexed")
+        self.assertIn("/SMask", image)
+
+    def test_linearized_output_leads_with_page_one_and_hints_every_page(self):
+        source = BACKEND_ROOT / "data" / "templates" / "i9-2025" / "i9-2025.pdf"
+        values = {"Last Name (Family Name)": "Linearized"}
+        plain, linearized = io.BytesIO(), io.BytesIO()
+        fill_acroform_pdf(source, values, plain, linearize=False)
+        fill_acroform_pdf(source, values, linearized, linearize=True)
+        data = linearized.getvalue()
+
+        params = {key: value for key, value in re.findall(rb"/([LONET]) (\d+)", data[:1024])}
+        hint_offset, hint_length = map(int, re.search(rb"/H \[ (\d+) (\d+) \]", data[:1024]).groups())
+        reader = PdfReader(io.BytesIO(data), strict=True)
+        self.assertIn(b"/Linearized 1", data[:1024])
+        self.assertEqual(int(params[b"L"]), len(data))
+        self.assertEqual(int(params[b"N"]), len(reader.pages))
+        self.assertEqual(reader.pages[0].indirect_reference.idnum, int(params[b"O"]))
+        self.assertIn("Linearized", reader.pages[0].extract_text())
+        self.assertEqual(
+            [page.extract_text() for page in reader.pages],
+            [page.extract_text() for page in PdfReader(io.BytesIO(plain.getvalue())).pages],
+        )
+
+        # Page offset hint table (Annex F.4.1): each page's object is where the hints say.
+        hint = data[hint_offset:hint_offset + hint_length]
+        body = hint[hint.index(b"stream") + 7:]
+        bits = "".join(f"{byte:08b}" for byte in zlib.decompressobj().decompress(body))
+        header = [int(bits[start:end], 2) for start, end in ((0, 32), (32, 64), (64, 80), (80, 112), (112, 128))]
+        min_objects, position, object_bits, min_length, length_bits = header
+        cursor = 288
+        counts, lengths = [], []
+        for items, width, base in ((counts, object_bits, min_objects), (lengths, length_bits, min_length)):
+            for _ in reader.pages:
+                items.append(base + int(bits[cursor:cursor + width] or "0", 2))
+                cursor += width
+            cursor += -cursor % 8
+        number = int(params[b"O"])
+        for index, (count, length) in enumerate(zip(counts, lengths)):
+            actual = position + (hint_length if position >= hint_offset else 0)
+            self.assertTrue(data.startswith(f"{number} 0 obj".encode(), actual), index)
+            self.assertEqual(reader.pages[index].indirect_reference.idnum, number)
+            number = 1 if index == 0 else number + count
+            position += length
+
+    def test_packet_merge_keeps_order_and_shares_resources(self):
+        templates = BACKEND_ROOT / "data" / "templates"
+        documents = []
+        for template_id, values in (("w9-2026", {"f1_01[0]": "Packet Filer"}), ("w4-2026", {"f1_01[0]": "Packet"})):
+            buffer = io.BytesIO()
+            fill_acroform_pdf(templates / template_id / f"{template_id}.pdf", values, buffer)
+            documents.append((template_id, buffer.getvalue()))
+
+        merged = merge_pdf_bytes(documents)
+        reader = PdfReader(io.BytesIO(merged))
+        page_counts = [len(PdfReader(io.BytesIO(content)).pages) for _, content in documents]
+
+        self.assertEqual(len(reader.pages), sum(page_counts))
+        self.assertEqual([item.title for item in reader.outline], ["w9-2026", "w4-2026"])
+        self.assertEqual(reader.get_destination_page_number(reader.outline[1]), page_counts[0])
+        self.assertIn("Packet Filer", reader.pages[0].extract_text())
+        self.assertLess(len(merged), sum(len(content) for _, content in documents))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,87 @@
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BACKEND_ROOT))
+
+from engines import render_cache  # noqa: E402
+from engines.executor import render_pdf_bytes  # noqa: E402
+from engines.pdf_cache import source_digest  # noqa: E402
+
+W9_PDF = BACKEND_ROOT / "data" / "templates" / "w9-2026" / "w9-2026.pdf"
+
+
+class RenderCacheTests(unittest.TestCase):
+    def setUp(self):
+        render_cache.clear_render_cache()
+        self.addCleanup(render_cache.clear_render_cache)
+
+    def test_key_ignores_value_order_but_not_values_or_template(self):
+        key = render_cache.render_key("abc", {"a": "1", "b": "2"}, [])
+
+        self.assertEqual(key, render_cache.render_key("abc", {"b": "2", "a": "1"}, None))
+        self.assertNotEqual(key, render_cache.render_key("abc", {"a": "1", "b": "3"}, []))
+        self.assertNotEqual(key, render_cache.render_key("abd", {"a": "1", "b": "2"}, []))
+
+    def test_key_depends_on_the_output_settings(self):
+        values = {"a": "1"}
+        key = render_cache.render_key("abc", values, [])
+
+        self.assertEqual(key, render_cache.render_key("abc", values, [], False, "full", False))
+        self.assertNotEqual(key, render_cache.render_key("abc", values, [], True))
+        self.assertNotEqual(key, render_cache.render_key("abc", values, [], output_mode="incremental"))
+        self.assertNotEqual(key, render_cache.render_key("abc", values, [], optimized=True))
+        self.assertNotEqual(
+            render_cache.render_key("abc", values, [], signature_dpi=200),
+            render_cache.render_key("abc", values, [], signature_dpi=300),
+        )
+
+    def test_identical_render_inputs_produce_identical_bytes(self):
+        values = {"f1_01[0]": "Cached Filer", "f1_02[0]": "Cached LLC"}
+        first = render_pdf_bytes(str(W9_PDF), values)
+        second = render_pdf_bytes(str(W9_PDF), dict(reversed(list(values.items()))))
+
+        self.assertEqual(first, second)
+
+    def test_second_lookup_is_a_hit(self):
+        key = render_cache.render_key(source_digest(W9_PDF), {"f1_01[0]": "Filer"}, [])
+        self.assertIsNone(render_cache.get_rendered(key))
+        render_cache.put_rendered(key, b"%PDF-cached")
+
+        self.assertEqual(render_cache.get_rendered(key), b"%PDF-cached")
+        stats = render_cache.render_cache_stats()
+        self.assertGreaterEqual(stats["hits"], 1)
+        self.assertGreater(stats["hit_rate"], 0)
+
+    def test_least_recently_used_entries_are_evicted_by_size(self):
+        with mock.patch.object(render_cache, "RENDER_CACHE_BYTES", 25):
+            render_cache.put_rendered("a", b"x" * 10)
+            render_cache.put_rendered("b", b"x" * 10)
+            render_cache.get_rendered("a")
+            render_cache.put_rendered("c", b"x" * 10)
+
+            self.assertIsNotNone(render_cache.get_rendered("a"))
+            self.assertIsNone(render_cache.get_rendered("b"))
+            self.assertLessEqual(render_cache.render_cache_stats()["bytes"], 25)
+
+    def test_expired_entries_are_not_served(self):
+        render_cache.put_rendered("old", b"%PDF-old")
+        with mock.patch.object(render_cache, "RENDER_CACHE_TTL_SECONDS", -1):
+            self.assertIsNone(render_cache.get_rendered("old"))
+
+    def test_disk_tier_survives_a_cleared_memory_cache(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(render_cache, "RENDER_CACHE_DIR", directory):
+            render_cache.put_rendered("ab" + "0" * 62, b"%PDF-disk")
+            render_cache.clear_render_cache()
+
+            self.assertEqual(render_cache.get_rendered("ab" + "0" * 62), b"%PDF-disk")
+            self.assertGreaterEqual(render_cache.render_cache_stats()["disk_hits"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
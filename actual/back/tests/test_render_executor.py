@@ -0,0 +1,114 @@
+import asyncio
+import sys
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BACKEND_ROOT))
+
+from engines.executor import RenderBusy, RenderExecutor, RenderTimeout, _Worker  # noqa: E402
+
+W9_PDF = BACKEND_ROOT / "data" / "templates" / "w9-2026" / "w9-2026.pdf"
+
+
+class InlineRenderExecutorTests(unittest.TestCase):
+    def test_inline_render_returns_pdf_bytes(self):
+        executor = RenderExecutor(workers=0, queue_max=1)
+        content = asyncio.run(executor.render(W9_PDF, {"f1_01[0]": "Inline Filer"}))
+
+        self.assertTrue(content.startswith(b"%PDF"))
+        self.assertEqual(executor.stats()["completed"], 1)
+        self.assertEqual(executor.stats()["pending"], 0)
+
+
+class ProcessRenderExecutorTests(unittest.TestCase):
+    def setUp(self):
+        self.executor = RenderExecutor(workers=1, queue_max=0, timeout=60, warm_paths=[str(W9_PDF)])
+        self.addCleanup(self.executor.shutdown)
+
+    def test_full_queue_is_rejected_instead_of_waiting(self):
+        first = self.executor.submit(W9_PDF, {"f1_01[0]": "First Filer"})
+        with self.assertRaises(RenderBusy) as raised:
+            self.executor.submit(W9_PDF, {"f1_01[0]": "Second Filer"})
+
+        self.assertGreater(raised.exception.retry_after, 0)
+        self.assertTrue(first.result(timeout=60).startswith(b"%PDF"))
+        self.assertEqual(self.executor.stats()["rejected"], 1)
+
+    def test_cache_stats_come_from_the_worker_processes(self):
+        asyncio.run(self.executor.render(W9_PDF, {"f1_01[0]": "Counted Filer"}))
+        stats = self.executor.cache_stats()
+
+        # Counted where the work happened: in the worker, which warmed the W-9 pool.
+        self.assertGreaterEqual(stats["pdf_sources"]["documents"], 1)
+        self.assertGreaterEqual(stats["writer_pools"]["w9-2026"]["checkouts"], 1)
+
+    def test_timed_out_render_is_reported_and_the_pool_recovers(self):
+        self.executor.timeout = 0.001
+        with self.assertRaises(RenderTimeout):
+            asyncio.run(self.executor.render(W9_PDF, {"f1_01[0]": "Slow Filer"}))
+        self.assertEqual(self.executor.stats()["timeouts"], 1)
+
+        self.executor.timeout = 60
+        content = asyncio.run(self.executor.render(W9_PDF, {"f1_01[0]": "Next Filer"}))
+        self.assertTrue(content.startswith(b"%PDF"))
+
+    def test_stopping_a_timed_out_render_does_not_block_the_event_loop(self):
+        stop = _Worker.stop
+        threads = []
+
+        def recording_stop(worker, job):
+            threads.append(threading.current_thread())
+            return stop(worker, job)
+
+        async def timed_out_render():
+            self.executor.timeout = 0.001
+            with self.assertRaises(RenderTimeout):
+                await self.executor.render(W9_PDF, {"f1_01[0]": "Slow Filer"})
+            return threading.current_thread()
+
+        with mock.patch.object(_Worker, "stop", recording_stop):
+            loop_thread = asyncio.run(timed_out_render())
+        # Stopping only signals the process; joining and respawning happen
+        # on the worker's own thread.
+        self.assertEqual(threads, [loop_thread])
+        deadline = time.monotonic() + 30
+        while self.executor.stats()["restarts"] < 1 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(self.executor.stats()["restarts"], 1)
+
+
+class WorkerIsolationTests(unittest.TestCase):
+    def setUp(self):
+        self.executor = RenderExecutor(workers=2, queue_max=2, timeout=2)
+        self.addCleanup(self.executor.shutdown)
+        self.executor.start()
+        # Warm both workers so spawning does not overlap the timed jobs.
+        asyncio.run(self._gather(self.executor._run(time.sleep, 0), self.executor._run(time.sleep, 0)))
+
+    @staticmethod
+    async def _gather(*runs):
+        return await asyncio.gather(*runs, return_exceptions=True)
+
+    def test_a_timed_out_render_does_not_fail_renders_on_other_workers(self):
+        stuck, other = asyncio.run(self._gather(self.executor._run(time.sleep, 30), self.executor._run(time.sleep, 0.2)))
+
+        self.assertIsInstance(stuck, RenderTimeout)
+        self.assertIsNone(other)
+        self.assertIsNone(asyncio.run(self.executor._run(time.sleep, 0)))
+        self.assertEqual(self.executor.stats()["timeouts"], 1)
+
+    def test_time_waiting_for_a_worker_does_not_count_against_the_timeout(self):
+        # Three 1.2 s jobs on two workers: the third waits ~1.2 s, then runs 1.2 s.
+        results = asyncio.run(self._gather(*(self.executor._run(time.sleep, 1.2) for _ in range(3))))
+
+        self.assertEqual(results, [None, None, None])
+        self.assertEqual(self.executor.stats()["timeouts"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
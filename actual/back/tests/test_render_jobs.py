@@ -0,0 +1,110 @@
+import asyncio
+import sys
+import unittest
+from pathlib import Path
+
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BACKEND_ROOT))
+
+from engines.render_jobs import DONE, FAILED, RenderJobConflict, RenderJobStore  # noqa: E402
+
+
+class RenderJobStoreTests(unittest.TestCase):
+    def test_job_runs_in_background_and_reports_progress(self):
+        store = RenderJobStore(ttl=60)
+
+        async def run(job):
+            job.advance("rendering", 0.5)
+            await asyncio.sleep(0.01)
+            return b"%PDF-job"
+
+        async def scenario():
+            job, created = store.submit("w9-2026", "fp", run)
+            self.assertTrue(created)
+            self.assertFalse(job.finished)
+            await job.task
+            return job
+
+        job = asyncio.run(scenario())
+        self.assertEqual((job.status, job.progress, job.result), (DONE, 1.0, b"%PDF-job"))
+        self.assertIs(store.get(job.job_id), job)
+
+    def test_idempotency_key_replays_the_job_and_rejects_other_payloads(self):
+        store = RenderJobStore(ttl=60)
+        renders = []
+
+        async def run(job):
+            renders.append(job.job_id)
+            return b"%PDF"
+
+        async def scenario():
+            first, _ = store.submit("w9-2026", "fp-1", run, idempotency_key="retry-me")
+            again, created = store.submit("w9-2026", "fp-1", run, idempotency_key="retry-me")
+            self.assertIs(again, first)
+            self.assertFalse(created)
+            with self.assertRaises(RenderJobConflict):
+                store.submit("w9-2026", "fp-2", run, idempotency_key="retry-me")
+            await first.task
+
+        asyncio.run(scenario())
+        self.assertEqual(len(renders), 1)
+
+    def test_idempotency_keys_are_scoped_to_principal_and_template(self):
+        store = RenderJobStore(ttl=60)
+
+        async def run(job):
+            return b"%PDF"
+
+        async def scenario():
+            mine, _ = store.submit("w9-2026", "fp-1", run, idempotency_key="k", principal="198.51.100.1")
+            theirs, created = store.submit("w9-2026", "fp-2", run, idempotency_key="k", principal="203.0.113.9")
+            self.assertTrue(created)
+            other_form, created = store.submit("w4-2026", "fp-3", run, idempotency_key="k", principal="198.51.100.1")
+            self.assertTrue(created)
+            again, created = store.submit("w9-2026", "fp-1", run, idempotency_key="k", principal="198.51.100.1")
+            self.assertFalse(created)
+            self.assertIs(again, mine)
+            await asyncio.gather(mine.task, theirs.task, other_form.task)
+            return {mine.job_id, theirs.job_id, other_form.job_id}
+
+        self.assertEqual(len(asyncio.run(scenario())), 3)
+
+    def test_failed_job_releases_its_key(self):
+        store = RenderJobStore(ttl=60)
+
+        async def failing(job):
+            raise ValueError("busy")
+
+        async def scenario():
+            failed, _ = store.submit("w9-2026", "fp", failing, idempotency_key="k")
+            await asyncio.gather(failed.task, return_exceptions=True)
+            retried, created = store.submit("w9-2026", "fp", failing, idempotency_key="k")
+            await asyncio.gather(retried.task, return_exceptions=True)
+            return failed, retried, created
+
+        failed, retried, created = asyncio.run(scenario())
+        self.assertEqual((failed.status, failed.error), (FAILED, "busy"))
+        self.assertTrue(created)
+        self.assertIsNot(retried, failed)
+
+    def test_sweeper_drops_finished_jobs_after_ttl(self):
+        store = RenderJobStore(ttl=5)
+
+        async def run(job):
+            return b"%PDF"
+
+        async def scenario():
+            job, _ = store.submit("w9-2026", "fp", run, idempotency_key="k")
+            await job.task
+            return job
+
+        job = asyncio.run(scenario())
+        self.assertEqual(store.sweep(now=job.finished_at + 1), 0)
+        self.assertEqual(store.sweep(now=job.finished_at + 6), 1)
+        self.assertIsNone(store.get(job.job_id))
+        self.assertEqual(store.stats()["held"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
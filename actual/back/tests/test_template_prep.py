@@ -0,0 +1,90 @@
+import io
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from pypdf import PdfReader, PdfWriter
+
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BACKEND_ROOT))
+
+from engines.acroform import fill_acroform_pdf  # noqa: E402
+from engines.pdf_compact import write_compact  # noqa: E402
+from engines.template_prep import build_render_copy, render_source_path  # noqa: E402
+
+TEMPLATES = BACKEND_ROOT / "data" / "templates"
+
+
+class CompactWriterTests(unittest.TestCase):
+    def test_object_streams_round_trip_smaller_than_plain_output(self):
+        reader = PdfReader(str(TEMPLATES / "w4-2026" / "w4-2026.pdf"))
+        plain, compact = io.BytesIO(), io.BytesIO()
+        PdfWriter(clone_from=reader).write(plain)
+        write_compact(PdfWriter(clone_from=reader), compact)
+
+        self.assertLess(len(compact.getvalue()), len(plain.getvalue()) // 2)
+        result = PdfReader(io.BytesIO(compact.getvalue()), strict=True)
+        self.assertTrue(result.xref_objStm)  # objects were read from object streams
+        self.assertEqual(set(result.get_fields()), set(reader.get_fields()))
+        self.assertEqual(
+            [page.extract_text() for page in result.pages],
+            [page.extract_text() for page in reader.pages],
+        )
+
+    def test_pypdf_without_the_writer_internals_gets_plain_output(self):
+        reader = PdfReader(str(TEMPLATES / "w9-2026" / "w9-2026.pdf"))
+        plain, fallback = io.BytesIO(), io.BytesIO()
+        PdfWriter(clone_from=reader).write(plain)
+        with mock.patch("engines.pdf_compact._WRITER_INTERNALS", ("_missing_writer_state",)):
+            write_compact(PdfWriter(clone_from=reader), fallback)
+
+        self.assertEqual(len(fallback.getvalue()), len(plain.getvalue()))
+        self.assertEqual(set(PdfReader(fallback).get_fields()), set(reader.get_fields()))
+
+
+class RenderCopyTests(unittest.TestCase):
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        folder = self.root / "w4-2026"
+        folder.mkdir()
+        self.pdf_path = folder / "w4-2026.pdf"
+        shutil.copyfile(TEMPLATES / "w4-2026" / "w4-2026.pdf", self.pdf_path)
+
+    def test_copy_drops_unused_parts_and_renders_the_same(self):
+        copy = build_render_copy(self.pdf_path)
+
+        self.assertEqual(render_source_path(self.pdf_path), copy)
+        self.assertLess(copy.stat().st_size, self.pdf_path.stat().st_size)
+        original, stripped = PdfReader(str(self.pdf_path)), PdfReader(str(copy))
+        self.assertIn("/XFA", original.trailer["/Root"]["/AcroForm"])
+        self.assertNotIn("/XFA", stripped.trailer["/Root"]["/AcroForm"])
+        self.assertNotIn("/Metadata", stripped.trailer["/Root"])
+        self.assertEqual(set(stripped.get_fields()), set(original.get_fields()))
+
+        values = {"f1_01[0]": "Render Copy", "c1_1[0]": "/1"}
+        expected, actual = io.BytesIO(), io.BytesIO()
+        fill_acroform_pdf(self.pdf_path, values, expected)
+        fill_acroform_pdf(copy, values, actual)
+        self.assertEqual(
+            [page.extract_text() for page in PdfReader(actual).pages],
+            [page.extract_text() for page in PdfReader(expected).pages],
+        )
+
+    def test_replaced_template_is_not_rendered_from_the_old_copy(self):
+        old_copy = build_render_copy(self.pdf_path)
+        shutil.copyfile(TEMPLATES / "w9-2026" / "w9-2026.pdf", self.pdf_path)
+
+        self.assertEqual(render_source_path(self.pdf_path), self.pdf_path)
+        new_copy = build_render_copy(self.pdf_path)
+        self.assertNotEqual(new_copy, old_copy)
+        self.assertFalse(old_copy.exists())
+        self.assertEqual(render_source_path(self.pdf_path), new_copy)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BACKEND_ROOT))
+
+from core.template_store import (  # noqa: E402
+    TemplateCatalog,
+    invalidate_template_cache,
+    load_template,
+    template_cache_stats,
+)
+
+
+def _write_template(root: Path, template_id: str, **meta) -> Path:
+    base = root / template_id
+    base.mkdir(parents=True, exist_ok=True)
+    (base / "template.json").write_text(json.dumps({"id": template_id, "pdf": "form.pdf", **meta}), encoding="utf-8")
+    (base / "schema.json").write_text(json.dumps({"fields": [{"key": "name"}]}), encoding="utf-8")
+    (base / "mapping.json").write_text(json.dumps({"name": "f1"}), encoding="utf-8")
+    (base / "form.pdf").write_bytes(b"%PDF-1.4\n")
+    return base
+
+
+class TemplateBundleCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name)
+        invalidate_template_cache()
+
+    def tearDown(self):
+        invalidate_template_cache()
+        self.directory.cleanup()
+
+    def test_repeated_loads_are_served_from_cache(self):
+        _write_template(self.root, "demo")
+        before = template_cache_stats()
+        first = load_template(self.root, "demo")
+        second = load_template(self.root, "demo")
+        after = template_cache_stats()
+
+        self.assertIs(first, second)
+        self.assertEqual(after["misses"] - before["misses"], 1)
+        self.assertEqual(after["hits"] - before["hits"], 1)
+
+    def test_changed_file_is_reloaded(self):
+        base = _write_template(self.root, "demo")
+        first = load_template(self.root, "demo")
+        schema_path = base / "schema.json"
+        schema_path.write_text(json.dumps({"fields": [{"key": "name"}, {"key": "email"}]}), encoding="utf-8")
+        stat = schema_path.stat()
+        os.utime(schema_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+        second = load_template(self.root, "demo")
+        self.assertIsNot(first, second)
+        self.assertEqual(len(second.schema["fields"]), 2)
+
+    def test_mapping_plan_follows_the_mapping_file(self):
+        base = _write_template(self.root, "demo")
+        self.assertEqual(load_template(self.root, "demo").mapping_plan.build({"name": "Ada"}), ({"f1": "Ada"}, []))
+
+        mapping_path = base / "mapping.json"
+        mapping_path.write_text(json.dumps({"name": ["f1", "f2"]}), encoding="utf-8")
+        stat = mapping_path.stat()
+        os.utime(mapping_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+        plan = load_template(self.root, "demo").mapping_plan
+        self.assertEqual(plan.build({"name": "Ada"}), ({"f1": "Ada", "f2": "Ada"}, []))
+
+    def test_malformed_mapping_fails_only_when_it_is_compiled(self):
+        base = _write_template(self.root, "demo")
+        (base / "mapping.json").write_text(json.dumps(["not", "a", "mapping"]), encoding="utf-8")
+
+        bundle = load_template(self.root, "demo")
+        self.assertEqual(bundle.schema["fields"], [{"key": "name"}])
+        with self.assertRaises(AttributeError):
+            bundle.mapping_plan
+
+    def test_transform_program_follows_the_schema_file(self):
+        base = _write_template(self.root, "demo")
+        self.assertEqual(load_template(self.root, "demo").transform_program.apply({"name": "Ada"}), {"name": "Ada"})
+
+        schema_path = base / "schema.json"
+        transforms = [{"type": "copy", "from": "name", "to": "signer"}]
+        schema_path.write_text(json.dumps({"fields": [{"key": "name"}], "transforms": transforms}), encoding="utf-8")
+        stat = schema_path.stat()
+        os.utime(schema_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+        program = load_template(self.root, "demo").transform_program
+        self.assertEqual(program.apply({"name": "Ada"}), {"name": "Ada", "signer": "Ada"})
+
+    def test_invalidation_and_unpublished_lookup(self):
+        _write_template(self.root, "draft", published=False)
+        with self.assertRaises(FileNotFoundError):
+            load_template(self.root, "draft")
+        first = load_template(self.root, "draft", include_unpublished=True)
+
+        invalidate_template_cache("draft")
+        self.assertIsNot(load_template(self.root, "draft", include_unpublished=True), first)
+
+
+class TemplateCatalogTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_catalog_filters_unpublished_and_counts_fields(self):
+        _write_template(self.root, "public", category="tax", tags=["irs"], country="US")
+        _write_template(self.root, "draft", published=False)
+        catalog = TemplateCatalog(self.root, refresh_interval=0)
+
+        self.assertEqual(catalog.ids(), ["public"])
+        self.assertEqual(catalog.ids(include_unpublished=True), ["draft", "public"])
+        entry = catalog.get("public")
+        self.assertEqual((entry.category, entry.tags, entry.country, entry.field_count), ("tax", ["irs"], "US", 1))
+        with self.assertRaises(FileNotFoundError):
+            catalog.get("draft")
+
+    def test_only_invalidated_folders_are_reparsed(self):
+        _write_template(self.root, "first", title="One")
+        _write_template(self.root, "second", title="Two")
+        catalog = TemplateCatalog(self.root, refresh_interval=0)
+        untouched = catalog.get("second")
+
+        meta_path = self.root / "first" / "template.json"
+        meta_path.write_text(json.dumps({"id": "first", "pdf": "form.pdf", "title": "Uno"}), encoding="utf-8")
+        stat = meta_path.stat()
+        os.utime(meta_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+        self.assertEqual(catalog.get("first").meta["title"], "One")
+
+        catalog.invalidate("first")
+        self.assertEqual(catalog.get("first").meta["title"], "Uno")
+        self.assertIs(catalog.get("second"), untouched)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,13 +1,126 @@
+import json
+import random
+import re
 import sys
 import unittest
+from datetime import date
 from pathlib import Path
+from unittest import mock
 
 
 BACKEND_ROOT = Path(__file__).resolve().parents[1]
 sys.path.insert(0, str(BACKEND_ROOT))
 
-from core.transforms import apply_transforms  # noqa: E402
-from core.formula import FormulaError, evaluate_formula, formula_dependencies  # noqa: E402
+from core.transforms import apply_transforms, compile_transforms  # noqa: E402
+from core import formula  # noqa: E402
+from core.formula import FormulaError, evaluate_formula, formula_cache_stats, formula_dependencies  # noqa: E402
+
+TEMPLATES = BACKEND_ROOT / "data" / "templates"
+
+KEYS = ["a", "b", "c", "status", "note"]
+VALUES = [None, "", " ", True, False, 0, 1, -2, 2.5, "0", "1", "-3", "yes", "no", "on", "single", "1,000", "x1.5",
+          [], ["a"], {"k": 1}, 10 ** 400, float("nan"), float("inf")]
+OPERATIONS = ["add", "sum", "subtract", "multiply", "divide", "percent", "pow", "mod", "min", "max", "avg", "round",
+              "abs", "negate", "unknown", None, ["add"]]
+
+
+def _random_expected(rng):
+    kind = rng.randrange(4)
+    if kind == 0:
+        return rng.choice(VALUES[:-2])
+    if kind == 1:
+        return rng.sample(VALUES[:-2], rng.randint(0, 3))
+    operators = {
+        "equals": lambda: rng.choice(VALUES), "not_equals": lambda: rng.choice(VALUES),
+        "in": lambda: rng.sample(VALUES, 2) if rng.random() < 0.8 else rng.choice(["yes", 3, None]),
+        "not_in": lambda: rng.sample(VALUES, 2), "empty": lambda: rng.choice(VALUES),
+        "truthy": lambda: rng.choice(VALUES), "gt": lambda: rng.choice(VALUES), "gte": lambda: rng.choice(VALUES),
+        "lt": lambda: rng.choice(VALUES), "lte": lambda: rng.choice(VALUES),
+    }
+    return {name: make() for name, make in rng.sample(sorted(operators.items()), rng.randint(0, 3))}
+
+
+def _random_conditions(rng):
+    roll = rng.random()
+    if roll < 0.4:
+        return None
+    if roll < 0.43:
+        return rng.choice(["", [], 1])
+    return {key: _random_expected(rng) for key in rng.sample(KEYS, rng.randint(0, 2))}
+
+
+def _random_rule(rng):
+    key = lambda: rng.choice(KEYS + ["out", ""])  # noqa: E731
+    rtype = rng.choice(["derive", "compute", "formula", "copy", "concat", "auto_date", "set_value", "other", None])
+    rule = {"type": rtype}
+    if rtype == "derive":
+        rule["set"] = {key(): rng.choice(VALUES)}
+        if rng.random() < 0.5:
+            rule["else_set"] = rng.choice([{key(): rng.choice(VALUES)}, [], None])
+    elif rtype == "compute":
+        rule.update(operation=rng.choice(OPERATIONS), output=key())
+        if rng.random() < 0.8:
+            rule["inputs"] = rng.choice([rng.sample(KEYS, rng.randint(0, 3)), "ab", 7, [["a"]]])
+        else:
+            rule["input"] = key()
+        for option in ("factor", "divisor", "percent", "exp", "mod", "precision"):
+            if rng.random() < 0.2:
+                rule[option] = rng.choice(VALUES)
+    elif rtype == "formula":
+        rule["outputs"] = rng.choice([
+            {key(): rng.choice(["a + b", "max(a, b) / 2", "ifelse(c, a, b)", "a +", 3])},
+            ["a + b"],
+        ])
+    elif rtype == "copy":
+        rule.update({"from": key(), "to": key()})
+        if rng.random() < 0.5:
+            rule["if_empty"] = rng.choice(VALUES)
+    elif rtype == "concat":
+        rule[rng.choice(["fields", "inputs"])] = rng.choice([rng.sample(KEYS, 2), "ab"])
+        rule["output"] = key()
+        for option in ("skip_empty", "separator"):
+            if rng.random() < 0.3:
+                rule[option] = rng.choice(VALUES)
+    elif rtype == "auto_date":
+        rule["field"] = key()
+        if rng.random() < 0.3:
+            rule["format"] = rng.choice(["YYYY-MM-DD", "DD.MM", 5])
+    elif rtype == "set_value":
+        rule.update(field=key(), value=rng.choice(VALUES))
+        if rng.random() < 0.5:
+            rule["else_value"] = rng.choice(VALUES)
+    for condition in ("when", "unless"):
+        conditions = _random_conditions(rng)
+        if conditions is not None:
+            rule[condition] = conditions
+    return rule if rng.random() < 0.98 else rng.choice(["derive", None])
+
+
+def _random_formula(rng, depth=0):
+    if depth > 3 or rng.random() < 0.3:
+        return rng.choice(["a", "b", "c", "sum", "true", "false", "missing", "0", "2", "2.5", "'yes'", "'1'", "None"])
+    kind = rng.randrange(5)
+    if kind == 0:
+        operator = rng.choice(["+", "-", "*", "/", "%", "^", "**"])
+        return f"({_random_formula(rng, depth + 1)} {operator} {_random_formula(rng, depth + 1)})"
+    if kind == 1:
+        operators = rng.choices(["==", "!=", ">", ">=", "<", "<="], k=rng.randint(1, 3))
+        parts = [_random_formula(rng, depth + 1) for _ in range(len(operators) + 1)]
+        return "(" + parts[0] + "".join(f" {op} {part}" for op, part in zip(operators, parts[1:])) + ")"
+    if kind == 2:
+        joiner = rng.choice([" and ", " or "])
+        return "(" + joiner.join(_random_formula(rng, depth + 1) for _ in range(rng.randint(2, 3))) + ")"
+    if kind == 3:
+        return rng.choice(["-", "+", "not "]) + _random_formula(rng, depth + 1)
+    name = rng.choice(["percent", "sum", "avg", "min", "max", "round", "abs", "floor", "ceil", "clamp", "ifelse"])
+    return f"{name}(" + ", ".join(_random_formula(rng, depth + 1) for _ in range(rng.randint(0, 3))) + ")"
+
+
+def _outcome(run):
+    try:
+        return "ok", run()
+    except Exception as exc:
+        return "error", type(exc)
 
 
 class TransformEngineTests(unittest.TestCase):
@@ -66,6 +179,146 @@ class TransformEngineTests(unittest.TestCase):
         with self.assertRaises(FormulaError):
             evaluate_formula("__import__('os').system('echo nope')", {})
 
+    def assertSameResult(self, transforms, data):
+        expected = _outcome(lambda: apply_transforms(data, transforms))
+        actual = _outcome(lambda: compile_transforms(transforms).apply(data))
+        # repr: NaN results compare unequal to themselves
+        self.assertEqual(repr(actual), repr(expected), transforms)
+        if expected[0] == "ok":
+            self.assertEqual(list(actual[1]), list(expected[1]))  # same key order
+
+    def test_compiled_transforms_match_the_interpreter(self):
+        rng = random.Random(2024)
+        for _ in range(3000):
+            transforms = [_random_rule(rng) for _ in range(rng.randint(1, 6))]
+            data = {key: rng.choice(VALUES) for key in KEYS if rng.random() < 0.7}
+            self.assertSameResult(transforms, data)
+
+    def test_compiled_transforms_match_the_interpreter_on_every_template(self):
+        rng = random.Random(99)
+        for schema_path in sorted(TEMPLATES.glob("*/schema.json")):
+            schema = json.loads(schema_path.read_text(encoding="utf-8"))
+            transforms = schema.get("transforms", [])
+            keys = [field["key"] for field in schema.get("fields", []) if field.get("key")]
+            choices = [option.get("value") for field in schema.get("fields", []) for option in field.get("options") or []]
+            with self.subTest(template=schema_path.parent.name):
+                for _ in range(100):
+                    data = {key: rng.choice(VALUES + choices) for key in keys if rng.random() < 0.7}
+                    self.assertSameResult(transforms, data)
+
+    def test_transform_list_that_is_not_a_list_fails_like_the_interpreter(self):
+        with self.assertRaises(TypeError):
+            apply_transforms({}, None)
+        program = compile_transforms(None)
+        with self.assertRaises(TypeError):
+            program.apply({})
+
+    def test_incremental_runs_match_full_runs(self):
+        rng = random.Random(7)
+        incremental_programs = 0
+        for _ in range(600):
+            transforms = [_random_rule(rng) for _ in range(rng.randint(1, 8))]
+            program = compile_transforms(transforms)
+            incremental_programs += program.incremental
+            previous, data = None, {}
+            for _ in range(8):
+                data = dict(data)
+                for key in rng.sample(KEYS, rng.randint(0, 2)):
+                    if rng.random() < 0.2:
+                        data.pop(key, None)
+                    else:
+                        data[key] = rng.choice(VALUES[:-3])
+                expected = _outcome(lambda: apply_transforms(data, transforms))
+                actual = _outcome(lambda: program.apply_incremental(data, previous))
+                if expected[0] == "error":
+                    self.assertEqual(actual, expected, transforms)
+                    previous = None
+                    continue
+                self.assertEqual(repr(sorted(actual[1].result.items())), repr(sorted(expected[1].items())), transforms)
+                previous = actual[1]
+        self.assertGreater(incremental_programs, 200)
+
+    def test_incremental_runs_rerun_only_affected_rules(self):
+        transforms = [
+            {"type": "compute", "operation": "add", "inputs": ["wages", "tips"], "output": "income"},
+            {"type": "formula", "outputs": {"tax": "round(income * rate, 2)"}},
+            {"type": "derive", "when": {"tax": {"gt": 100}}, "set": {"owes": True}, "else_set": {"owes": False}},
+            {"type": "concat", "fields": ["first", "last"], "output": "name"},
+            {"type": "copy", "from": "name", "to": "signer", "if_empty": True},
+        ]
+        program = compile_transforms(transforms)
+        self.assertTrue(program.incremental)
+        runs = []
+        for index, node in enumerate(program.nodes):
+            node.step = (lambda step, index: lambda values: (runs.append(index), step(values)))(node.step, index)
+        data = {"wages": "1000", "tips": "0", "rate": "0.2", "first": "Ada", "last": "King"}
+        first = program.apply_incremental(data)
+        self.assertEqual(runs, [0, 1, 2, 3, 4])
+
+        runs.clear()
+        second = program.apply_incremental(dict(data, last="Lovelace"), first)
+        self.assertEqual(runs, [3, 4])
+        self.assertEqual(second.result, apply_transforms(dict(data, last="Lovelace"), transforms))
+
+        # The sum is unchanged, so nothing downstream of "income" reruns.
+        runs.clear()
+        third = program.apply_incremental(dict(data, last="Lovelace", wages="999", tips="1"), second)
+        self.assertEqual(runs, [0])
+        self.assertEqual(third.result, dict(second.result, wages="999", tips="1"))
+
+        runs.clear()
+        fourth = program.apply_incremental(dict(data, last="Lovelace", rate="0.01"), second, changed={"rate"})
+        self.assertEqual(runs, [1, 2])
+        self.assertFalse(fourth.result["owes"])
+
+    def test_incremental_runs_refresh_auto_dates(self):
+        program = compile_transforms([{"type": "auto_date", "field": "signed", "format": "YYYY-MM-DD"}])
+        with mock.patch("core.transforms._date") as clock:
+            clock.today.return_value = date(2026, 1, 1)
+            first = program.apply_incremental({"name": "Ada"})
+            clock.today.return_value = date(2026, 1, 2)
+            self.assertEqual(program.apply_incremental({"name": "Ada"}, first).result["signed"], "2026-01-02")
+
+    def test_bare_function_names_are_formula_dependencies(self):
+        self.assertEqual(formula_dependencies("sum + max(a, true)"), {"sum", "a"})
+        program = compile_transforms([{"type": "formula", "outputs": {"total": "sum * 2"}}])
+        first = program.apply_incremental({"sum": "2"})
+        self.assertEqual(program.apply_incremental({"sum": "3"}, first).result["total"], "6")
+
+    def test_compiled_formulas_match_the_reference_evaluator(self):
+        rng = random.Random(11)
+        for _ in range(4000):
+            expression = _random_formula(rng)
+            values = {key: rng.choice(VALUES[:-3] + ["3", "-1.5", "$1,200"]) for key in ("a", "b", "c", "sum")}
+            expected = _outcome(lambda: formula._format(formula._eval(formula._parse(expression), values)))
+            actual = _outcome(lambda: evaluate_formula(expression, values))
+            self.assertEqual(repr(actual), repr(expected), expression)
+            if expected[0] == "error" and expected[1] is FormulaError:
+                with self.assertRaises(FormulaError) as reference:
+                    formula._eval(formula._parse(expression), values)
+                with self.assertRaisesRegex(FormulaError, re.escape(str(reference.exception))):
+                    evaluate_formula(expression, values)
+
+    def test_formulas_are_compiled_once_in_a_bounded_cache(self):
+        with mock.patch.object(formula, "FORMULA_CACHE_SIZE", 2):
+            formula._formula_cache.clear()
+            before = formula_cache_stats()
+            self.assertEqual(evaluate_formula("a + 1", {"a": 1}), "2")
+            self.assertEqual(evaluate_formula("a + 1", {"a": 2}), "3")
+            self.assertEqual(formula_dependencies("a + 1"), {"a"})
+            stats = formula_cache_stats()
+            self.assertEqual((stats["misses"] - before["misses"], stats["hits"] - before["hits"]), (1, 2))
+
+            for expression in ("b", "c"):
+                formula_dependencies(expression)
+            self.assertEqual(list(formula._formula_cache), ["b", "c"])
+            self.assertEqual(formula_cache_stats()["evictions"] - before["evictions"], 1)
+
+            for _ in range(2):  # invalid formulas are cached and fail the same way each time
+                with self.assertRaisesRegex(FormulaError, "Formula is too long"):
+                    evaluate_formula("1+" * 300 + "1", {})
+            formula._formula_cache.clear()
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -10,6 +10,11 @@ from urllib.parse import urlparse
 
 from pypdf import PdfReader
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))  # actual/back
+
+from engines.template_prep import build_render_copy  # noqa: E402
+from engines.widget_index import build_widget_index  # noqa: E402
+
 
 ALLOWED_TRANSFORMS = {"derive", "compute", "copy", "concat", "auto_date", "set_value"}
 OFFICIAL_SOURCE_HOSTS = {"irs.gov", "www.irs.gov", "uscis.gov", "www.uscis.gov"}
@@ -46,14 +51,7 @@ def _mapping_targets(rule: Any) -> Iterable[str]:
 
 
 def _widget_names(reader: PdfReader) -> set[str]:
-    names: set[str] = set()
-    for page in reader.pages:
-        for annotation_ref in page.get("/Annots", []) or []:
-            annotation = annotation_ref.get_object()
-            name = annotation.get("/T")
-            if name:
-                names.add(str(name))
-    return names
+    return {widget.partial_name for widget in build_widget_index(reader).named if widget.partial_name}
 
 
 def _transform_outputs(transforms: list[dict[str, Any]]) -> set[str]:
@@ -222,6 +220,16 @@ def audit_template(directory: Path) -> tuple[list[str], list[str], dict[str, Any
     return errors, warnings, summary
 
 
+def _render_copy_line(directory: Path) -> str:
+    meta = json.loads((directory / "template.json").read_text(encoding="utf-8"))
+    pdf_path = directory / str(meta.get("pdf", ""))
+    copy = build_render_copy(pdf_path)
+    if copy is None:
+        return "  RENDER COPY: skipped, renders use the original"
+    original, stripped = pdf_path.stat().st_size, copy.stat().st_size
+    return f"  RENDER COPY: {copy.name} {original // 1024} KB -> {stripped // 1024} KB"
+
+
 def main() -> int:
     parser = argparse.ArgumentParser(description="Audit Oky-Docky PDF template bundles.")
     parser.add_argument(
@@ -230,6 +238,11 @@ def main() -> int:
         type=Path,
         default=Path("actual/back/data/templates"),
     )
+    parser.add_argument(
+        "--build-render-copies",
+        action="store_true",
+        help="write the stripped render copy (.render/) of every template that passes",
+    )
     args = parser.parse_args()
 
     failed = False
@@ -241,6 +254,8 @@ def main() -> int:
             print(f"  WARN: {warning}")
         for error in errors:
             print(f"  ERROR: {error}")
+        if args.build_render_copies and not errors:
+            print(_render_copy_line(directory))
         failed = failed or bool(errors)
     return 1 if failed else 0
 
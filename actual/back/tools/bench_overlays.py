@@ -0,0 +1,78 @@
+"""
+Benchmark overlay stamping: every checkbox on a template is ticked and a
+typed signature is added, then the number of stamps is compared with the
+number of PageObject.merge_page calls the render actually performed.
+
+    python actual/back/tools/bench_overlays.py [template_id ...]
+"""
+from __future__ import annotations
+
+import io
+import sys
+import time
+from pathlib import Path
+
+from pypdf import PdfReader
+from pypdf._page import PageObject
+
+ROOT = Path(__file__).resolve().parents[1]  # actual/back
+sys.path.insert(0, str(ROOT))
+
+from engines.acroform import fill_acroform_pdf  # noqa: E402
+
+TEMPLATES = ROOT / "data" / "templates"
+
+
+def _all_buttons_on(pdf_path: Path) -> dict[str, str]:
+    values: dict[str, str] = {}
+    for name, field in (PdfReader(str(pdf_path)).get_fields() or {}).items():
+        if field.get("/FT") != "/Btn":
+            continue
+        states = [state for state in field.get("/_States_", []) if state != "/Off"]
+        if states:
+            values[name] = states[0]
+    return values
+
+
+def bench(template_id: str, runs: int = 3) -> None:
+    pdf_path = next((TEMPLATES / template_id).glob("*.pdf"))
+    values = _all_buttons_on(pdf_path)
+    overlays = [{"value": "Test Signer", "page": 0, "rect": [72, 72, 272, 96], "text_mode": True}]
+
+    merges = 0
+    original_merge = PageObject.merge_page
+
+    def counting_merge(self, *args, **kwargs):
+        nonlocal merges
+        merges += 1
+        return original_merge(self, *args, **kwargs)
+
+    PageObject.merge_page = counting_merge
+    try:
+        fill_acroform_pdf(pdf_path, values, io.BytesIO(), overlays)  # warm caches
+        merges = 0
+        started = time.perf_counter()
+        for _ in range(runs):
+            fill_acroform_pdf(pdf_path, values, io.BytesIO(), overlays)
+        elapsed = (time.perf_counter() - started) / runs
+    finally:
+        PageObject.merge_page = original_merge
+
+    # One stamp per ticked checkbox plus the signature; the previous engine
+    # merged one overlay document per stamp.
+    stamps = len(values) + len(overlays)
+    print(
+        f"{template_id}: {stamps} stamps -> {merges // runs} merge_page calls "
+        f"(was {stamps}), {elapsed * 1000:.0f} ms/render"
+    )
+
+
+def main() -> int:
+    template_ids = sys.argv[1:] or ["w9-2026", "w4-2026", "f14039-2026"]
+    for template_id in template_ids:
+        bench(template_id)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""
+Byte-compare the text appearance streams of the fast engine
+(engines/appearance.py) with pypdf's TextStreamAppearance for every text
+widget of every template, and time a render of all text fields both ways.
+
+    python actual/back/tools/compare_appearances.py [template_id ...]
+
+Exits non-zero if any appearance stream differs.
+"""
+from __future__ import annotations
+
+import io
+import logging
+import sys
+import time
+from pathlib import Path
+from unittest import mock
+
+from pypdf import PdfReader
+
+ROOT = Path(__file__).resolve().parents[1]  # actual/back
+sys.path.insert(0, str(ROOT))
+
+from engines.acroform import fill_acroform_pdf  # noqa: E402
+from engines.appearance import compare_with_pypdf  # noqa: E402
+
+TEMPLATES = ROOT / "data" / "templates"
+
+
+def _render_ms(pdf_path: Path, values: dict[str, str], runs: int = 3) -> float:
+    fill_acroform_pdf(pdf_path, values, io.BytesIO())  # warm caches
+    started = time.perf_counter()
+    for _ in range(runs):
+        fill_acroform_pdf(pdf_path, values, io.BytesIO())
+    return (time.perf_counter() - started) / runs * 1000
+
+
+def compare(template_id: str) -> int:
+    pdf_path = next((TEMPLATES / template_id).glob("*.pdf"))
+    mismatches = compare_with_pypdf(pdf_path)
+    for mismatch in mismatches:
+        print(f"  MISMATCH {mismatch}")
+
+    fields = PdfReader(str(pdf_path)).get_fields() or {}
+    values = {name: f"Value {i}" for i, (name, field) in enumerate(fields.items()) if field.get("/FT") == "/Tx"}
+    fast = _render_ms(pdf_path, values)
+    # With no text values handled by the engine, everything takes the pypdf path.
+    with mock.patch("engines.acroform.fill_text_appearances", side_effect=lambda writer, source, v: dict(v)):
+        slow = _render_ms(pdf_path, values)
+    print(f"{template_id}: {len(mismatches)} mismatches, {len(values)} text fields, "
+          f"{slow:.0f} ms -> {fast:.0f} ms/render")
+    return len(mismatches)
+
+
+def main() -> int:
+    logging.getLogger("pypdf").setLevel(logging.ERROR)
+    template_ids = sys.argv[1:] or sorted(path.name for path in TEMPLATES.iterdir() if path.is_dir())
+    failures = sum(compare(template_id) for template_id in template_ids)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
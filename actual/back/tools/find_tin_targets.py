@@ -1,36 +1,20 @@
+import sys
 from pathlib import Path
 from pypdf import PdfReader
-from pypdf.generic import IndirectObject
 
-def deref(obj):
-    return obj.get_object() if isinstance(obj, IndirectObject) else obj
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))  # actual/back
+
+from engines.widget_index import build_widget_index  # noqa: E402
 
 PDF = "actual/back/data/templates/w9-2026/w9-2026.pdf"
 r = PdfReader(PDF)
 
 # найдём ВСЕ текстовые виджеты (/Tx) и посмотрим, какие похожи на TIN
-tx = []
-for pi, page in enumerate(r.pages):
-    annots = deref(page.get("/Annots")) or []
-    for a in annots:
-        annot = deref(a)
-        if not isinstance(annot, dict) or annot.get("/Subtype") != "/Widget":
-            continue
-
-        parent = deref(annot.get("/Parent"))
-        FT = annot.get("/FT") or (parent.get("/FT") if isinstance(parent, dict) else None)
-        if FT != "/Tx":
-            continue
-
-        T = annot.get("/T")
-        if T is None and isinstance(parent, dict):
-            T = parent.get("/T")
-
-        if not T:
-            continue
-
-        name = str(T)
-        tx.append((pi + 1, name))
+tx = [
+    (widget.page + 1, widget.short_name)
+    for widget in build_widget_index(r).widgets
+    if widget.field_type == "/Tx" and widget.short_name
+]
 
 print("TX widgets:", len(tx))
 for p, name in tx:
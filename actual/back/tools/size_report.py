@@ -0,0 +1,76 @@
+"""
+Report the size and render time of every template's output in each output
+mode: full or incremental (PDF_OUTPUT_MODE), with and without the optimizer
+(PDF_OPTIMIZE_OUTPUT).
+
+    python actual/back/tools/size_report.py [template_id ...]
+
+Every third text field is filled, every other checkbox is checked and one
+typed signature overlay is stamped, roughly what a completed form holds.
+"""
+from __future__ import annotations
+
+import io
+import logging
+import sys
+import time
+from pathlib import Path
+
+from pypdf import PdfReader
+
+ROOT = Path(__file__).resolve().parents[1]  # actual/back
+sys.path.insert(0, str(ROOT))
+
+from engines.acroform import fill_acroform_pdf  # noqa: E402
+
+TEMPLATES = ROOT / "data" / "templates"
+MODES = [
+    ("full", False, False),
+    ("full+opt", False, True),
+    ("incr", True, False),
+    ("incr+opt", True, True),
+]
+OVERLAYS = [{"value": "Jane Sample", "page": 0, "rect": [50, 50, 250, 80], "text_mode": True}]
+
+
+def _sample_values(pdf_path: Path) -> dict[str, str]:
+    values = {}
+    fields = PdfReader(str(pdf_path)).get_fields() or {}
+    for i, (name, field) in enumerate(fields.items()):
+        if field.get("/FT") == "/Tx" and i % 3 == 0:
+            values[name] = f"Value {i}"
+        elif field.get("/FT") == "/Btn" and i % 2 == 0:
+            states = [state for state in field.get("/_States_", []) if state != "/Off"]
+            if states:
+                values[name] = states[0]
+    return values
+
+
+def _measure(pdf_path: Path, values: dict[str, str], incremental: bool, optimize: bool) -> tuple[int, float]:
+    fill_acroform_pdf(pdf_path, values, io.BytesIO(), OVERLAYS, incremental=incremental, optimize=optimize)
+    started = time.perf_counter()
+    buffer = io.BytesIO()
+    fill_acroform_pdf(pdf_path, values, buffer, OVERLAYS, incremental=incremental, optimize=optimize)
+    return len(buffer.getvalue()), (time.perf_counter() - started) * 1000
+
+
+def report(template_id: str) -> None:
+    pdf_path = next((TEMPLATES / template_id).glob("*.pdf"))
+    values = _sample_values(pdf_path)
+    cells = []
+    for label, incremental, optimize in MODES:
+        size, ms = _measure(pdf_path, values, incremental, optimize)
+        cells.append(f"{label} {size / 1024:7.0f} KB {ms:5.0f} ms")
+    print(f"{template_id:<22} template {pdf_path.stat().st_size / 1024:6.0f} KB | " + " | ".join(cells))
+
+
+def main() -> int:
+    logging.getLogger("pypdf").setLevel(logging.ERROR)
+    template_ids = sys.argv[1:] or sorted(path.name for path in TEMPLATES.iterdir() if path.is_dir())
+    for template_id in template_ids:
+        report(template_id)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())